@@ -11,6 +11,7 @@ from panda3d.core import Loader as PandaLoader
 from direct.showbase.DirectObject import DirectObject
 from direct.showbase.Loader import Loader
 from direct.directnotify import DirectNotifyGlobal
+from .AnimBundleCache import AnimBundleCache
 
 
 class Actor(DirectObject, NodePath):
@@ -32,6 +33,13 @@ class Actor(DirectObject, NodePath):
     mergeLODBundles = ConfigVariableBool('merge-lod-bundles', True)
     allowAsyncBind = ConfigVariableBool('allow-async-bind', True)
 
+    # AnimBundles loaded by prefetchAnims(), shared by all Actors.
+    animBundleCache = AnimBundleCache(
+        ConfigVariableInt('actor-anim-cache-size', 64,
+            "Maximum number of prefetched animations kept for sharing "
+            "between Actors, or 0 for no limit.").getValue(),
+        animLoaderOptions)
+
     class PartDef:
 
         """Instances of this class are stored within the
@@ -2310,6 +2318,81 @@ class Actor(DirectObject, NodePath):
                              lodName = lodName,
                              allowAsyncBind = allowAsyncBind)
 
+    def prefetchAnims(self, animNames = None, partName = None, lodName = None,
+                      priority = None, callback = None, extraArgs = []):
+        """
+        Loads the named animations in the background, and binds them to
+        the named part and/or lod as they come in, so that playing them
+        later doesn't hold up the render while they load.  If animNames,
+        partName or lodName is None, it means all of them.
+
+        The loaded AnimBundles are kept in Actor.animBundleCache and shared
+        with every other Actor that plays the same files.  priority is
+        passed on to the loader, to load the more important animations
+        first.  Once they are all bound, callback is called with extraArgs.
+        Returns the number of files that had to be requested.
+        """
+        if self.mergeLODBundles:
+            lodNames = ['common']
+        elif lodName is None:
+            lodNames = list(self.__animControlDict.keys())
+        else:
+            lodNames = [lodName]
+
+        if isinstance(animNames, str):
+            animNames = [animNames]
+
+        # filename -> list of (lodName, partName, animName) to bind it to
+        filenames = {}
+        for lName in lodNames:
+            partDict = self.__animControlDict.get(lName, {})
+            if partName is None:
+                partNames = list(partDict.keys())
+            else:
+                partNames = [partName]
+            for pName in partNames:
+                animDict = partDict.get(pName, {})
+                if animNames is None:
+                    names = list(animDict.keys())
+                else:
+                    names = animNames
+                for animName in names:
+                    anim = animDict.get(animName)
+                    if anim is None or anim.animControl or anim.animBundle or \
+                       not anim.filename:
+                        continue
+                    filenames.setdefault(str(anim.filename), []).append(
+                        (lName, pName, animName))
+
+        if not filenames:
+            if callback:
+                callback(*extraArgs)
+            return 0
+
+        remaining = [len(filenames)]
+        def gotBundle(bundle, filename, binds):
+            if bundle is not None:
+                for lName, pName, animName in binds:
+                    # The Actor may have been cleaned up, or the anim
+                    # reloaded, while it was loading.
+                    anim = self.__animControlDict.get(lName, {}).get(pName, {}).get(animName)
+                    if anim is None or anim.animControl or \
+                       str(anim.filename) != filename:
+                        continue
+                    anim.animBundle = bundle
+                    self.__bindAnimToPart(animName, pName, lName)
+            remaining[0] -= 1
+            if remaining[0] == 0 and callback:
+                callback(*extraArgs)
+
+        for filename, binds in filenames.items():
+            Actor.animBundleCache.requestBundle(
+                filename,
+                lambda bundle, filename=filename, binds=binds: gotBundle(bundle, filename, binds),
+                priority = priority)
+
+        return len(filenames)
+
     def bindAllAnims(self, allowAsyncBind = False):
         """Loads and binds all animations that have been defined for
         the Actor. """
@@ -2367,6 +2450,10 @@ class Actor(DirectObject, NodePath):
         else:
             bundle = self.__partBundleDict[lodName][subpartDef.truePartName].getBundle()
 
+        if not anim.animBundle and anim.filename:
+            # Another Actor may have prefetched it already.
+            anim.animBundle = Actor.animBundleCache.getBundle(anim.filename)
+
         if anim.animBundle:
             # We already have a bundle; just bind it.
             animControl = bundle.bindAnim(anim.animBundle, -1, subpartDef.subset)
@@ -2596,6 +2683,7 @@ class Actor(DirectObject, NodePath):
     get_current_frame = getCurrentFrame
     set_play_rate = setPlayRate
     bind_all_anims = bindAllAnims
+    prefetch_anims = prefetchAnims
     unload_anims = unloadAnims
     remove_part = removePart
     use_lod = useLOD
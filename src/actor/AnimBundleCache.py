@@ -0,0 +1,135 @@
+"""Contains the AnimBundleCache class, which shares loaded animations
+between all of the Actors."""
+
+__all__ = ['AnimBundleCache']
+
+from panda3d.core import LoaderOptions, AnimBundleNode
+from direct.directnotify import DirectNotifyGlobal
+from collections import OrderedDict
+
+class AnimBundleCache:
+    """
+    Keeps the AnimBundles of animation files loaded by Actor.prefetchAnims(),
+    by filename, so that every Actor playing the same animation shares one
+    copy of it and only the first of them has to wait for it to load.
+
+    The cache holds at most maxSize bundles, or any number if maxSize is 0.
+    When it is full, the least recently used bundle that no Actor has bound
+    is evicted; if all of them are bound, the least recently used one is.
+    An evicted bundle stays in memory for as long as the Actors that bound
+    it keep it, but will be loaded again by the next Actor that needs it.
+
+    Files are loaded in the background by the ShowBase loader, bypassing the
+    ModelPool so that this cache is the only one that keeps them, and a file
+    that is already being loaded for one Actor isn't loaded again for
+    another.
+    """
+
+    notify = DirectNotifyGlobal.directNotify.newCategory("AnimBundleCache")
+
+    def __init__(self, maxSize, loaderOptions):
+        self.maxSize = maxSize
+        self.loaderOptions = LoaderOptions(loaderOptions)
+        self.loaderOptions.setFlags(loaderOptions.getFlags() | LoaderOptions.LFNoRamCache)
+
+        # filename -> AnimBundle, least recently used first
+        self.__bundles = OrderedDict()
+        # filename -> list of callbacks waiting on the file to load
+        self.__pending = {}
+
+        self.numHits = 0
+        self.numMisses = 0
+        self.numEvictions = 0
+
+    def getMaxSize(self):
+        return self.maxSize
+
+    def setMaxSize(self, maxSize):
+        self.maxSize = maxSize
+        self.__evict()
+
+    def getNumBundles(self):
+        return len(self.__bundles)
+
+    def hasBundle(self, filename):
+        return str(filename) in self.__bundles
+
+    def getBundle(self, filename):
+        """Returns the cached AnimBundle of the file, or None if it isn't
+        cached, and marks it as recently used."""
+        filename = str(filename)
+        bundle = self.__bundles.get(filename)
+        if bundle is None:
+            self.numMisses += 1
+            return None
+        self.numHits += 1
+        self.__bundles.move_to_end(filename)
+        return bundle
+
+    def addBundle(self, filename, bundle):
+        filename = str(filename)
+        self.__bundles[filename] = bundle
+        self.__bundles.move_to_end(filename)
+        self.__evict()
+
+    def removeBundle(self, filename):
+        self.__bundles.pop(str(filename), None)
+
+    def clear(self):
+        self.__bundles.clear()
+
+    def isPending(self, filename):
+        return str(filename) in self.__pending
+
+    def requestBundle(self, filename, callback, priority = None):
+        """Calls callback with the AnimBundle of the file, or None if it
+        couldn't be loaded.  If the bundle is cached, this happens right
+        away, otherwise once it has been loaded in the background."""
+        filename = str(filename)
+        bundle = self.getBundle(filename)
+        if bundle is not None:
+            callback(bundle)
+            return
+
+        waiting = self.__pending.get(filename)
+        if waiting is not None:
+            waiting.append(callback)
+            return
+
+        self.__pending[filename] = [callback]
+        base.loader.loadModel(filename, loaderOptions = self.loaderOptions,
+                              callback = self.__gotAnim, extraArgs = [filename],
+                              priority = priority)
+
+    def __gotAnim(self, model, filename):
+        bundle = None
+        if model is not None and not model.isEmpty():
+            if model.node().isOfType(AnimBundleNode.getClassType()):
+                bundleNP = model
+            else:
+                bundleNP = model.find('**/+AnimBundleNode')
+            if not bundleNP.isEmpty():
+                bundle = bundleNP.node().getBundle()
+
+        if bundle is None:
+            self.notify.warning("couldn't load animation %s" % (filename))
+        else:
+            self.addBundle(filename, bundle)
+
+        for callback in self.__pending.pop(filename, []):
+            callback(bundle)
+
+    def __evict(self):
+        if self.maxSize <= 0:
+            return
+        while len(self.__bundles) > self.maxSize:
+            victim = None
+            for filename, bundle in self.__bundles.items():
+                # The only reference is ours, so no Actor has it bound.
+                if bundle.getRefCount() <= 1:
+                    victim = filename
+                    break
+            if victim is None:
+                victim = next(iter(self.__bundles))
+            del self.__bundles[victim]
+            self.numEvictions += 1
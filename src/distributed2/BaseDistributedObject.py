@@ -8,6 +8,22 @@ from .DOState import DOState
 class BaseDistributedObject(DirectObject):
     notify = directNotify.newCategory("BaseDistributedObject")
 
+    # Objects are updated in order of phase, lowest first.  All objects in
+    # a phase are done updating before the next phase starts.
+    updatePhase = 0
+    # Set to True if update() spends most of its time in code that releases
+    # the GIL, so it may run on a worker thread alongside other objects in
+    # the same phase.
+    updateThreaded = False
+
+    # Name of the ownsend DC method field that carries the object's user
+    # commands, or None if the object doesn't take commands.  The owner view
+    # builds a command each tick in createCommand(), runs it right away
+    # through the field's method, and sends it to the server, which runs the
+    # same method on its tick.  The method must be deterministic so both
+    # sides arrive at the same state.
+    commandField = None
+
     """
     DO lifetime
 
@@ -47,6 +63,21 @@ class BaseDistributedObject(DirectObject):
         self.doState = DOState.Fresh
         # Set of tasks that have been created on this object.
         self._tasks = {}
+        # True if update() should not be called each tick.
+        self._asleep = False
+
+    def sleep(self):
+        """
+        Stops update() being called each tick, for objects that have nothing
+        to simulate until something wakes them up.
+        """
+        self._asleep = True
+
+    def wake(self):
+        self._asleep = False
+
+    def isAsleep(self):
+        return self._asleep
 
     def isGenerated(self):
         return self.doState >= DOState.Generated
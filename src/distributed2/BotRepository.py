@@ -0,0 +1,102 @@
+from direct.directnotify.DirectNotifyGlobal import directNotify
+
+from .ClientRepository import ClientRepository
+
+from collections import deque
+import random
+
+class BotRepository(ClientRepository):
+    """
+    A headless synthetic client used to put load on a server.  Many of these
+    can run in one process; see LoadGenerator.
+
+    Once verified, the bot follows a simple script: every
+    `interestChangeInterval` seconds it replaces its interest with a random
+    `numInterestZones` of `interestZones`, and it sends `updatesPerSecond`
+    object messages produced by `makeUpdate`.  Subclasses can override
+    botTick() for anything more involved.
+    """
+
+    notify = directNotify.newCategory("BotRepository")
+
+    def __init__(self, botId, updateRate = None, cmdRate = None,
+                 interestZones = [], numInterestZones = 1,
+                 interestChangeInterval = 0.0, updatesPerSecond = 0.0,
+                 makeUpdate = None, latencyHistory = 256):
+        ClientRepository.__init__(self)
+        self.botId = botId
+        self.runFrameTaskName = "botRunFrame-%i" % botId
+
+        self.wantUpdateRate = updateRate
+        self.wantCMDRate = cmdRate
+        self.interestZones = list(interestZones)
+        self.numInterestZones = numInterestZones
+        self.interestChangeInterval = interestChangeInterval
+        self.updatesPerSecond = updatesPerSecond
+        # Called with the bot, returns a (do, fieldName, args) tuple to send,
+        # or None to skip.
+        self.makeUpdate = makeUpdate
+
+        self.verified = False
+        self.failed = False
+        self.nextInterestChange = 0.0
+        self.updateBudget = 0.0
+
+        self.snapshotsReceived = 0
+        # Smallest difference seen between a snapshot's arrival time and its
+        # server tick time.  Latency is reported relative to this, since the
+        # two clocks are not synchronized.
+        self.minSnapshotOffset = None
+        self.snapshotLatencies = deque(maxlen = latencyHistory)
+
+    def handleConnectSuccess(self):
+        self.sendHello()
+
+    def handleConnectFailure(self):
+        self.failed = True
+
+    def handleHelloSuccess(self):
+        self.verified = True
+        if self.wantUpdateRate is not None:
+            self.setUpdateRate(self.wantUpdateRate)
+        if self.wantCMDRate is not None:
+            self.setCMDRate(self.wantCMDRate)
+
+    def handleInterestComplete(self, handle):
+        pass
+
+    def unpackServerSnapshot(self, dgi, tick = -1):
+        self.recordSnapshot(self.serverTickCount)
+        return ClientRepository.unpackServerSnapshot(self, dgi, tick)
+
+    def recordSnapshot(self, tickCount):
+        self.snapshotsReceived += 1
+        offset = globalClock.getRealTime() - tickCount * self.serverIntervalPerTick
+        if self.minSnapshotOffset is None or offset < self.minSnapshotOffset:
+            self.minSnapshotOffset = offset
+        self.snapshotLatencies.append(offset - self.minSnapshotOffset)
+
+    def runFrame(self, task):
+        ClientRepository.runFrame(self, task)
+        if self.verified:
+            self.botTick()
+        return task.cont
+
+    def botTick(self):
+        """ Runs the bot's script.  Called once per sim tick once verified. """
+        now = globalClock.getFrameTime()
+
+        if self.interestZones and self.interestChangeInterval > 0 and \
+            now >= self.nextInterestChange:
+            count = min(self.numInterestZones, len(self.interestZones))
+            self.setInterest(random.sample(self.interestZones, count))
+            self.nextInterestChange = now + self.interestChangeInterval
+
+        if self.makeUpdate and self.updatesPerSecond > 0:
+            self.updateBudget += self.updatesPerSecond * self.serverIntervalPerTick
+            while self.updateBudget >= 1.0:
+                self.updateBudget -= 1.0
+                update = self.makeUpdate(self)
+                if update:
+                    do, name, args = update
+                    self.sendUpdate(do, name, args)
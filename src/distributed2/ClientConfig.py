@@ -1,4 +1,10 @@
-from panda3d.core import ConfigVariableInt
+from panda3d.core import ConfigVariableInt, ConfigVariableDouble
 
 cl_cmdrate = ConfigVariableInt("cl_cmdrate", 30)
 cl_updaterate = ConfigVariableInt("cl_updaterate", 20)
+# Number of worker threads that run the updates of objects marked
+# updateThreaded.  0 runs every object update on the main thread.
+cl_sim_threads = ConfigVariableInt("cl_sim_threads", 0)
+# How far behind the newest snapshot, in seconds, fields marked "interp" are
+# rendered.  Should cover at least two snapshot intervals.
+cl_interp = ConfigVariableDouble("cl_interp", 0.1)
@@ -3,6 +3,7 @@ from panda3d.core import URLSpec, NetAddress
 from panda3d.direct import CClientRepository, DCPacker
 
 from direct.distributed.PyDatagram import PyDatagram
+from direct.distributed.PyDatagramIterator import PyDatagramIterator
 from direct.showbase.DirectObject import DirectObject
 from direct.directnotify.DirectNotifyGlobal import directNotify
 
@@ -10,6 +11,7 @@ from .BaseObjectManager import BaseObjectManager
 from .ClientConfig import *
 from .NetMessages import NetMessages
 from .DOState import DOState
+from .ObjectScheduler import ObjectScheduler
 
 class ClientRepository(BaseObjectManager, CClientRepository):
     notify = directNotify.newCategory("ClientRepository")
@@ -33,29 +35,155 @@ class ClientRepository(BaseObjectManager, CClientRepository):
         self.serverIntervalPerTick = 0
         self.interestHandle = 0
 
+        # Name of the sim task that runs this repository.  Must be unique if
+        # several repositories run in one process.
+        self.runFrameTaskName = "clientRunFrame"
+
+        # Running totals of datagram bytes received from and sent to the
+        # server.
+        self.bytesReceived = 0
+        self.bytesSent = 0
+
+        self.objectScheduler = ObjectScheduler("clientSimObjects", cl_sim_threads.getValue())
+
+        # Owner views that take user commands, by doId.
+        self.commandObjects = {}
+        self.nextCommandTime = 0.0
+
+        # The snapshot and command rates we asked the server for.  Changed
+        # with setUpdateRate() and setCMDRate().
+        self.updateRate = cl_updaterate.getValue()
+        self.cmdRate = cl_cmdrate.getValue()
+
+        # Real time at which the newest snapshot arrived, used to place the
+        # render time for interpolation between snapshots.
+        self.lastSnapshotTime = 0.0
+
     def simObjects(self):
-        for do in self.doId2do.values():
-            do.update()
+        self.objectScheduler.runUpdates(self.doId2do.values())
 
     def runFrame(self, task):
         self.readerPollUntilEmpty()
         self.runCallbacks()
 
+        self.createUserCommands()
         self.simObjects()
+        self.sendUserCommands()
+
+        return task.cont
 
+    def getRenderTick(self):
+        """
+        Returns the fractional server tick that interpolated fields should
+        show right now.  This trails the newest snapshot by cl_interp seconds
+        so there are normally two snapshots to interpolate between.
+        """
+        if not self.serverIntervalPerTick:
+            return float(self.serverTickCount)
+        elapsed = globalClock.getRealTime() - self.lastSnapshotTime
+        return self.serverTickCount + (elapsed - cl_interp.getValue()) / self.serverIntervalPerTick
+
+    def interpolateObjects(self, task):
+        self.interpolate(self.getRenderTick())
         return task.cont
 
     def startClientLoop(self):
-        base.simTaskMgr.add(self.runFrame, "clientRunFrame", sort = -100)
+        base.simTaskMgr.add(self.runFrame, self.runFrameTaskName, sort = -100)
+        # Interpolation runs every rendered frame rather than every sim tick.
+        base.taskMgr.add(self.interpolateObjects, self.runFrameTaskName + "-interpolate",
+                         sort = -100)
 
     def stopClientLoop(self):
-        base.simTaskMgr.remove("clientRunFrame")
+        base.simTaskMgr.remove(self.runFrameTaskName)
+        base.taskMgr.remove(self.runFrameTaskName + "-interpolate")
+
+    def createUserCommands(self):
+        """
+        Builds this tick's user command for each owner view that takes them,
+        and runs it right away so the owner sees its effect without waiting
+        for the server.
+        """
+        for do in self.commandObjects.values():
+            args = do.createCommand()
+            if args is None:
+                continue
+
+            field = do.dclass.getFieldByName(do.commandField)
+            if not field:
+                self.notify.warning("Unknown command field %s on %s" %
+                                    (do.commandField, do.dclass.getName()))
+                continue
+
+            packer = DCPacker()
+            packer.beginPack(field)
+            field.packArgs(packer, args)
+            if not packer.endPack():
+                self.notify.warning("Failed to pack user command for doId %i" % do.doId)
+                continue
+
+            do.commandNumber += 1
+            do.pendingCommands.append((do.commandNumber, args))
+            do.unsentCommands.append((do.commandNumber, packer.getBytes()))
+            do.runCommand(args)
+
+    def sendUserCommands(self):
+        """ Sends the queued user commands, at most cmdRate times a second. """
+        if not self.commandObjects:
+            return
+
+        now = globalClock.getFrameTime()
+        if now < self.nextCommandTime:
+            return
+        self.nextCommandTime = now + 1.0 / max(1, self.cmdRate)
+
+        for do in self.commandObjects.values():
+            while do.unsentCommands:
+                commands = do.unsentCommands[:255]
+                del do.unsentCommands[:255]
+
+                dg = PyDatagram()
+                dg.addUint16(NetMessages.CL_UserCommands)
+                dg.addUint32(do.doId)
+                dg.addUint8(len(commands))
+                for commandNumber, data in commands:
+                    dg.addUint32(commandNumber)
+                    dg.addBlob(data)
+                self.sendDatagram(dg)
+
+    def __handleCommandAck(self, dgi):
+        doId = dgi.getUint32()
+        commandNumber = dgi.getUint32()
+        tick = dgi.getUint32()
+        do = self.commandObjects.get(doId)
+        if do and tick > self.serverTickCount:
+            # Acks come bundled with the snapshot of their tick, and are
+            # dropped along with it if it's stale.
+            do.commandAcks.append((tick, commandNumber))
+
+    def reconcileUserCommands(self, tick):
+        """
+        Called after a snapshot has been applied onto the owner views.  Drops
+        the commands the server had run by that tick and runs the rest again
+        on top of the server's state.  If tick is None, the snapshot was not
+        fully applied, and only the commands are run again.
+        """
+        for do in self.commandObjects.values():
+            if tick is not None:
+                while do.commandAcks and do.commandAcks[0][0] <= tick:
+                    do.ackedCommand = do.commandAcks.popleft()[1]
+                while do.pendingCommands and do.pendingCommands[0][0] <= do.ackedCommand:
+                    do.pendingCommands.popleft()
+                do.saveAuthoritativeState()
+
+            for _, args in do.pendingCommands:
+                do.runCommand(args)
 
     def getNextInterestHandle(self):
         return (self.interestHandle + 1) % 256
 
     # Change the rate at which we receive state snapshots from the server.
     def setUpdateRate(self, rate):
+        self.updateRate = rate
         dg = PyDatagram()
         dg.addUint16(NetMessages.CL_SetUpdateRate)
         dg.addUint8(rate)
@@ -63,6 +191,7 @@ class ClientRepository(BaseObjectManager, CClientRepository):
 
     # Change the rate at which we send commands to the server.
     def setCMDRate(self, rate):
+        self.cmdRate = rate
         dg = PyDatagram()
         dg.addUint16(NetMessages.CL_SetCMDRate)
         dg.addUint8(rate)
@@ -112,6 +241,10 @@ class ClientRepository(BaseObjectManager, CClientRepository):
 
     def __handleInterestComplete(self, dgi):
         handle = dgi.getUint8()
+        self.handleInterestComplete(handle)
+
+    def handleInterestComplete(self, handle):
+        """ Called when the server has completed an interest operation. """
         messenger.send('interestComplete', [handle])
 
     def sendHello(self, password = ""):
@@ -120,8 +253,8 @@ class ClientRepository(BaseObjectManager, CClientRepository):
         dg.addString(password)
         # DC hash verification
         dg.addUint32(self.hashVal)
-        dg.addUint8(cl_updaterate.getValue())
-        dg.addUint8(cl_cmdrate.getValue())
+        dg.addUint8(self.updateRate)
+        dg.addUint8(self.cmdRate)
         self.sendDatagram(dg)
 
     def __handleServerHelloResp(self, dgi):
@@ -135,18 +268,45 @@ class ClientRepository(BaseObjectManager, CClientRepository):
             base.setTickRate(self.serverTickRate)
 
             self.notify.info("Verified with server")
-            messenger.send('serverHelloSuccess')
+            self.handleHelloSuccess()
         else:
             self.notify.warning("Failed to verify with server")
             msg = dgi.getString()
             messenger.send('serverHelloFail', [msg])
             self.disconnect()
 
+    def handleHelloSuccess(self):
+        """ Called when the server has verified us. """
+        messenger.send('serverHelloSuccess')
+
     def __handleServerTick(self, dgi):
-        self.serverTickCount = dgi.getUint32()
+        tickCount = dgi.getUint32()
+        if tickCount <= self.serverTickCount:
+            # Snapshots are sent unreliably and may arrive out of order.
+            # We already have something newer.
+            self.notify.debug("Dropping stale snapshot for tick %i" % tickCount)
+            return
 
-        # Let the C++ repository unpack and apply the snapshot onto our objects
-        self.unpackServerSnapshot(dgi)
+        self.serverTickCount = tickCount
+        self.lastSnapshotTime = globalClock.getRealTime()
+
+        # Undo our predictions, so fields the snapshot doesn't change are
+        # left at the server's values too.
+        for do in self.commandObjects.values():
+            do.restoreAuthoritativeState()
+
+        # Let the C++ repository unpack and apply the snapshot onto our
+        # objects.  Fields marked "interp" are recorded at this tick and
+        # applied by interpolateObjects().
+        if not self.unpackServerSnapshot(dgi, tickCount):
+            # The snapshot references an object whose generate hasn't
+            # arrived yet.  Don't acknowledge it, so the server keeps sending
+            # deltas from the last snapshot we fully applied.
+            self.notify.debug("Could not fully apply snapshot for tick %i" % tickCount)
+            self.reconcileUserCommands(None)
+            return
+
+        self.reconcileUserCommands(tickCount)
 
         self.notify.debug("Got tick %i and snapshot from server" % self.serverTickCount)
 
@@ -181,6 +341,10 @@ class ClientRepository(BaseObjectManager, CClientRepository):
 
             do.announceGenerate()
 
+            if do.commandField:
+                do.saveAuthoritativeState()
+                self.commandObjects[doId] = do
+
     def __handleGenerateObject(self, dgi):
         while dgi.getRemainingSize() > 0:
             classId = dgi.getUint16()
@@ -216,6 +380,8 @@ class ClientRepository(BaseObjectManager, CClientRepository):
 
     def deleteObject(self, do):
         del self.doId2do[do.doId]
+        self.commandObjects.pop(do.doId, None)
+        self.removeInterpHistory(do.doId)
         if do.doState > DOState.Disabled:
             do.disable()
         do.delete()
@@ -227,6 +393,8 @@ class ClientRepository(BaseObjectManager, CClientRepository):
             do.delete()
 
         self.doId2do = {}
+        self.commandObjects = {}
+        self.clearInterpHistory()
 
     def disconnect(self):
         if not self.connected:
@@ -239,6 +407,7 @@ class ClientRepository(BaseObjectManager, CClientRepository):
             self.connectionHandle = None
         self.connected = False
         self.clientId = 0
+        self.serverTickCount = 0
         self.serverTickRate = 0
         self.serverIntervalPerTick = 0
         self.stopClientLoop()
@@ -257,6 +426,7 @@ class ClientRepository(BaseObjectManager, CClientRepository):
     def readerPollOnce(self):
         msg = NetworkMessage()
         if self.netSys.receiveMessageOnConnection(self.connectionHandle, msg):
+            self.bytesReceived += msg.getDatagram().getLength()
             self.msgType = msg.getDatagramIterator().getUint16()
             self.handleDatagram(msg.getDatagramIterator())
             return True
@@ -265,6 +435,7 @@ class ClientRepository(BaseObjectManager, CClientRepository):
     def sendDatagram(self, dg):
         if dg.getLength() <= 0 or not self.connected:
             return
+        self.bytesSent += dg.getLength()
         self.netSys.sendDatagram(self.connectionHandle, dg, NetworkSystem.NSFReliableNoNagle)
 
     def connect(self, url):
@@ -275,7 +446,7 @@ class ClientRepository(BaseObjectManager, CClientRepository):
         self.serverAddress = addr
         self.connectionHandle = self.netSys.connectByIPAddress(addr)
         if not self.connectionHandle:
-            messenger.send('connectFailure', [self.serverAddress])
+            self.handleConnectFailure()
             self.serverAddress = None
             self.connectionHandle = None
         else:
@@ -294,13 +465,13 @@ class ClientRepository(BaseObjectManager, CClientRepository):
             # We've successfully connected.
             self.connected = True
             self.notify.info("Successfully connected")
-            messenger.send('connectSuccess', [self.serverAddress])
+            self.handleConnectSuccess()
 
         elif oldState == NetworkSystem.NCSConnecting:
             # If state was connecting and new state is not connected, we failed!
             self.connected = False
             self.stopClientLoop()
-            messenger.send('connectFailure', [self.serverAddress])
+            self.handleConnectFailure()
             self.serverAddress = None
 
         elif state == NetworkSystem.NCSClosedByPeer or \
@@ -315,6 +486,14 @@ class ClientRepository(BaseObjectManager, CClientRepository):
             self.stopClientLoop()
             self.deleteAllObjects()
 
+    def handleConnectSuccess(self):
+        """ Called when the connection to the server has been established. """
+        messenger.send('connectSuccess', [self.serverAddress])
+
+    def handleConnectFailure(self):
+        """ Called when the connection to the server could not be made. """
+        messenger.send('connectFailure', [self.serverAddress])
+
     def handleDatagram(self, dgi):
         if self.msgType == NetMessages.SV_Hello_Resp:
             self.__handleServerHelloResp(dgi)
@@ -330,6 +509,19 @@ class ClientRepository(BaseObjectManager, CClientRepository):
             self.__handleDeleteObject(dgi)
         elif self.msgType == NetMessages.B_ObjectMessage:
             self.__handleObjectMessage(dgi)
+        elif self.msgType == NetMessages.SV_MessageBundle:
+            self.__handleMessageBundle(dgi)
+        elif self.msgType == NetMessages.SV_CommandAck:
+            self.__handleCommandAck(dgi)
+
+    def __handleMessageBundle(self, dgi):
+        # Handle each framed message in order as if it arrived on its own.
+        while dgi.getRemainingSize() > 0:
+            length = dgi.getUint32()
+            dg = PyDatagram(dgi.extractBytes(length))
+            msgDgi = PyDatagramIterator(dg)
+            self.msgType = msgDgi.getUint16()
+            self.handleDatagram(msgDgi)
 
     def sendUpdate(self, do, name, args):
         if not do:
@@ -0,0 +1,180 @@
+from direct.distributed.PyDatagram import PyDatagram
+from direct.distributed.PyDatagramIterator import PyDatagramIterator
+from direct.directnotify.DirectNotifyGlobal import directNotify
+
+from .ClientRepository import ClientRepository
+from .ClientConfig import *
+from .DemoRecorder import DemoRecorder
+
+import struct
+
+class DemoPlayer(ClientRepository):
+    """
+    Plays back a demo file written by DemoRecorder through the regular client
+    unpack path, without a server.  Read the same DC files the server used
+    before opening the demo.
+
+    playToEnd() runs through the whole demo as fast as possible, which is
+    useful for benchmarking the client.  startPlayback() plays it in step
+    with the sim clock at the indicated speed.  seek() jumps to any tick by
+    way of the nearest earlier keyframe.
+    """
+
+    notify = directNotify.newCategory("DemoPlayer")
+
+    def __init__(self):
+        ClientRepository.__init__(self)
+        self.runFrameTaskName = "demoPlayerRunFrame"
+        self.file = None
+        self.keyframes = []
+        self.dataStart = 0
+        self.dataEnd = 0
+        self.playbackTick = 0.0
+        self.playbackSpeed = 1.0
+        self.recordsPlayed = 0
+
+    def openDemo(self, filename):
+        self.closeDemo()
+        self.file = open(filename, "rb")
+
+        headerSize = struct.calcsize(DemoRecorder.HeaderFormat)
+        magic, version, dcHash, tickRate, indexOffset = struct.unpack(
+            DemoRecorder.HeaderFormat, self.file.read(headerSize))
+        if magic != DemoRecorder.Magic or version != DemoRecorder.Version:
+            self.notify.warning("%s is not a version %i demo file" %
+                                (filename, DemoRecorder.Version))
+            self.closeDemo()
+            return False
+        if dcHash != self.hashVal:
+            self.notify.warning("%s was recorded with different DC files" % filename)
+
+        self.serverTickRate = tickRate
+        self.serverIntervalPerTick = 1.0 / tickRate
+        self.dataStart = headerSize
+        self.dataEnd = indexOffset
+
+        self.keyframes = []
+        if indexOffset:
+            self.file.seek(indexOffset)
+            count = struct.unpack("<I", self.file.read(4))[0]
+            entrySize = struct.calcsize(DemoRecorder.IndexEntryFormat)
+            for _ in range(count):
+                self.keyframes.append(struct.unpack(DemoRecorder.IndexEntryFormat,
+                                                    self.file.read(entrySize)))
+        else:
+            # The recording was never finished, play to the end of the file.
+            self.file.seek(0, 2)
+            self.dataEnd = self.file.tell()
+
+        self.rewind()
+        return True
+
+    def closeDemo(self):
+        self.stopPlayback()
+        if self.file:
+            self.file.close()
+            self.file = None
+        self.deleteAllObjects()
+
+    def rewind(self):
+        """
+        Moves playback to the start of the demo, which is its first keyframe,
+        since objects that existed before recording started are only
+        generated there.
+        """
+        self.deleteAllObjects()
+        self.serverTickCount = 0
+        self.playbackTick = 0.0
+        self.file.seek(self.dataStart)
+
+        # Anything before the first keyframe is already reflected in it.
+        while True:
+            header = self.readRecordHeader()
+            if header is None:
+                return
+            recordType, recordTick, length = header
+            if recordType == DemoRecorder.RecordKeyframe:
+                self.playRecord(self.file.read(length))
+                self.playbackTick = float(recordTick)
+                return
+            self.file.seek(length, 1)
+
+    def readRecordHeader(self):
+        """ Returns the (type, tick, length) of the next record, or None at the end. """
+        if self.file.tell() >= self.dataEnd:
+            return None
+        headerSize = struct.calcsize(DemoRecorder.RecordHeaderFormat)
+        data = self.file.read(headerSize)
+        if len(data) < headerSize:
+            return None
+        return struct.unpack(DemoRecorder.RecordHeaderFormat, data)
+
+    def playRecord(self, data):
+        dgi = PyDatagramIterator(PyDatagram(data))
+        self.msgType = dgi.getUint16()
+        self.handleDatagram(dgi)
+        self.recordsPlayed += 1
+
+    def playUntil(self, tick):
+        """ Plays every record up to and including the indicated tick. """
+        while True:
+            start = self.file.tell()
+            header = self.readRecordHeader()
+            if header is None:
+                return False
+
+            recordType, recordTick, length = header
+            if recordTick > tick:
+                self.file.seek(start)
+                return True
+
+            if recordType == DemoRecorder.RecordKeyframe:
+                # Only needed when seeking.
+                self.file.seek(length, 1)
+                continue
+
+            self.playRecord(self.file.read(length))
+
+    def playToEnd(self):
+        """ Plays the rest of the demo as fast as possible. """
+        while self.playUntil(0xFFFFFFFF):
+            pass
+
+    def seek(self, tick):
+        """ Moves playback to the indicated tick. """
+        keyframe = None
+        for keyframeTick, offset in self.keyframes:
+            if keyframeTick > tick:
+                break
+            keyframe = (keyframeTick, offset)
+
+        if keyframe is None or keyframe[0] < self.serverTickCount <= tick:
+            # Quicker to play forward from where we are.
+            if tick < self.serverTickCount:
+                self.rewind()
+        else:
+            self.deleteAllObjects()
+            self.serverTickCount = 0
+            self.file.seek(keyframe[1])
+            recordType, recordTick, length = self.readRecordHeader()
+            self.playRecord(self.file.read(length))
+
+        self.playUntil(tick)
+        self.playbackTick = float(tick)
+
+    def startPlayback(self, speed = 1.0):
+        self.playbackSpeed = speed
+        base.simTaskMgr.add(self.__playbackTask, self.runFrameTaskName, sort = -100)
+
+    def stopPlayback(self):
+        base.simTaskMgr.remove(self.runFrameTaskName)
+
+    def __playbackTask(self, task):
+        self.playbackTick += globalClock.getDt() * self.playbackSpeed / self.serverIntervalPerTick
+        if not self.playUntil(int(self.playbackTick)):
+            messenger.send('demoPlaybackDone')
+            return task.done
+
+        self.simObjects()
+        self.interpolate(self.playbackTick - cl_interp.getValue() / self.serverIntervalPerTick)
+        return task.cont
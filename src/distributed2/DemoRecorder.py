@@ -0,0 +1,188 @@
+from direct.distributed.PyDatagram import PyDatagram
+from direct.directnotify.DirectNotifyGlobal import directNotify
+
+from .NetMessages import NetMessages
+
+import struct
+
+class DemoRecorder:
+    """
+    Records everything the server sends about its objects to a demo file:
+    generates, deletes, broadcast object messages and a delta snapshot every
+    tick, as a client seeing every zone would receive them.  DemoPlayer plays
+    the file back.
+
+    Every `keyframeInterval` seconds a keyframe is written, holding a
+    generate of every object and an absolute snapshot, so playback can seek
+    to it.  An index of the keyframes is written at the end of the file.
+
+    File layout, little endian:
+        header: magic, uint16 version, uint32 DC hash, uint8 tick rate,
+                uint64 offset of the index
+        records: uint8 type, uint32 tick, uint32 length, message
+        index: uint32 count, then uint32 tick and uint64 offset per keyframe
+
+    A message record holds one datagram as the client would receive it.  A
+    keyframe record holds an SV_MessageBundle, and is skipped unless
+    playback is seeking to it.
+    """
+
+    notify = directNotify.newCategory("DemoRecorder")
+
+    Magic = b"P3DEMO"
+    Version = 1
+    HeaderFormat = "<6sHIBQ"
+    RecordHeaderFormat = "<BII"
+    IndexEntryFormat = "<IQ"
+
+    RecordMessage = 0
+    RecordKeyframe = 1
+
+    def __init__(self, server, filename, keyframeInterval = 10.0):
+        self.server = server
+        self.filename = filename
+        self.keyframeInterval = keyframeInterval
+        self.file = None
+
+        self.keyframes = []
+        self.nextKeyframeTime = 0.0
+        self.lastSnapshot = None
+        self.snapshotDatagram = None
+        self.snapshotTick = 0
+
+        # Messages waiting for the end of the tick, like a client's.
+        self.pendingMessages = []
+        self.pendingGenerates = {}
+
+    def start(self):
+        self.file = open(self.filename, "wb")
+        self.file.write(struct.pack(self.HeaderFormat, self.Magic, self.Version,
+                                    self.server.hashVal, int(base.ticksPerSec), 0))
+        self.keyframes = []
+        self.nextKeyframeTime = 0.0
+        self.lastSnapshot = None
+        self.server.demoRecorder = self
+        self.notify.info("Recording demo to %s" % self.filename)
+
+    def stop(self):
+        if not self.file:
+            return
+
+        self.server.demoRecorder = None
+
+        indexOffset = self.file.tell()
+        self.file.write(struct.pack("<I", len(self.keyframes)))
+        for tick, offset in self.keyframes:
+            self.file.write(struct.pack(self.IndexEntryFormat, tick, offset))
+
+        self.file.seek(0)
+        self.file.write(struct.pack(self.HeaderFormat, self.Magic, self.Version,
+                                    self.server.hashVal, int(base.ticksPerSec), indexOffset))
+        self.file.close()
+        self.file = None
+        self.lastSnapshot = None
+        self.notify.info("Finished recording demo to %s, %i keyframes" %
+                         (self.filename, len(self.keyframes)))
+
+    def isRecording(self):
+        return self.file is not None
+
+    def recordGenerate(self, do):
+        entry = [NetMessages.SV_GenerateObject, do.doId, do]
+        self.pendingMessages.append(entry)
+        self.pendingGenerates[do.doId] = entry
+
+    def recordDelete(self, doId):
+        entry = self.pendingGenerates.pop(doId, None)
+        if not entry:
+            self.pendingMessages.append([NetMessages.SV_DeleteObject, doId, None])
+            return
+
+        # Generated and deleted in the same tick, forget both along with any
+        # messages in between.
+        cancelling = False
+        for pending in self.pendingMessages:
+            if pending is entry:
+                cancelling = True
+            if cancelling and pending[1] == doId:
+                pending[0] = None
+
+    def recordDatagram(self, msgType, dg, doId = None):
+        self.pendingMessages.append([msgType, doId, dg])
+
+    def flush(self):
+        """ Writes the messages recorded this tick. """
+        tick = base.tickCount
+        for msgType, doId, payload in self.pendingMessages:
+            if msgType is None:
+                continue
+
+            if msgType == NetMessages.SV_GenerateObject:
+                dg = PyDatagram()
+                dg.addUint16(msgType)
+                self.server.packObjectGenerate(dg, payload)
+            elif msgType == NetMessages.SV_DeleteObject:
+                dg = PyDatagram()
+                dg.addUint16(msgType)
+                dg.addUint32(doId)
+            else:
+                dg = payload
+
+            self.writeRecord(self.RecordMessage, tick, dg)
+
+        self.pendingMessages = []
+        self.pendingGenerates = {}
+
+    def queueSnapshot(self, snap):
+        """
+        Writes a keyframe if one is due, and queues up this tick's delta
+        snapshot to be formatted along with the clients' snapshots.
+        """
+        tick = snap.getTickCount()
+        zoneIds = list(self.server.objectsByZoneId.keys())
+
+        now = globalClock.getFrameTime()
+        if now >= self.nextKeyframeTime:
+            self.writeKeyframe(snap, zoneIds)
+            self.nextKeyframeTime = now + self.keyframeInterval
+
+        dg = PyDatagram()
+        dg.addUint16(NetMessages.SV_Tick)
+        if self.lastSnapshot:
+            self.server.snapshotMgr.queueClientFormatDeltaSnapshot(dg, self.lastSnapshot, snap, zoneIds)
+        else:
+            self.server.snapshotMgr.queueClientFormatSnapshot(dg, snap, zoneIds)
+        self.snapshotDatagram = dg
+        self.snapshotTick = tick
+        self.lastSnapshot = snap
+
+    def writeSnapshot(self):
+        """ Writes the snapshot queued by queueSnapshot(), once formatted. """
+        if self.snapshotDatagram:
+            self.writeRecord(self.RecordMessage, self.snapshotTick, self.snapshotDatagram)
+            self.snapshotDatagram = None
+
+    def writeKeyframe(self, snap, zoneIds):
+        generate = PyDatagram()
+        generate.addUint16(NetMessages.SV_GenerateObject)
+        for do in self.server.doId2do.values():
+            self.server.packObjectGenerate(generate, do)
+
+        snapshot = PyDatagram()
+        snapshot.addUint16(NetMessages.SV_Tick)
+        self.server.snapshotMgr.clientFormatSnapshot(snapshot, snap, zoneIds)
+
+        bundle = PyDatagram()
+        bundle.addUint16(NetMessages.SV_MessageBundle)
+        for dg in (generate, snapshot):
+            bundle.addUint32(dg.getLength())
+            bundle.appendData(dg.getMessage())
+
+        tick = snap.getTickCount()
+        self.keyframes.append((tick, self.file.tell()))
+        self.writeRecord(self.RecordKeyframe, tick, bundle)
+
+    def writeRecord(self, recordType, tick, dg):
+        data = dg.getMessage()
+        self.file.write(struct.pack(self.RecordHeaderFormat, recordType, tick, len(data)))
+        self.file.write(data)
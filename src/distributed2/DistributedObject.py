@@ -1,12 +1,59 @@
 from .BaseDistributedObject import BaseDistributedObject
 
+from collections import deque
+import copy
+
 # Base client network object
 class DistributedObject(BaseDistributedObject):
 
     neverDisable = False
 
+    # Set to True on classes with many instances to receive snapshot state
+    # through batchDataUpdate(), one call per class per snapshot, instead of
+    # preDataUpdate(), the field setters and postDataUpdate() per object.
+    batchDataUpdates = False
+
+    # Names of the state fields that user commands change on the owner view.
+    # When a snapshot arrives, these are put back to their last server values
+    # before it is applied, and the commands the server hasn't run yet are
+    # run again on top.  Commands should assign these attributes rather than
+    # modify them in place.
+    predictedFields = ()
+
     def __init__(self):
         BaseDistributedObject.__init__(self)
+        # Number of the last user command created on this owner view.
+        self.commandNumber = 0
+        # Commands the server hasn't acknowledged, as (number, args) pairs.
+        self.pendingCommands = deque()
+        # Commands not yet sent, as (number, packed args) pairs.
+        self.unsentCommands = []
+        # (tick, number) of command acknowledgements not yet matched to a
+        # snapshot.
+        self.commandAcks = deque()
+        self.ackedCommand = 0
+        # Server values of predictedFields as of the last snapshot.
+        self.authoritativeState = {}
+
+    def createCommand(self):
+        """
+        Override this on owner views of classes with a commandField to return
+        the args of this tick's user command, usually built from input, or
+        None to send nothing this tick.
+        """
+        return None
+
+    def runCommand(self, args):
+        """ Runs a user command on the object, through its commandField. """
+        getattr(self, self.commandField)(*args)
+
+    def saveAuthoritativeState(self):
+        self.authoritativeState = {name: copy.copy(getattr(self, name, None))
+                                   for name in self.predictedFields}
+
+    def restoreAuthoritativeState(self):
+        for name, value in self.authoritativeState.items():
+            setattr(self, name, copy.copy(value))
 
     def preDataUpdate(self):
         """
@@ -22,6 +69,44 @@ class DistributedObject(BaseDistributedObject):
         """
         pass
 
+    @classmethod
+    def batchDataUpdate(cls, objects, fields):
+        """
+        Called with the state unpacked from a snapshot for all objects of this
+        class, if batchDataUpdates is True.  objects is the list of objects
+        that were in the snapshot.  fields maps the name of each changed field
+        to a pair of parallel lists: the indices into objects of the objects
+        whose field changed, and the new values.
+
+        Values of fields tagged "interp" come through here too, once per
+        frame from ClientRepository.interpolateObjects(), with objects
+        holding only the objects that have a new interpolated value.
+
+        Override this to process the whole class at once.  The default
+        applies the values one object at a time, like the unbatched path.
+        It is looked up on the class rather than on an object, so overrides
+        must be classmethods too.
+        """
+        changes = [[] for _ in objects]
+        for name, (indices, values) in fields.items():
+            for i, value in zip(indices, values):
+                changes[i].append((name, value))
+
+        for do, objChanges in zip(objects, changes):
+            do.preDataUpdate()
+            for name, value in objChanges:
+                proxy = getattr(do, "RecvProxy_" + name, None)
+                if proxy and isinstance(value, tuple):
+                    proxy(*value)
+                elif proxy:
+                    proxy(value)
+                else:
+                    setattr(do, name, value)
+                handler = getattr(do, "OnRecv_" + name, None)
+                if handler:
+                    handler()
+            do.postDataUpdate()
+
     def sendUpdate(self, name, args = []):
         """
         Sends a non-stateful event message from one object view to another.
@@ -1,11 +1,54 @@
 from .BaseDistributedObject import BaseDistributedObject
 
+from collections import deque
+
 # Base server network object
 class DistributedObjectAI(BaseDistributedObject):
 
+    # If True, the object promises to call markStateChanged() whenever one of
+    # its state fields changes, and its fields are only re-packed into
+    # snapshots on ticks where that happened.  Leave this False for objects
+    # whose state comes from SendProxy methods or otherwise changes behind
+    # the object's back.
+    trackStateChanges = False
+
+    # Relative importance of the object to clients with proximity interest.
+    # Scaled down with distance from the client's interest anchor.
+    interestPriority = 1.0
+
     def __init__(self):
         BaseDistributedObject.__init__(self)
         self.owner = None
+        self._stateDirty = True
+        # User commands received from the owner and not yet run, as
+        # (commandNumber, packed args) pairs.
+        self.commandQueue = deque()
+        # Number of the last user command received, and of the last one run.
+        self.lastQueuedCommand = 0
+        self.lastRunCommand = 0
+        # (x, y) given to ServerRepository.setObjectPosition(), or None.
+        self.interestPos = None
+
+    def markStateChanged(self):
+        """
+        Marks the object's state as changed, so its fields will be re-packed
+        in the next snapshot.  Only needed if trackStateChanges is True.
+        """
+        self._stateDirty = True
+
+    def clearStateChanged(self):
+        """
+        Called by the repository after the object's state has been packed
+        into a snapshot.
+        """
+        self._stateDirty = False
+
+    def isStateChanged(self):
+        """
+        Returns True if the object's fields need to be re-packed in the next
+        snapshot.
+        """
+        return self._stateDirty or not self.trackStateChanges
 
     def sendUpdate(self, name, args = [], client = None):
         """
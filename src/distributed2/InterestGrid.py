@@ -0,0 +1,80 @@
+import math
+
+class InterestGrid:
+    """
+    Divides the ground plane into square cells, each of which is a zone.
+    Objects placed with ServerRepository.setObjectPosition() are moved into
+    the zone of the cell they are in, and clients with an interest anchor
+    get interest in every cell within their radius, so proximity interest
+    rides on the regular zone-based interest and snapshot code.
+
+    The grid covers gridSize by gridSize cells centered on the origin, using
+    zone IDs starting at zoneBase.  Positions outside it are clamped to the
+    edge cells.
+
+    A cell enters a client's interest once its nearest point is within the
+    radius, and leaves it only once it is further than the radius plus the
+    hysteresis, so objects near the boundary don't flap in and out.
+    """
+
+    def __init__(self, cellSize, gridSize, zoneBase, hysteresis = None):
+        self.cellSize = float(cellSize)
+        self.gridSize = gridSize
+        self.zoneBase = zoneBase
+        if hysteresis is None:
+            hysteresis = self.cellSize * 0.5
+        self.hysteresis = hysteresis
+        self.halfExtent = self.cellSize * gridSize * 0.5
+
+    def isGridZone(self, zoneId):
+        return self.zoneBase <= zoneId < self.zoneBase + self.gridSize * self.gridSize
+
+    def getCell(self, x, y):
+        """ Returns the (column, row) of the cell containing the position. """
+        col = int(math.floor((x + self.halfExtent) / self.cellSize))
+        row = int(math.floor((y + self.halfExtent) / self.cellSize))
+        last = self.gridSize - 1
+        return (min(max(col, 0), last), min(max(row, 0), last))
+
+    def getCellZone(self, col, row):
+        return self.zoneBase + row * self.gridSize + col
+
+    def getZoneForPosition(self, x, y):
+        return self.getCellZone(*self.getCell(x, y))
+
+    def getZoneCell(self, zoneId):
+        index = zoneId - self.zoneBase
+        return (index % self.gridSize, index // self.gridSize)
+
+    def getDistanceToZone(self, x, y, zoneId):
+        """ Returns the distance from the position to the nearest point of the cell. """
+        col, row = self.getZoneCell(zoneId)
+        minX = col * self.cellSize - self.halfExtent
+        minY = row * self.cellSize - self.halfExtent
+        dx = max(minX - x, 0.0, x - (minX + self.cellSize))
+        dy = max(minY - y, 0.0, y - (minY + self.cellSize))
+        return math.sqrt(dx * dx + dy * dy)
+
+    def getZonesInRadius(self, x, y, radius):
+        """ Returns the set of zones with any part within radius of the position. """
+        minCol, minRow = self.getCell(x - radius, y - radius)
+        maxCol, maxRow = self.getCell(x + radius, y + radius)
+        zones = set()
+        for row in range(minRow, maxRow + 1):
+            for col in range(minCol, maxCol + 1):
+                zoneId = self.getCellZone(col, row)
+                if self.getDistanceToZone(x, y, zoneId) <= radius:
+                    zones.add(zoneId)
+        return zones
+
+    def updateInterest(self, currentZones, x, y, radius):
+        """
+        Returns the new set of grid zones a client at the position should
+        have interest in, given the grid zones it has now.
+        """
+        zones = self.getZonesInRadius(x, y, radius)
+        keepRadius = radius + self.hysteresis
+        for zoneId in currentZones:
+            if zoneId not in zones and self.getDistanceToZone(x, y, zoneId) <= keepRadius:
+                zones.add(zoneId)
+        return zones
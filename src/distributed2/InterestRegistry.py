@@ -0,0 +1,111 @@
+class InterestRegistry:
+    """
+    Keeps track of which clients have interest in which zones.
+
+    A client can have interest in the same zone for more than one reason:
+    explicitly, because it owns objects there, or through proximity.  Each
+    reason holds a reference on the zone, and the client sees the zone for
+    as long as any reference is held.  addRefs() and removeRefs() return the
+    zones that came into or went out of view, so the caller only has to
+    generate or delete the objects in those.
+
+    The clients in each zone are kept in a list, which getClients() returns
+    as is so that broadcasting to a zone doesn't allocate anything.  Don't
+    modify it, and don't change interest in the zone while iterating it.
+    Removing a client swaps the last client into its place, so membership
+    changes are constant time.
+
+    Each client's set of visible zones is kept in its currentInterestZoneIds.
+    """
+
+    def __init__(self):
+        # Maps zoneId to the list of clients that see it.
+        self.zoneClients = {}
+        # Maps (zoneId, client) to the client's index in the zone's list.
+        self.clientIndices = {}
+        # Maps client to a dictionary of zoneId to reference count.
+        self.clientRefs = {}
+
+    def getClients(self, zoneId):
+        """ Returns the clients that see the zone. """
+        return self.zoneClients.get(zoneId, ())
+
+    def hasInterest(self, client, zoneId):
+        return (zoneId, client) in self.clientIndices
+
+    def getRefCount(self, client, zoneId):
+        refs = self.clientRefs.get(client)
+        if not refs:
+            return 0
+        return refs.get(zoneId, 0)
+
+    def addRefs(self, client, zoneIds):
+        """
+        Adds a reference on each of the zones for the client.  Returns the
+        list of zones the client didn't see before.
+        """
+        refs = self.clientRefs.get(client)
+        if refs is None:
+            refs = {}
+            self.clientRefs[client] = refs
+
+        opened = []
+        for zoneId in zoneIds:
+            count = refs.get(zoneId, 0)
+            refs[zoneId] = count + 1
+            if count == 0:
+                self.__addClient(zoneId, client)
+                client.currentInterestZoneIds.add(zoneId)
+                opened.append(zoneId)
+        return opened
+
+    def removeRefs(self, client, zoneIds):
+        """
+        Removes a reference on each of the zones for the client.  Returns the
+        list of zones the client no longer sees.
+        """
+        refs = self.clientRefs.get(client)
+        if not refs:
+            return []
+
+        closed = []
+        for zoneId in zoneIds:
+            count = refs.get(zoneId, 0)
+            if count > 1:
+                refs[zoneId] = count - 1
+            elif count == 1:
+                del refs[zoneId]
+                self.__removeClient(zoneId, client)
+                client.currentInterestZoneIds.discard(zoneId)
+                closed.append(zoneId)
+        return closed
+
+    def removeClient(self, client):
+        """ Drops all of the client's interest.  Returns the zones it saw. """
+        refs = self.clientRefs.pop(client, None)
+        if not refs:
+            return []
+
+        closed = list(refs.keys())
+        for zoneId in closed:
+            self.__removeClient(zoneId, client)
+        client.currentInterestZoneIds.clear()
+        return closed
+
+    def __addClient(self, zoneId, client):
+        clients = self.zoneClients.get(zoneId)
+        if clients is None:
+            clients = []
+            self.zoneClients[zoneId] = clients
+        self.clientIndices[(zoneId, client)] = len(clients)
+        clients.append(client)
+
+    def __removeClient(self, zoneId, client):
+        clients = self.zoneClients[zoneId]
+        index = self.clientIndices.pop((zoneId, client))
+        last = clients.pop()
+        if last is not client:
+            clients[index] = last
+            self.clientIndices[(zoneId, last)] = index
+        if not clients:
+            del self.zoneClients[zoneId]
@@ -0,0 +1,201 @@
+"""
+Times InterestRegistry against per-zone client sets rebuilt with set
+unions, the way ServerRepository tracked interest before, for many clients
+spread over many zones.
+
+Run it as a script:
+    python -m direct.distributed2.InterestRegistryBenchmark --clients 1000 --zones 10000
+"""
+
+from .InterestRegistry import InterestRegistry
+
+import argparse
+import random
+import timeit
+
+class BenchmarkClient:
+    """ Just the parts of ServerRepository.Client that interest touches. """
+
+    def __init__(self, id):
+        self.id = id
+        self.explicitInterestZoneIds = set()
+        self.ownedZoneIds = set()
+        self.currentInterestZoneIds = set()
+
+class ZoneSetInterest:
+    """
+    Interest kept as a set of clients per zone, with each client's zones
+    rebuilt from the union of its reasons on every change.
+    """
+
+    def __init__(self):
+        self.zonesToClients = {}
+
+    def getClients(self, zoneId):
+        return self.zonesToClients.get(zoneId, set())
+
+    def update(self, client):
+        origZoneIds = client.currentInterestZoneIds
+        newZoneIds = client.explicitInterestZoneIds | client.ownedZoneIds
+        if origZoneIds == newZoneIds:
+            return [], []
+        client.currentInterestZoneIds = newZoneIds
+        added = newZoneIds - origZoneIds
+        removed = origZoneIds - newZoneIds
+        for zoneId in added:
+            self.zonesToClients.setdefault(zoneId, set()).add(client)
+        for zoneId in removed:
+            self.zonesToClients[zoneId].remove(client)
+        return added, removed
+
+class Scenario:
+    """
+    A reproducible sequence of interest changes and broadcasts: each client
+    starts with `zonesPerClient` explicit zones and one owned zone, then
+    swaps one explicit zone at a time.
+    """
+
+    def __init__(self, numClients, numZones, zonesPerClient, numChanges, seed):
+        rng = random.Random(seed)
+        self.numClients = numClients
+        self.numZones = numZones
+        self.initialZones = [rng.sample(range(numZones), zonesPerClient)
+                             for _ in range(numClients)]
+        self.ownedZones = [zones[0] for zones in self.initialZones]
+        self.changes = []
+        current = [list(zones) for zones in self.initialZones]
+        for _ in range(numChanges):
+            index = rng.randrange(numClients)
+            zones = current[index]
+            old = zones.pop(rng.randrange(len(zones)))
+            new = rng.randrange(numZones)
+            while new in zones:
+                new = rng.randrange(numZones)
+            zones.append(new)
+            self.changes.append((index, old, new))
+        self.broadcastZones = [rng.randrange(numZones) for _ in range(numChanges)]
+
+    def makeClients(self):
+        return [BenchmarkClient(i) for i in range(self.numClients)]
+
+def setupRegistry(scenario):
+    registry = InterestRegistry()
+    clients = scenario.makeClients()
+    for client, zones, owned in zip(clients, scenario.initialZones, scenario.ownedZones):
+        registry.addRefs(client, zones)
+        registry.addRefs(client, [owned])
+    return registry, clients
+
+def setupZoneSets(scenario):
+    interest = ZoneSetInterest()
+    clients = scenario.makeClients()
+    for client, zones, owned in zip(clients, scenario.initialZones, scenario.ownedZones):
+        client.explicitInterestZoneIds = set(zones)
+        client.ownedZoneIds = {owned}
+        interest.update(client)
+    return interest, clients
+
+def benchmarkRegistry(scenario, repeat):
+    results = {}
+
+    results['setup'] = min(timeit.repeat(lambda: setupRegistry(scenario),
+                                         number = 1, repeat = repeat))
+
+    def changes():
+        registry, clients = setupRegistry(scenario)
+        def run():
+            for index, old, new in scenario.changes:
+                client = clients[index]
+                registry.addRefs(client, (new,))
+                registry.removeRefs(client, (old,))
+        return run
+    results['change'] = min(timeit.timeit(changes(), number = 1)
+                            for _ in range(repeat))
+
+    registry, clients = setupRegistry(scenario)
+    def broadcast():
+        count = 0
+        for zoneId in scenario.broadcastZones:
+            for client in registry.getClients(zoneId):
+                count += 1
+        return count
+    results['broadcast'] = min(timeit.repeat(broadcast, number = 1, repeat = repeat))
+
+    # An owned zone going away while the client still sees it explicitly.
+    def ownership():
+        for client, owned in zip(clients, scenario.ownedZones):
+            registry.removeRefs(client, (owned,))
+            registry.addRefs(client, (owned,))
+    results['ownership'] = min(timeit.repeat(ownership, number = 1, repeat = repeat))
+
+    return results
+
+def benchmarkZoneSets(scenario, repeat):
+    results = {}
+
+    results['setup'] = min(timeit.repeat(lambda: setupZoneSets(scenario),
+                                         number = 1, repeat = repeat))
+
+    def changes():
+        interest, clients = setupZoneSets(scenario)
+        def run():
+            for index, old, new in scenario.changes:
+                client = clients[index]
+                explicit = client.explicitInterestZoneIds
+                explicit.discard(old)
+                explicit.add(new)
+                interest.update(client)
+        return run
+    results['change'] = min(timeit.timeit(changes(), number = 1)
+                            for _ in range(repeat))
+
+    interest, clients = setupZoneSets(scenario)
+    def broadcast():
+        count = 0
+        for zoneId in scenario.broadcastZones:
+            for client in interest.getClients(zoneId):
+                count += 1
+        return count
+    results['broadcast'] = min(timeit.repeat(broadcast, number = 1, repeat = repeat))
+
+    def ownership():
+        for client, owned in zip(clients, scenario.ownedZones):
+            client.ownedZoneIds = set()
+            interest.update(client)
+            client.ownedZoneIds = {owned}
+            interest.update(client)
+    results['ownership'] = min(timeit.repeat(ownership, number = 1, repeat = repeat))
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+    parser.add_argument('--clients', type = int, default = 1000)
+    parser.add_argument('--zones', type = int, default = 10000)
+    parser.add_argument('--zones-per-client', type = int, default = 20)
+    parser.add_argument('--changes', type = int, default = 20000,
+                        help = "interest changes and broadcasts to time")
+    parser.add_argument('--repeat', type = int, default = 5,
+                        help = "runs of each test, the fastest is reported")
+    parser.add_argument('--seed', type = int, default = 1)
+    args = parser.parse_args()
+
+    scenario = Scenario(args.clients, args.zones, args.zones_per_client,
+                        args.changes, args.seed)
+    registry = benchmarkRegistry(scenario, args.repeat)
+    zoneSets = benchmarkZoneSets(scenario, args.repeat)
+
+    counts = {'setup': args.clients,
+              'change': args.changes,
+              'broadcast': args.changes,
+              'ownership': args.clients}
+    print("%i clients, %i zones, %i zones per client" %
+          (args.clients, args.zones, args.zones_per_client))
+    print("%-10s %8s %16s %16s" % ('', 'ops', 'registry us/op', 'zone sets us/op'))
+    for name in ('setup', 'change', 'broadcast', 'ownership'):
+        print("%-10s %8i %16.3f %16.3f" %
+              (name, counts[name], registry[name] * 1e6 / counts[name],
+               zoneSets[name] * 1e6 / counts[name]))
+
+if __name__ == '__main__':
+    main()
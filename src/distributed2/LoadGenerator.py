@@ -0,0 +1,107 @@
+from direct.directnotify.DirectNotifyGlobal import directNotify
+
+from .BotRepository import BotRepository
+
+class LoadGenerator:
+    """
+    Runs a crowd of headless BotRepository clients in this process against a
+    server, to find out how much load the server can take.
+
+    Any extra keyword arguments are passed on to each bot.  If the server is
+    running in this process too, pass its ServerRepository as `server` and
+    its tick timings are included in the report.
+
+    Example:
+        gen = LoadGenerator("tcp://127.0.0.1:27015", 200, "game.dc",
+                            interestZones = range(10), numInterestZones = 2,
+                            interestChangeInterval = 5.0)
+        gen.start()
+        ...
+        print(gen.getSummary())
+    """
+
+    notify = directNotify.newCategory("LoadGenerator")
+
+    def __init__(self, url, numBots, dcFileNames = None, botClass = BotRepository,
+                 server = None, **botArgs):
+        self.url = url
+        self.numBots = numBots
+        self.dcFileNames = dcFileNames
+        self.botClass = botClass
+        self.server = server
+        self.botArgs = botArgs
+        self.bots = []
+        self.startTime = 0.0
+
+    def start(self):
+        self.notify.info("Starting %i bots against %s" % (self.numBots, self.url))
+        self.startTime = globalClock.getRealTime()
+        for i in range(self.numBots):
+            bot = self.botClass(i, **self.botArgs)
+            bot.readDCFiles(self.dcFileNames)
+            bot.connect(self.url)
+            self.bots.append(bot)
+
+    def stop(self):
+        for bot in self.bots:
+            bot.disconnect()
+            # disconnect() does nothing if the bot never got connected.
+            bot.stopClientLoop()
+        self.bots = []
+
+    def getReport(self):
+        """
+        Returns a dictionary summarizing the bots' connection state, snapshot
+        latency and bandwidth, and the server's tick time if known.
+        """
+        elapsed = max(globalClock.getRealTime() - self.startTime, 0.001)
+
+        latencies = []
+        bytesReceived = 0
+        bytesSent = 0
+        snapshots = 0
+        for bot in self.bots:
+            latencies += bot.snapshotLatencies
+            bytesReceived += bot.bytesReceived
+            bytesSent += bot.bytesSent
+            snapshots += bot.snapshotsReceived
+
+        latencies.sort()
+        if latencies:
+            count = len(latencies)
+            latency = {'mean': sum(latencies) / count,
+                       'p50': latencies[min(count - 1, int(count * 0.50))],
+                       'p99': latencies[min(count - 1, int(count * 0.99))],
+                       'max': latencies[-1]}
+        else:
+            latency = {'mean': 0.0, 'p50': 0.0, 'p99': 0.0, 'max': 0.0}
+
+        report = {'bots': len(self.bots),
+                  'verified': len([bot for bot in self.bots if bot.verified]),
+                  'failed': len([bot for bot in self.bots if bot.failed]),
+                  'elapsed': elapsed,
+                  'snapshots': snapshots,
+                  'snapshotLatency': latency,
+                  'bytesReceivedPerSec': bytesReceived / elapsed,
+                  'bytesSentPerSec': bytesSent / elapsed}
+
+        if self.server:
+            report['serverTick'] = self.server.getTickProfiler().getStats()
+
+        return report
+
+    def getSummary(self):
+        report = self.getReport()
+        latency = report['snapshotLatency']
+        lines = ["%i bots, %i verified, %i failed, %.1f s" %
+                 (report['bots'], report['verified'], report['failed'], report['elapsed']),
+                 "%i snapshots, latency above minimum: mean %.2f ms, p99 %.2f ms, max %.2f ms" %
+                 (report['snapshots'], latency['mean'] * 1000, latency['p99'] * 1000,
+                  latency['max'] * 1000),
+                 "received %.0f B/s, sent %.0f B/s" %
+                 (report['bytesReceivedPerSec'], report['bytesSentPerSec'])]
+        if 'serverTick' in report:
+            tick = report['serverTick']
+            lines.append("server tick: mean %.2f ms, p99 %.2f ms, max %.2f ms" %
+                         (tick['mean'] * 1000, tick['p99'] * 1000, tick['max'] * 1000))
+        return "\n".join(lines)
@@ -0,0 +1,452 @@
+"""
+Runs a ServerRepository and a ClientRepository against each other in one
+process, over an in-memory loopback link instead of the network, and checks
+that client prediction and server reconciliation of user commands agree.
+
+Both repositories are stepped by hand, server first, one sim tick at a
+time, and the link delivers datagrams a fixed number of ticks after they
+were sent, so a run with the same arguments always plays out the same way.
+The link can also drop a share of the datagrams sent unreliably, which are
+the snapshots; see SnapshotLossSimulation.
+
+Run it as a script:
+    python -m direct.distributed2.LoopbackHarness --ticks 600 --latency 3
+"""
+
+from panda3d.core import Datagram, Filename
+
+from direct.distributed.PyDatagramIterator import PyDatagramIterator
+from direct.directnotify.DirectNotifyGlobal import directNotify
+from direct.task import Task
+
+from .ClientRepository import ClientRepository
+from .ServerRepository import ServerRepository
+from .DistributedObject import DistributedObject
+from .DistributedObjectAI import DistributedObjectAI
+
+from collections import deque
+import argparse
+import builtins
+import os
+import random
+import sys
+import tempfile
+
+DCText = """
+from direct.distributed2.LoopbackHarness import LoopbackMover/AI/OV
+
+keyword ram;
+keyword ownsend;
+
+dclass LoopbackMover {
+  int32 x ram;
+  int32 y ram;
+  move(int8 dx, int8 dy) ownsend;
+};
+"""
+
+def scriptedCommand(commandNumber):
+    """ Returns the args of the harness's user command with this number. """
+    return ((commandNumber * 7) % 5 - 2, (commandNumber * 3) % 5 - 2)
+
+class LoopbackMover(DistributedObject):
+    """ Client view of the object the harness's user commands move. """
+
+    commandField = 'move'
+
+    def __init__(self):
+        DistributedObject.__init__(self)
+        self.x = 0
+        self.y = 0
+
+    def move(self, dx, dy):
+        self.x = self.x + dx
+        self.y = self.y + dy
+
+class LoopbackMoverOV(LoopbackMover):
+    """ Owner view, which predicts its position from its own commands. """
+
+    predictedFields = ('x', 'y')
+
+    def __init__(self):
+        LoopbackMover.__init__(self)
+        # Set by the harness.  Called with a command number, returns the
+        # command's args.
+        self.script = None
+
+    def createCommand(self):
+        if not self.script:
+            return None
+        return self.script(self.commandNumber + 1)
+
+class LoopbackMoverAI(DistributedObjectAI):
+
+    commandField = 'move'
+
+    def __init__(self):
+        DistributedObjectAI.__init__(self)
+        self.x = 0
+        self.y = 0
+
+    def move(self, dx, dy):
+        self.x = self.x + dx
+        self.y = self.y + dy
+
+class LoopbackLink:
+    """
+    One direction of the loopback connection.  Holds each datagram for
+    `latency` ticks before handing it to the receiving end, and loses
+    `dropRate` of the datagrams sent unreliably, picked by a random number
+    generator seeded with `seed`.
+    """
+
+    def __init__(self, latency = 0, dropRate = 0.0, seed = 0):
+        self.latency = latency
+        self.dropRate = dropRate
+        self.rng = random.Random(seed)
+        self.tick = 0
+        # (deliver tick, datagram) pairs, in the order they were sent.
+        self.inFlight = deque()
+        self.datagramsSent = 0
+        self.bytesSent = 0
+        self.datagramsDropped = 0
+        self.bytesDropped = 0
+
+    def send(self, dg, reliable = True):
+        self.datagramsSent += 1
+        self.bytesSent += dg.getLength()
+        if not reliable and self.dropRate > 0.0 and self.rng.random() < self.dropRate:
+            self.datagramsDropped += 1
+            self.bytesDropped += dg.getLength()
+            return
+        # Copy it, the sender is free to reuse the datagram.
+        self.inFlight.append((self.tick + self.latency, Datagram(dg.getMessage())))
+
+    def receive(self):
+        """ Returns the next datagram due by now, or None. """
+        if self.inFlight and self.inFlight[0][0] <= self.tick:
+            return self.inFlight.popleft()[1]
+        return None
+
+class LoopbackMessage:
+    """ Stands in for the NetworkMessage given to ServerRepository.handleDatagram(). """
+
+    def __init__(self, connection, datagram):
+        self.connection = connection
+        self.datagram = datagram
+
+    def getConnection(self):
+        return self.connection
+
+    def getDatagram(self):
+        return self.datagram
+
+    def getDatagramIterator(self):
+        return PyDatagramIterator(self.datagram)
+
+class LoopbackConnectionInfo:
+    """ Stands in for the NetworkConnectionInfo of a new connection. """
+
+    netAddress = "loopback"
+
+class LoopbackServerRepository(ServerRepository):
+    """ A ServerRepository that talks to LoopbackClientRepositories. """
+
+    notify = directNotify.newCategory("LoopbackServerRepository")
+
+    def __init__(self, listenPort):
+        ServerRepository.__init__(self, listenPort)
+        # The harness runs our frames itself.
+        base.simTaskMgr.remove("serverRunFrame")
+        # Link to each client by connection, and the link from each client.
+        self.linksToClients = {}
+        self.linksFromClients = {}
+
+    def addLoopbackClient(self, connection, toClient, fromClient):
+        self.linksToClients[connection] = toClient
+        self.linksFromClients[connection] = fromClient
+        self.handleNewConnection(connection, LoopbackConnectionInfo())
+
+    def readerPollOnce(self):
+        for connection, link in self.linksFromClients.items():
+            dg = link.receive()
+            if dg is not None:
+                self.handleDatagram(LoopbackMessage(connection, dg))
+                return True
+        return False
+
+    def runCallbacks(self):
+        pass
+
+    def sendDatagram(self, dg, connection, reliable = True):
+        link = self.linksToClients.get(connection)
+        if link:
+            link.send(dg, reliable)
+
+class LoopbackClientRepository(ClientRepository):
+    """ A ClientRepository connected to a LoopbackServerRepository. """
+
+    notify = directNotify.newCategory("LoopbackClientRepository")
+
+    def __init__(self):
+        ClientRepository.__init__(self)
+        self.toServer = None
+        self.fromServer = None
+
+    def connectLoopback(self, server, connection, toServer, fromServer):
+        self.toServer = toServer
+        self.fromServer = fromServer
+        self.connectionHandle = connection
+        self.connected = True
+        server.addLoopbackClient(connection, fromServer, toServer)
+
+    def readerPollOnce(self):
+        dg = self.fromServer.receive()
+        if dg is None:
+            return False
+        self.bytesReceived += dg.getLength()
+        dgi = PyDatagramIterator(dg)
+        self.msgType = dgi.getUint16()
+        self.handleDatagram(dgi)
+        return True
+
+    def runCallbacks(self):
+        pass
+
+    def sendDatagram(self, dg):
+        if dg.getLength() <= 0 or not self.connected:
+            return
+        self.bytesSent += dg.getLength()
+        self.toServer.send(dg)
+
+class LoopbackHarness:
+    """
+    Connects a LoopbackClientRepository to a LoopbackServerRepository,
+    generates a LoopbackMoverAI owned by the client, and has the owner view
+    send scriptedCommand() every tick.  After every tick it checks that:
+      - the server's object is where the commands it has run put it,
+      - the owner view's last server state is where the commands the server
+        acknowledged put it, and
+      - the owner view's predicted state is where all of the commands it
+        created put it.
+
+    A HostBase is created if there isn't one yet.
+
+    Example:
+        harness = LoopbackHarness(latency = 3)
+        harness.run(600)
+        print(harness.getSummary())
+    """
+
+    notify = directNotify.newCategory("LoopbackHarness")
+
+    def __init__(self, latency = 0, dropRate = 0.0, seed = 0,
+                 listenPort = 27099, zoneId = 1,
+                 serverClass = LoopbackServerRepository,
+                 clientClass = LoopbackClientRepository):
+        if not hasattr(builtins, 'base'):
+            from direct.showbase.HostBase import HostBase
+            HostBase()
+
+        self.task = Task.Task(self.__noop, "loopbackHarness")
+        self.tick = 0
+        self.setTime()
+
+        self.server = serverClass(listenPort)
+        self.client = clientClass()
+        self.readDCFiles()
+
+        self.toServer = LoopbackLink(latency)
+        self.fromServer = LoopbackLink(latency, dropRate, seed)
+        self.client.connectLoopback(self.server, 1, self.toServer, self.fromServer)
+
+        self.zoneId = zoneId
+        self.serverMover = None
+        self.mover = None
+        self.scripting = True
+
+        # Positions after each number of commands, starting with none.
+        self.expectedPositions = [(0, 0)]
+        # Tick each command was created on, by command number.
+        self.commandTicks = {}
+        # Ticks from creating each acknowledged command to reconciling it.
+        self.commandLatencies = []
+        self.lastAcked = 0
+        self.mismatches = []
+
+    def __noop(self, task):
+        return task.cont
+
+    def readDCFiles(self):
+        fd, pathname = tempfile.mkstemp(suffix = '.dc')
+        try:
+            with os.fdopen(fd, 'w') as dcFile:
+                dcFile.write(DCText)
+            dcFileName = Filename.fromOsSpecific(pathname).getFullpath()
+            self.server.readDCFiles([dcFileName])
+            self.client.readDCFiles([dcFileName])
+        finally:
+            os.remove(pathname)
+
+    def setTime(self):
+        """ Puts the sim clock at the current tick, like HostBase.runFrame() does. """
+        frameTime = self.tick * base.intervalPerTick
+        base.tickCount = self.tick
+        base.frameTime = frameTime
+        base.deltaTime = base.intervalPerTick
+        globalClock.setFrameTime(frameTime)
+        globalClock.setDt(base.intervalPerTick)
+        globalClock.setFrameCount(self.tick)
+
+    def start(self, maxTicks = 100):
+        """
+        Says hello and generates the client's object.  Returns False if the
+        client wasn't verified within maxTicks.
+        """
+        self.client.sendHello()
+        for _ in range(maxTicks):
+            self.step()
+            if self.client.serverTickRate:
+                break
+        else:
+            self.notify.warning("Client was not verified after %i ticks" % maxTicks)
+            return False
+
+        owner = self.server.clientsByConnection[self.client.connectionHandle]
+        self.serverMover = LoopbackMoverAI()
+        self.server.generateObject(self.serverMover, self.zoneId, owner)
+        for _ in range(maxTicks):
+            self.step()
+            self.mover = self.client.commandObjects.get(self.serverMover.doId)
+            if self.mover:
+                break
+        else:
+            self.notify.warning("Owner view was not generated after %i ticks" % maxTicks)
+            return False
+
+        self.mover.script = self.scriptedCommand
+        return True
+
+    def scriptedCommand(self, commandNumber):
+        if not self.scripting:
+            return None
+        return scriptedCommand(commandNumber)
+
+    def expectedPosition(self, commandNumber):
+        while len(self.expectedPositions) <= commandNumber:
+            x, y = self.expectedPositions[-1]
+            dx, dy = scriptedCommand(len(self.expectedPositions))
+            self.expectedPositions.append((x + dx, y + dy))
+        return self.expectedPositions[commandNumber]
+
+    def step(self):
+        """ Runs one sim tick of the server, then of the client. """
+        self.setTime()
+        self.toServer.tick = self.tick
+        self.fromServer.tick = self.tick
+
+        self.server.runFrame(self.task)
+        if self.serverMover:
+            self.check('server', (self.serverMover.x, self.serverMover.y),
+                       self.serverMover.lastRunCommand)
+
+        self.client.runFrame(self.task)
+        if self.mover:
+            self.checkClient()
+
+        self.tick += 1
+
+    def checkClient(self):
+        mover = self.mover
+        for commandNumber in range(len(self.commandTicks) + 1, mover.commandNumber + 1):
+            self.commandTicks[commandNumber] = self.tick
+        for commandNumber in range(self.lastAcked + 1, mover.ackedCommand + 1):
+            self.commandLatencies.append(self.tick - self.commandTicks[commandNumber])
+        self.lastAcked = mover.ackedCommand
+
+        state = mover.authoritativeState
+        self.check('authoritative', (state.get('x'), state.get('y')), mover.ackedCommand)
+        self.check('predicted', (mover.x, mover.y), mover.commandNumber)
+
+    def check(self, what, position, commandNumber):
+        expected = self.expectedPosition(commandNumber)
+        if position != expected:
+            self.mismatches.append((self.tick, what, commandNumber, position, expected))
+            self.notify.warning("Tick %i: %s position %s after command %i, expected %s" %
+                                (self.tick, what, position, commandNumber, expected))
+
+    def run(self, numTicks, settleTicks = 100):
+        """
+        Runs numTicks ticks of scripted commands, then up to settleTicks more
+        without, for the last commands to be acknowledged.  Returns True if
+        every check passed and every command was acknowledged.
+        """
+        if not self.mover and not self.start():
+            return False
+
+        self.scripting = True
+        for _ in range(numTicks):
+            self.step()
+
+        self.scripting = False
+        for _ in range(settleTicks):
+            if self.mover.ackedCommand == self.mover.commandNumber:
+                break
+            self.step()
+
+        return self.isSettled() and not self.mismatches
+
+    def isSettled(self):
+        return self.mover is not None and \
+            self.mover.ackedCommand == self.mover.commandNumber and \
+            (self.mover.x, self.mover.y) == (self.serverMover.x, self.serverMover.y)
+
+    def getReport(self):
+        latencies = sorted(self.commandLatencies)
+        if latencies:
+            count = len(latencies)
+            latency = {'mean': sum(latencies) / count,
+                       'p50': latencies[min(count - 1, int(count * 0.50))],
+                       'p99': latencies[min(count - 1, int(count * 0.99))],
+                       'max': latencies[-1]}
+        else:
+            latency = {'mean': 0.0, 'p50': 0, 'p99': 0, 'max': 0}
+
+        return {'ticks': self.tick,
+                'commands': self.mover.commandNumber if self.mover else 0,
+                'acked': self.mover.ackedCommand if self.mover else 0,
+                'settled': self.isSettled(),
+                'mismatches': len(self.mismatches),
+                'commandLatency': latency,
+                'bytesToServer': self.toServer.bytesSent,
+                'bytesToClient': self.fromServer.bytesSent,
+                'datagramsToClient': self.fromServer.datagramsSent}
+
+    def getSummary(self):
+        report = self.getReport()
+        latency = report['commandLatency']
+        return "\n".join([
+            "%i ticks, %i commands, %i acknowledged, %i mismatches, %s" %
+            (report['ticks'], report['commands'], report['acked'], report['mismatches'],
+             "settled" if report['settled'] else "NOT settled"),
+            "command latency in ticks: mean %.2f, p50 %i, p99 %i, max %i" %
+            (latency['mean'], latency['p50'], latency['p99'], latency['max']),
+            "sent %i B to the server, %i B in %i datagrams to the client" %
+            (report['bytesToServer'], report['bytesToClient'], report['datagramsToClient'])])
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+    parser.add_argument('--ticks', type = int, default = 600)
+    parser.add_argument('--latency', type = int, default = 0,
+                        help = "ticks each datagram spends in flight")
+    parser.add_argument('--port', type = int, default = 27099,
+                        help = "the server still opens a listen socket on this port")
+    args = parser.parse_args()
+
+    harness = LoopbackHarness(args.latency, listenPort = args.port)
+    ok = harness.run(args.ticks)
+    print(harness.getSummary())
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
@@ -51,3 +51,13 @@ class NetMessages:
 
     # Object is going away.
     SV_DeleteObject = 16
+
+    # Several messages framed into one datagram.  Each message is prefixed
+    # with its length as a uint32.
+    SV_MessageBundle = 17
+
+    # Client sends numbered user commands for an object it owns.
+    CL_UserCommands = 18
+    # Server tells the owner the last command it ran on an object, and the
+    # tick it ran it on.
+    SV_CommandAck = 19
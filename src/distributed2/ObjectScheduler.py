@@ -0,0 +1,131 @@
+from direct.directnotify.DirectNotifyGlobal import directNotify
+
+class ObjectScheduler:
+    """
+    Runs the per-tick update() of a repository's distributed objects.
+
+    Objects are run in groups by their class's updatePhase, lowest first.
+    Every object in a phase finishes before the next phase starts, so an
+    object can rely on everything in earlier phases being up to date.
+    Objects that are asleep are skipped.
+
+    Within a phase, objects of classes that set updateThreaded are split
+    across the worker threads of an AsyncTaskChain while the rest run on the
+    calling thread.  This only gains anything if their update() spends most
+    of its time in C++ code that releases the GIL, such as physics or path
+    finding.  With no worker threads, everything runs serially.
+
+    The time spent in update() is accumulated per class.
+    """
+
+    notify = directNotify.newCategory("ObjectScheduler")
+
+    def __init__(self, chainName, numThreads = 0, taskMgr = None):
+        self.chainName = chainName
+        self.numThreads = numThreads
+        self.taskMgr = taskMgr
+        self.chain = None
+        if numThreads > 0:
+            if self.taskMgr is None:
+                self.taskMgr = base.simTaskMgr
+            self.taskMgr.setupTaskChain(chainName, numThreads = numThreads)
+            self.chain = self.taskMgr.mgr.findTaskChain(chainName)
+
+        self.resetStats()
+
+    def resetStats(self):
+        """ Forgets the accumulated update timings. """
+        # Maps class name to [number of updates, total seconds, max seconds].
+        self.classStats = {}
+
+    def getStats(self):
+        """
+        Returns a dictionary mapping class name to a dictionary of the count,
+        total, mean and max update times in seconds since the last reset.
+        """
+        stats = {}
+        for name, (count, total, maxTime) in self.classStats.items():
+            stats[name] = {'count': count,
+                           'total': total,
+                           'mean': total / count if count else 0.0,
+                           'max': maxTime}
+        return stats
+
+    def getSummary(self, n = 10):
+        """ Returns a report of the n classes with the most update time. """
+        stats = sorted(self.getStats().items(), key = lambda item: item[1]['total'],
+                       reverse = True)[:n]
+        lines = []
+        for name, s in stats:
+            lines.append("%s: %i updates, total %.2f ms, mean %.3f ms, max %.3f ms" %
+                         (name, s['count'], s['total'] * 1000, s['mean'] * 1000,
+                          s['max'] * 1000))
+        return "\n".join(lines)
+
+    def runUpdates(self, objects):
+        """ Runs update() on the indicated distributed objects. """
+        phases = {}
+        for do in objects:
+            if do._asleep:
+                continue
+            phase = phases.get(do.updatePhase)
+            if phase is None:
+                phase = ([], [])
+                phases[do.updatePhase] = phase
+            if do.updateThreaded and self.chain:
+                phase[1].append(do)
+            else:
+                phase[0].append(do)
+
+        for key in sorted(phases.keys()):
+            serial, threaded = phases[key]
+            jobStats = []
+            if threaded:
+                jobStats = self.__startThreaded(threaded)
+            self.__runObjects(serial, self.classStats)
+            if threaded:
+                # Nothing in the next phase may start until this one is done.
+                self.chain.waitForTasks()
+                for stats in jobStats:
+                    self.__mergeStats(stats)
+
+    def __startThreaded(self, objects):
+        # Each job counts into its own table, which are merged once the jobs
+        # are done, so the threads never touch the same counters.
+        numJobs = min(self.numThreads, len(objects))
+        jobStats = []
+        for i in range(numJobs):
+            stats = {}
+            jobStats.append(stats)
+            self.taskMgr.add(self.__runObjectsTask, "%s-%i" % (self.chainName, i),
+                             extraArgs = [objects[i::numJobs], stats], appendTask = True,
+                             taskChain = self.chainName)
+        return jobStats
+
+    def __runObjectsTask(self, objects, classStats, task):
+        self.__runObjects(objects, classStats)
+        return task.done
+
+    def __mergeStats(self, jobStats):
+        for name, (count, total, maxTime) in jobStats.items():
+            stats = self.classStats.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += count
+            stats[1] += total
+            stats[2] = max(stats[2], maxTime)
+
+    def __runObjects(self, objects, classStats):
+        getTime = globalClock.getRealTime
+        for do in objects:
+            start = getTime()
+            do.update()
+            elapsed = getTime() - start
+
+            name = do.__class__.__name__
+            stats = classStats.get(name)
+            if stats is None:
+                stats = [0, 0.0, 0.0]
+                classStats[name] = stats
+            stats[0] += 1
+            stats[1] += elapsed
+            if elapsed > stats[2]:
+                stats[2] = elapsed
@@ -1,4 +1,4 @@
-from panda3d.core import ConfigVariableBool, ConfigVariableString, ConfigVariableInt
+from panda3d.core import ConfigVariableBool, ConfigVariableString, ConfigVariableInt, ConfigVariableDouble
 
 # Server related config variables
 sv_max_clients = ConfigVariableInt("sv_max_clients", 24)
@@ -10,3 +10,30 @@ sv_tickrate = ConfigVariableInt("sv_tickrate", 66)
 sv_snapshot_history = ConfigVariableInt("sv_snapshot_history", 50)
 sv_port = ConfigVariableInt("sv_port", 27015)
 sv_alternateticks = ConfigVariableBool("sv_alternateticks", False)
+# How many worker threads format per-client snapshots?  0 formats them on
+# the main thread.
+sv_snapshot_encode_threads = ConfigVariableInt("sv_snapshot_encode_threads", 0)
+# Budget per client per tick for generating objects in zones the client just
+# opened interest in.  Generates that don't fit are spread over the following
+# ticks.  0 means no limit.
+sv_interest_generate_bytes = ConfigVariableInt("sv_interest_generate_bytes", 0)
+sv_interest_generate_ms = ConfigVariableDouble("sv_interest_generate_ms", 0.0)
+# Send snapshots unreliably?  Lost snapshots are recovered by deltas against
+# the last tick the client acknowledged, instead of by retransmission.
+sv_unreliable_snapshots = ConfigVariableBool("sv_unreliable_snapshots", True)
+# How many ticks of timing history the tick profiler keeps, and how often in
+# seconds it logs a summary (0 to never log).
+sv_tick_stats_history = ConfigVariableInt("sv_tick_stats_history", 600)
+sv_tick_stats_log_interval = ConfigVariableDouble("sv_tick_stats_log_interval", 0.0)
+# Number of worker threads that run the updates of objects marked
+# updateThreaded.  0 runs every object update on the main thread.
+sv_sim_threads = ConfigVariableInt("sv_sim_threads", 0)
+# How many queued user commands an object may run per tick, letting it catch
+# up after commands arrive in a burst, and how many it may have queued.
+# Commands beyond the backlog are dropped.
+sv_max_commands_per_tick = ConfigVariableInt("sv_max_commands_per_tick", 2)
+sv_max_command_backlog = ConfigVariableInt("sv_max_command_backlog", 16)
+# Bytes per second of snapshot data each client may be sent.  When a
+# snapshot would go over, the most important objects are sent and the rest
+# wait for a later snapshot.  0 means no limit.
+sv_client_bandwidth = ConfigVariableInt("sv_client_bandwidth", 0)
@@ -1,6 +1,7 @@
 from panda3d.bsp import NetworkSystem, NetworkCallbacks, NetworkConnectionInfo, NetworkMessage
 from panda3d.core import UniqueIdAllocator, HashVal
 from panda3d.direct import FrameSnapshot, ClientFrameManager, ClientFrame, FrameSnapshotManager, DCPacker
+from panda3d.direct import SnapshotBudget
 
 from direct.distributed.PyDatagram import PyDatagram
 from direct.showbase.DirectObject import DirectObject
@@ -9,8 +10,13 @@ from direct.directnotify.DirectNotifyGlobal import directNotify
 from .NetMessages import NetMessages
 from .ServerConfig import *
 from .BaseObjectManager import BaseObjectManager
+from .TickProfiler import TickProfiler
+from .ObjectScheduler import ObjectScheduler
+from .InterestGrid import InterestGrid
+from .InterestRegistry import InterestRegistry
 
 from enum import IntEnum
+from collections import deque
 
 class ClientState(IntEnum):
 
@@ -58,6 +64,46 @@ class ServerRepository(BaseObjectManager):
             self.explicitInterestZoneIds = set()
             self.currentInterestZoneIds = set()
 
+            # Messages queued up to be sent to the client at the end of the
+            # tick.  Each entry is [msgType, doId, payload].  A msgType of
+            # None means the message was cancelled.
+            self.pendingMessages = []
+            # Generates in pendingMessages by doId, so a delete of the same
+            # object in the same tick can cancel them out.
+            self.pendingGenerates = {}
+
+            # Objects in newly opened interest zones still waiting to be
+            # generated for the client, when generates are rate limited.
+            # The set is authoritative; the deque keeps the order and may
+            # hold objects that were since dropped from the set.
+            self.interestGenerateQueue = deque()
+            self.interestGenerateIds = set()
+            # Interest handles to complete once the queue drains.
+            self.pendingInterestHandles = []
+
+            # Owned objects that have run user commands, whose last command
+            # is acknowledged with each snapshot.
+            self.commandObjects = set()
+
+            # Owned object whose position drives proximity interest, the
+            # radius around it, and the grid zones currently in range.
+            self.interestAnchor = None
+            self.interestRadius = 0.0
+            self.proximityZoneIds = set()
+
+            # Bytes per second of snapshot data we may send the client, or 0
+            # for no limit.
+            self.bandwidth = sv_client_bandwidth.getValue()
+            # Objects left out of snapshots to stay within the bandwidth, by
+            # doId, as [base tick, last tick skipped].  The base tick is the
+            # last state of the object the client is known to have.
+            self.skippedObjects = {}
+            # Priority built up by skipped objects, by doId.
+            self.snapshotPriorities = {}
+            # Objects sent against their own base tick, by snapshot tick.
+            # Once the client acknowledges the snapshot, they are caught up.
+            self.rebasedSnapshots = {}
+
         def getClientFrame(self, tick):
             return self.frameMgr.getClientFrame(tick)
 
@@ -88,12 +134,27 @@ class ServerRepository(BaseObjectManager):
         self.objectIdAllocator = UniqueIdAllocator(0, 0xFFFF)
         self.numClients = 0
         self.clientsByConnection = {}
-        self.zonesToClients = {}
+        self.interest = InterestRegistry()
 
         self.snapshotMgr = FrameSnapshotManager()
+        self.snapshotMgr.setNumEncodeThreads(sv_snapshot_encode_threads.getValue())
 
         self.objectsByZoneId = {}
 
+        self.tickProfiler = TickProfiler(sv_tick_stats_history.getValue(),
+                                         sv_tick_stats_log_interval.getValue())
+
+        self.objectScheduler = ObjectScheduler("serverSimObjects", sv_sim_threads.getValue())
+
+        # Owned objects with user commands waiting to run.
+        self.commandObjects = set()
+
+        # Grid used for proximity interest, if enabled.
+        self.interestGrid = None
+
+        # DemoRecorder writing everything we send to a file, if recording.
+        self.demoRecorder = None
+
         base.setTickRate(sv_tickrate.getValue())
         base.simTaskMgr.add(self.runFrame, "serverRunFrame", sort = -100)
 
@@ -113,79 +174,220 @@ class ServerRepository(BaseObjectManager):
         do.owner = owner
         self.doId2do[do.doId] = do
         self.objectsByZoneId.setdefault(do.zoneId, []).append(do)
+        ownerOpensZone = False
         if owner:
             owner.objectsByDoId[do.doId] = do
+            ownerOpensZone = do.zoneId not in owner.objectsByZoneId
             owner.objectsByZoneId.setdefault(do.zoneId, set()).add(do)
 
         do.generate()
 
-        clients = set(self.zonesToClients.get(do.zoneId, set()))
-        if len(clients) > 0:
-            if owner:
-                # Don't include the owner in this message, we send specific
-                # generate for the owner.
-                clients -= set(owner)
-            dg = PyDatagram()
-            dg.addUint16(NetMessages.SV_GenerateObject)
-            self.packObjectGenerate(dg, do)
-            # Inform clients interested in the object's zone
-            for client in clients:
-                self.sendDatagram(dg, client.connection)
+        # Inform clients interested in the object's zone
+        for client in self.interest.getClients(do.zoneId):
+            if client != owner:
+                # Don't include the owner, we send specific generate for the
+                # owner.
+                self.queueGenerate(client, do)
 
         if owner:
             # Send a specific owner generate
-            dg = PyDatagram()
-            dg.addUint16(NetMessages.SV_GenerateOwnerObject)
-            self.packObjectGenerate(dg, do)
-            self.sendDatagram(dg, owner.connection)
+            self.queueGenerate(owner, do, NetMessages.SV_GenerateOwnerObject)
 
             # Follow interest system. Client implicitly has interest in the
             # location of owned objects.
-            self.updateClientInterestZones(owner)
+            if ownerOpensZone:
+                self.addClientInterest(owner, [do.zoneId])
+
+        if self.demoRecorder:
+            self.demoRecorder.recordGenerate(do)
 
         do.announceGenerate()
 
     def deleteObject(self, do, removeFromOwnerTable = True):
         del self.doId2do[do.doId]
+        self.commandObjects.discard(do)
+        if do.owner is not None:
+            do.owner.commandObjects.discard(do)
         self.objectsByZoneId[do.zoneId].remove(do)
         if not self.objectsByZoneId[do.zoneId]:
             del self.objectsByZoneId[do.zoneId]
 
+        ownerClosesZone = False
         if removeFromOwnerTable and (do.owner is not None):
             client = do.owner
             client.objectsByZoneId[do.zoneId].remove(do)
             if not client.objectsByZoneId[do.zoneId]:
                 del client.objectsByZoneId[do.zoneId]
+                ownerClosesZone = True
             del client.objectsByDoId[do.doId]
 
-        clients = self.zonesToClients.get(do.zoneId, set())
-        if len(clients) > 0:
-            # Inform any clients that see the object
-            dg = PyDatagram()
-            dg.addUint16(NetMessages.SV_DeleteObject)
-            dg.addUint32(do.doId)
-            for client in clients:
-                self.sendDatagram(dg, client.connection)
+        if do.owner is not None and do.owner.interestAnchor is do:
+            self.setClientInterestAnchor(do.owner, None)
+
+        # Inform any clients that see the object
+        for client in self.interest.getClients(do.zoneId):
+            if do.doId in client.interestGenerateIds:
+                # Never made it to the client.
+                client.interestGenerateIds.remove(do.doId)
+                continue
+            self.queueDelete(client, do.doId)
+
+        if ownerClosesZone:
+            # That was the owner's last object in the zone.
+            self.removeClientInterest(do.owner, [do.zoneId])
+
+        if self.demoRecorder:
+            self.demoRecorder.recordDelete(do.doId)
 
         # Forget this object in the packet history
         self.snapshotMgr.removePrevSentPacket(do.doId)
 
         do.delete()
 
+    def setObjectZone(self, do, zoneId):
+        """
+        Moves a generated object into a different zone.  Clients that can
+        only see the old zone get a delete, and clients that can only see the
+        new zone get a generate.
+        """
+        oldZoneId = do.zoneId
+        if zoneId == oldZoneId:
+            return
+
+        self.objectsByZoneId[oldZoneId].remove(do)
+        if not self.objectsByZoneId[oldZoneId]:
+            del self.objectsByZoneId[oldZoneId]
+        self.objectsByZoneId.setdefault(zoneId, []).append(do)
+        do.zoneId = zoneId
+
+        interest = self.interest
+        for client in interest.getClients(oldZoneId):
+            if client == do.owner or interest.hasInterest(client, zoneId):
+                continue
+            if do.doId in client.interestGenerateIds:
+                # Never made it to the client.
+                client.interestGenerateIds.remove(do.doId)
+                continue
+            self.queueDelete(client, do.doId)
+
+        for client in interest.getClients(zoneId):
+            if client != do.owner and not interest.hasInterest(client, oldZoneId):
+                self.queueGenerate(client, do)
+
+        owner = do.owner
+        if owner:
+            # The owner follows its objects.
+            if zoneId not in owner.objectsByZoneId:
+                self.addClientInterest(owner, [zoneId])
+            owner.objectsByZoneId.setdefault(zoneId, set()).add(do)
+            owner.objectsByZoneId[oldZoneId].remove(do)
+            if not owner.objectsByZoneId[oldZoneId]:
+                del owner.objectsByZoneId[oldZoneId]
+                self.removeClientInterest(owner, [oldZoneId])
+
+    def setInterestGrid(self, grid):
+        """
+        Enables proximity interest using the indicated InterestGrid, or
+        disables it if grid is None.
+        """
+        self.interestGrid = grid
+        for client in self.clientsByConnection.values():
+            self.updateProximityInterest(client)
+
+    def setObjectPosition(self, do, x, y):
+        """
+        Tells the server where the object is on the ground plane.  With an
+        interest grid, this moves the object into the zone of its grid cell,
+        and updates the proximity interest of the client it anchors.
+        """
+        do.interestPos = (x, y)
+        if not self.interestGrid:
+            return
+
+        self.setObjectZone(do, self.interestGrid.getZoneForPosition(x, y))
+        if do.owner is not None and do.owner.interestAnchor is do:
+            self.updateProximityInterest(do.owner)
+
+    def setClientInterestAnchor(self, client, do, radius = 0.0):
+        """
+        Gives the client interest in all grid cells within radius of the
+        indicated object, which the client must own.  Pass None to stop.
+        """
+        assert do is None or do.owner == client
+        client.interestAnchor = do
+        client.interestRadius = radius
+        self.updateProximityInterest(client)
+
+    def updateProximityInterest(self, client):
+        anchor = client.interestAnchor
+        if not self.interestGrid or anchor is None or anchor.interestPos is None:
+            zoneIds = set()
+        else:
+            x, y = anchor.interestPos
+            zoneIds = self.interestGrid.updateInterest(client.proximityZoneIds, x, y,
+                                                       client.interestRadius)
+
+        if zoneIds != client.proximityZoneIds:
+            added = zoneIds - client.proximityZoneIds
+            removed = client.proximityZoneIds - zoneIds
+            client.proximityZoneIds = zoneIds
+            self.addClientInterest(client, added)
+            self.removeClientInterest(client, removed)
+
+    def getInterestPriority(self, client, do):
+        """
+        Returns how important the object is to the client.  With proximity
+        interest, this falls off with distance from the client's anchor.
+        """
+        anchor = client.interestAnchor
+        if not self.interestGrid or anchor is None or anchor.interestPos is None \
+            or do.interestPos is None:
+            return do.interestPriority
+
+        dx = do.interestPos[0] - anchor.interestPos[0]
+        dy = do.interestPos[1] - anchor.interestPos[1]
+        distance = (dx * dx + dy * dy) ** 0.5
+        return do.interestPriority / (1.0 + distance / self.interestGrid.cellSize)
+
     def simObjects(self):
-        for do in self.doId2do.values():
-            do.update()
+        self.objectScheduler.runUpdates(self.doId2do.values())
 
     def runFrame(self, task):
+        prof = self.tickProfiler
+        prof.beginTick()
+
         self.readerPollUntilEmpty()
+        prof.mark('readerPoll')
         self.runCallbacks()
+        prof.mark('runCallbacks')
+
+        self.runUserCommands()
+        prof.mark('userCommands')
 
         self.simObjects()
+        prof.mark('simObjects')
+
+        self.processInterestGenerates()
+        prof.mark('interestGenerates')
+
+        # Get generates and deletes out before the snapshot that may
+        # reference the objects.
+        self.flushClientMessages()
+        prof.mark('flushMessages')
 
         self.takeTickSnapshot(base.tickCount)
 
+        prof.endTick()
+
         return task.cont
 
+    def getTickProfiler(self):
+        """
+        Returns the TickProfiler that records the server's per-tick timings
+        and bytes sent.
+        """
+        return self.tickProfiler
+
     def clientNeedsUpdate(self, client):
         return client.isVerified() and client.nextUpdateTime <= globalClock.getFrameTime()
 
@@ -197,7 +399,6 @@ class ServerRepository(BaseObjectManager):
 
     def takeTickSnapshot(self, tickCount):
         self.notify.debug("Take tick snapshot at tick %i" % tickCount)
-        snap = FrameSnapshot(tickCount, len(self.doId2do))
 
         # Build a set of all unique client interest zones (for clients that needs snapshots)
         clientsNeedingSnapshots = []
@@ -206,44 +407,186 @@ class ServerRepository(BaseObjectManager):
             if self.clientNeedsUpdate(client):
                 # Factor in this client's interest zones
                 clientZones |= client.currentInterestZoneIds
-                # Calculate when the next update should be
-                client.nextUpdateTime = globalClock.getFrameTime() + client.updateInterval
-                client.setupPackInfo(snap)
                 clientsNeedingSnapshots.append(client)
 
-        if len(clientsNeedingSnapshots) == 0:
+        recorder = self.demoRecorder
+        if recorder:
+            # The demo sees every object.
+            clientZones |= set(self.objectsByZoneId.keys())
+
+        if len(clientsNeedingSnapshots) == 0 and not recorder:
             # No clients need snapshots, punt
             self.notify.debug("Punting, no clients need snapshot")
             return
 
         self.notify.debug("All unique client interest zones: %s" % repr(clientZones))
 
-        # Pack all objects visible by at least one client into the snapshot.
-        items = list(self.doId2do.items())
-        for i in range(len(items)):
-            doId, do = items[i]
+        # Only walk the objects that live in zones seen by at least one
+        # client, rather than every object on the server.  Zones are visited
+        # in sorted order and objects in generate order, so an object keeps
+        # the same entry index across ticks as long as the set of visible
+        # objects doesn't change.
+        visibleObjects = []
+        for zoneId in sorted(clientZones):
+            zoneObjects = self.objectsByZoneId.get(zoneId)
+            if zoneObjects:
+                visibleObjects += zoneObjects
+
+        snap = FrameSnapshot(tickCount, len(visibleObjects))
 
-            if do.zoneId not in clientZones:
-                # Object not seen by any clients, omit from snapshot
+        for client in clientsNeedingSnapshots:
+            # Calculate when the next update should be
+            client.nextUpdateTime = globalClock.getFrameTime() + client.updateInterval
+            client.setupPackInfo(snap)
+
+        # Pack all objects visible by at least one client into the snapshot.
+        for i in range(len(visibleObjects)):
+            do = visibleObjects[i]
+            if not do.isStateChanged() and \
+                self.snapshotMgr.packUnchangedObjectInSnapshot(snap, i, do.doId, do.zoneId, do.dclass):
+                # Nothing changed on the object since it was last packed,
+                # reuse the previous packet.
                 continue
 
-            self.snapshotMgr.packObjectInSnapshot(snap, i, do, doId, do.zoneId, do.dclass)
+            self.snapshotMgr.packObjectInSnapshot(snap, i, do, do.doId, do.zoneId, do.dclass)
+            do.clearStateChanged()
+
+        self.tickProfiler.mark('snapshotPack')
+
+        # Clients that acknowledged the same tick and see the same set of
+        # objects receive byte-identical snapshots, so only format one
+        # datagram per distinct (from tick, interest zones, excluded objects)
+        # view and share it.  The to-tick is implied, since the cache only
+        # lives for this snapshot.
+        formattedSnapshots = {}
+        clientDatagrams = []
 
-        # Send it out to whoever needs it
         for client in clientsNeedingSnapshots:
             # Get the frame the client most recently acknowledged
             oldFrame = client.getClientFrame(client.tickCount)
 
             client.lastSnapshot = snap
 
-            dg = PyDatagram()
-            dg.addUint16(NetMessages.SV_Tick)
             if oldFrame:
-                # We have an old frame to delta against
-                self.snapshotMgr.clientFormatDeltaSnapshot(dg, oldFrame.getSnapshot(), snap, list(client.currentInterestZoneIds))
+                fromTick = oldFrame.getTickCount()
             else:
-                self.snapshotMgr.clientFormatSnapshot(dg, snap, list(client.currentInterestZoneIds))
-            self.sendDatagram(dg, client.connection)
+                fromTick = -1
+            # Objects the client hasn't been sent a generate for yet must
+            # be left out of its snapshot.
+            excludeDoIds = frozenset(client.interestGenerateIds)
+            viewKey = (fromTick, frozenset(client.currentInterestZoneIds), excludeDoIds)
+
+            # A client with a bandwidth limit gets its own snapshot.
+            budget = self.makeSnapshotBudget(client)
+
+            dg = formattedSnapshots.get(viewKey) if budget is None else None
+            if dg is None:
+                dg = PyDatagram()
+                dg.addUint16(NetMessages.SV_Tick)
+                # The actual formatting happens below, possibly on the
+                # encode threads.
+                if oldFrame:
+                    # We have an old frame to delta against
+                    self.snapshotMgr.queueClientFormatDeltaSnapshot(dg, oldFrame.getSnapshot(), snap, list(client.currentInterestZoneIds), list(excludeDoIds), budget)
+                else:
+                    self.snapshotMgr.queueClientFormatSnapshot(dg, snap, list(client.currentInterestZoneIds), list(excludeDoIds), budget)
+                if budget is None:
+                    formattedSnapshots[viewKey] = dg
+
+            clientDatagrams.append((client, dg, budget, fromTick))
+
+        if recorder:
+            recorder.queueSnapshot(snap)
+
+        # Format all of the distinct client snapshots.  This releases the GIL
+        # and spreads the work over sv_snapshot_encode_threads threads.
+        self.snapshotMgr.formatQueuedSnapshots()
+        self.tickProfiler.mark('snapshotFormat')
+
+        if recorder:
+            recorder.writeSnapshot()
+
+        # Send it out to whoever needs it
+        reliable = not sv_unreliable_snapshots.getValue()
+        for client, dg, budget, fromTick in clientDatagrams:
+            if budget is not None:
+                self.recordSnapshotBudget(client, budget, fromTick, tickCount)
+            if client.commandObjects:
+                dg = self.bundleCommandAcks(client, dg, tickCount)
+            self.tickProfiler.countBytes(client.id, NetMessages.SV_Tick, dg.getLength())
+            self.sendDatagram(dg, client.connection, reliable)
+        self.tickProfiler.mark('snapshotSend')
+
+    def bundleCommandAcks(self, client, snapshotDg, tick):
+        """
+        Returns a bundle of the snapshot, preceded by an acknowledgement of
+        the last user command run on each of the client's objects.  They go
+        out in one datagram, so the client always knows which of its
+        commands the state in the snapshot includes.
+        """
+        bundle = PyDatagram()
+        bundle.addUint16(NetMessages.SV_MessageBundle)
+        for do in client.commandObjects:
+            if do.doId in client.skippedObjects:
+                # Left out to save bandwidth, the client still has its old
+                # state.
+                continue
+            dg = PyDatagram()
+            dg.addUint16(NetMessages.SV_CommandAck)
+            dg.addUint32(do.doId)
+            dg.addUint32(do.lastRunCommand)
+            dg.addUint32(tick)
+            bundle.addUint32(dg.getLength())
+            bundle.appendData(dg.getMessage())
+        bundle.addUint32(snapshotDg.getLength())
+        bundle.appendData(snapshotDg.getMessage())
+        return bundle
+
+    def makeSnapshotBudget(self, client):
+        """
+        Returns a SnapshotBudget limiting the client's next snapshot to its
+        share of the client's bandwidth, with each object in its interest
+        ranked by priority, or None if the client has no limit.
+        """
+        if client.bandwidth <= 0 or client.updateInterval <= 0:
+            return None
+
+        budget = SnapshotBudget(max(1, int(client.bandwidth * client.updateInterval)))
+
+        accumulated = client.snapshotPriorities
+        for zoneId in client.currentInterestZoneIds:
+            for do in self.objectsByZoneId.get(zoneId, ()):
+                budget.setPriority(do.doId, self.getInterestPriority(client, do) +
+                                   accumulated.get(do.doId, 0.0))
+
+        for doId, (baseTick, _) in client.skippedObjects.items():
+            budget.setBaseTick(doId, baseTick)
+
+        return budget
+
+    def recordSnapshotBudget(self, client, budget, fromTick, tickCount):
+        """
+        Remembers which objects were left out of the client's snapshot, so
+        they build up priority and are caught up later.
+        """
+        priorities = {}
+        for doId in budget.getSkippedObjects():
+            # Keep the priority it had this time, accumulated so far.
+            priorities[doId] = budget.getPriority(doId)
+            entry = client.skippedObjects.get(doId)
+            if entry:
+                entry[1] = tickCount
+            else:
+                client.skippedObjects[doId] = [fromTick, tickCount]
+        client.snapshotPriorities = priorities
+
+        rebased = list(budget.getRebasedObjects())
+        if rebased:
+            client.rebasedSnapshots[tickCount] = rebased
+            if len(client.rebasedSnapshots) > 128:
+                # The client isn't acknowledging.  Forgetting the record just
+                # means the objects are caught up again later.
+                del client.rebasedSnapshots[next(iter(client.rebasedSnapshots))]
 
     def isFull(self):
         return self.numClients >= sv_max_clients.getValue()
@@ -300,6 +643,8 @@ class ServerRepository(BaseObjectManager):
                 self.handleClientSetInterest(client, dgi)
             elif type == NetMessages.B_ObjectMessage:
                 self.handleObjectMessage(client, dgi)
+            elif type == NetMessages.CL_UserCommands:
+                self.handleClientUserCommands(client, dgi)
 
     def sendUpdate(self, do, name, args, client = None):
         if not do:
@@ -330,13 +675,18 @@ class ServerRepository(BaseObjectManager):
         if not client:
             if field.isBroadcast():
                 # Send to all interested clients
-                for cl in self.zonesToClients.get(do.zoneId, set()):
-                    self.sendDatagram(dg, cl.connection)
+                for cl in self.interest.getClients(do.zoneId):
+                    if do.doId in cl.interestGenerateIds:
+                        # Client doesn't know about the object yet.
+                        continue
+                    self.queueDatagram(cl, NetMessages.B_ObjectMessage, dg, do.doId)
+                if self.demoRecorder:
+                    self.demoRecorder.recordDatagram(NetMessages.B_ObjectMessage, dg, do.doId)
             else:
                 self.notify.warning("Can't send non-broadcast object message without a target client")
                 return
         else:
-            self.sendDatagram(dg, client.connection)
+            self.queueDatagram(client, NetMessages.B_ObjectMessage, dg, do.doId)
 
     def handleObjectMessage(self, client, dgi):
         doId = dgi.getUint32()
@@ -382,11 +732,14 @@ class ServerRepository(BaseObjectManager):
         """ Called when client wants to add interest into a set of zones """
         handle = dgi.getUint8()
         numZones = dgi.getUint8()
+        added = []
         for _ in range(numZones):
             zoneId = dgi.getUint32()
-            client.explicitInterestZoneIds.add(zoneId)
+            if zoneId not in client.explicitInterestZoneIds:
+                client.explicitInterestZoneIds.add(zoneId)
+                added.append(zoneId)
 
-        self.updateClientInterestZones(client)
+        self.addClientInterest(client, added)
         self.sendInterestComplete(client, handle)
 
     def handleClientRemoveInterest(self, client, dgi):
@@ -394,27 +747,35 @@ class ServerRepository(BaseObjectManager):
 
         handle = dgi.getUint8()
         numZones = dgi.getUint8()
+        removed = []
         for _ in range(numZones):
             zoneId = dgi.getUint32()
 
             if zoneId in client.explicitInterestZoneIds:
                 client.explicitInterestZoneIds.remove(zoneId)
+                removed.append(zoneId)
 
-        self.updateClientInterestZones(client)
+        self.removeClientInterest(client, removed)
         self.sendInterestComplete(client, handle)
 
     def handleClientSetInterest(self, client, dgi):
         """ Called when client wants to completely replace its interest zones """
 
-        client.explicitInterestZoneIds = set()
+        zoneIds = set()
 
         handle = dgi.getUint8()
         numZones = dgi.getUint8()
         for _ in range(numZones):
             zoneId = dgi.getUint32()
-            client.explicitInterestZoneIds.add(zoneId)
-
-        self.updateClientInterestZones(client)
+            zoneIds.add(zoneId)
+
+        added = zoneIds - client.explicitInterestZoneIds
+        removed = client.explicitInterestZoneIds - zoneIds
+        client.explicitInterestZoneIds = zoneIds
+        # Add first, so zones that are also seen for another reason don't
+        # go out of view in between.
+        self.addClientInterest(client, added)
+        self.removeClientInterest(client, removed)
         self.sendInterestComplete(client, handle)
 
     def packObjectGenerate(self, dg, object):
@@ -432,56 +793,229 @@ class ServerRepository(BaseObjectManager):
         else:
             dg.addUint8(0)
 
-    def updateClientInterestZones(self, client):
-        origZoneIds = client.currentInterestZoneIds
-        newZoneIds = client.explicitInterestZoneIds | set(client.objectsByZoneId.keys())
-        if origZoneIds == newZoneIds:
-            # No change.
-            return
-
-        client.currentInterestZoneIds = newZoneIds
-        addedZoneIds = newZoneIds - origZoneIds
-        removedZoneIds = origZoneIds - newZoneIds
-
-        dg = PyDatagram()
-        dg.addUint16(NetMessages.SV_GenerateObject)
-        for zoneId in addedZoneIds:
-            self.zonesToClients.setdefault(zoneId, set()).add(client)
-
+    def addClientInterest(self, client, zoneIds):
+        """
+        Adds a reference on each of the zones to the client's interest, and
+        generates the objects in the ones it couldn't see before.
+        """
+        opened = self.interest.addRefs(client, zoneIds)
+        if opened:
+            self.openClientZones(client, opened)
+
+    def removeClientInterest(self, client, zoneIds):
+        """
+        Removes a reference on each of the zones from the client's interest,
+        and deletes the objects in the ones it can no longer see.
+        """
+        closed = self.interest.removeRefs(client, zoneIds)
+        if closed:
+            self.closeClientZones(client, closed)
+
+    def openClientZones(self, client, zoneIds):
+        rateLimited = sv_interest_generate_bytes.getValue() > 0 or \
+            sv_interest_generate_ms.getValue() > 0
+
+        queued = []
+        for zoneId in zoneIds:
             # The client is opening interest in this zone. Need to inform
             # client of all objects in this zone.
             for object in self.objectsByZoneId.get(zoneId, []):
                 if object.owner != client:
                     # Don't do this if the client owns the object, it should
                     # already be generated for them.
-                    self.packObjectGenerate(dg, object)
-
-        self.sendDatagram(dg, client.connection)
-
-        dg = PyDatagram()
-        dg.addUint16(NetMessages.SV_DeleteObject)
-        for zoneId in removedZoneIds:
-            self.zonesToClients[zoneId].remove(client)
+                    if rateLimited:
+                        # Trickle it out in processInterestGenerates().
+                        queued.append(object)
+                        client.interestGenerateIds.add(object.doId)
+                    else:
+                        self.queueGenerate(client, object)
+
+        if queued:
+            # Most important objects first.
+            queued.sort(key = lambda object: self.getInterestPriority(client, object),
+                        reverse = True)
+            client.interestGenerateQueue.extend(queued)
+
+    def closeClientZones(self, client, zoneIds):
+        for zoneId in zoneIds:
             # The client is abandoning interest in this zone. Any
             # objects in this zone should be deleted on the client.
             for object in self.objectsByZoneId.get(zoneId, []):
                 if object.owner != client:
                     # Never delete objects owned by this client on interest change.
-                    dg.addUint32(object.doId)
-        self.sendDatagram(dg, client.connection)
+                    if object.doId in client.interestGenerateIds:
+                        # Never made it to the client.
+                        client.interestGenerateIds.remove(object.doId)
+                    else:
+                        self.queueDelete(client, object.doId)
+
+    def processInterestGenerates(self):
+        """
+        Generates queued interest objects for each client, up to the
+        per-client byte and time budgets for this tick.
+        """
+        budgetBytes = sv_interest_generate_bytes.getValue()
+        budgetTime = sv_interest_generate_ms.getValue() / 1000.0
+
+        for client in self.clientsByConnection.values():
+            if not client.interestGenerateQueue:
+                continue
+
+            startTime = globalClock.getRealTime()
+            numBytes = 0
+            queue = client.interestGenerateQueue
+            while queue:
+                object = queue.popleft()
+                if object.doId not in client.interestGenerateIds:
+                    # Deleted or interest removed since it was queued.
+                    continue
+                client.interestGenerateIds.remove(object.doId)
+                self.queueGenerate(client, object)
+
+                baseline = self.snapshotMgr.findOrCreateObjectPacketForBaseline(
+                    object, object.dclass, object.doId)
+                # Class, doId, zoneId and has-state header plus the state.
+                numBytes += 11
+                if baseline:
+                    numBytes += baseline.getLength()
+
+                if budgetBytes > 0 and numBytes >= budgetBytes:
+                    break
+                if budgetTime > 0 and globalClock.getRealTime() - startTime >= budgetTime:
+                    break
+
+            if not client.interestGenerateIds:
+                # Everything has been sent, now the interest operations are
+                # really complete.
+                queue.clear()
+                self.flushInterestComplete(client)
 
     def sendInterestComplete(self, client, handle):
-        dg = PyDatagram()
-        dg.addUint16(NetMessages.SV_InterestComplete)
-        dg.addUint8(handle)
-        self.sendDatagram(dg, client.connection)
+        # Interest operations complete in the order they were made, so the
+        # handle waits behind any earlier ones, and until the objects still
+        # being generated for the client have all gone out.
+        client.pendingInterestHandles.append(handle)
+        if not client.interestGenerateIds:
+            self.flushInterestComplete(client)
+
+    def flushInterestComplete(self, client):
+        """ Completes the client's pending interest handles, oldest first. """
+        handles = client.pendingInterestHandles
+        client.pendingInterestHandles = []
+        for handle in handles:
+            dg = PyDatagram()
+            dg.addUint16(NetMessages.SV_InterestComplete)
+            dg.addUint8(handle)
+            self.queueDatagram(client, NetMessages.SV_InterestComplete, dg)
+
+    def queueGenerate(self, client, do, msgType = NetMessages.SV_GenerateObject):
+        """
+        Queues up a generate of the object for the client.  The object's
+        baseline is packed when the queue is flushed.
+        """
+        entry = [msgType, do.doId, do]
+        client.pendingMessages.append(entry)
+        client.pendingGenerates[do.doId] = entry
+
+    def queueDelete(self, client, doId):
+        """
+        Queues up a delete of the object for the client.  If the client had
+        a generate for the object queued this tick, the two cancel out along
+        with any messages sent to the object in between.
+        """
+        client.skippedObjects.pop(doId, None)
+        client.snapshotPriorities.pop(doId, None)
+
+        entry = client.pendingGenerates.pop(doId, None)
+        if not entry:
+            client.pendingMessages.append([NetMessages.SV_DeleteObject, doId, None])
+            return
+
+        cancelling = False
+        for pending in client.pendingMessages:
+            if pending is entry:
+                cancelling = True
+            if cancelling and pending[1] == doId:
+                pending[0] = None
+
+    def queueDatagram(self, client, msgType, dg, doId = None):
+        """
+        Queues up the datagram to be sent to the client at the end of the
+        tick.  doId is the object the message is about, if any.
+        """
+        client.pendingMessages.append([msgType, doId, dg])
+
+    def flushClientMessages(self):
+        for client in self.clientsByConnection.values():
+            if client.pendingMessages:
+                self.flushMessages(client)
+        if self.demoRecorder:
+            self.demoRecorder.flush()
+
+    def flushMessages(self, client):
+        """
+        Sends all of the client's queued messages in one datagram.  Runs of
+        generates or deletes are merged into a single message.
+        """
+        prof = self.tickProfiler
+        messages = []
+        for msgType, doId, payload in client.pendingMessages:
+            if msgType is None:
+                # Cancelled.
+                continue
 
-    def sendDatagram(self, dg, connection):
-        self.netSys.sendDatagram(connection, dg, NetworkSystem.NSFReliableNoNagle)
+            if msgType in (NetMessages.SV_GenerateObject,
+                           NetMessages.SV_GenerateOwnerObject,
+                           NetMessages.SV_DeleteObject):
+                if messages and messages[-1][0] == msgType:
+                    dg = messages[-1][1]
+                else:
+                    dg = PyDatagram()
+                    dg.addUint16(msgType)
+                    messages.append((msgType, dg))
+
+                prevLength = dg.getLength()
+                if msgType == NetMessages.SV_DeleteObject:
+                    dg.addUint32(doId)
+                    dclassName = None
+                else:
+                    self.packObjectGenerate(dg, payload)
+                    dclassName = payload.dclass.getName()
+                prof.countBytes(client.id, msgType, dg.getLength() - prevLength, dclassName)
+            else:
+                messages.append((msgType, payload))
+                do = self.doId2do.get(doId) if doId is not None else None
+                prof.countBytes(client.id, msgType, payload.getLength(),
+                                do.dclass.getName() if do else None)
+
+        client.pendingMessages = []
+        client.pendingGenerates = {}
+
+        if len(messages) == 0:
+            return
+        elif len(messages) == 1:
+            # No need to frame a lone message.
+            self.sendDatagram(messages[0][1], client.connection)
+            return
+
+        bundle = PyDatagram()
+        bundle.addUint16(NetMessages.SV_MessageBundle)
+        for _, dg in messages:
+            bundle.addUint32(dg.getLength())
+            bundle.appendData(dg.getMessage())
+        self.sendDatagram(bundle, client.connection)
+
+    def sendDatagram(self, dg, connection, reliable = True):
+        if reliable:
+            flags = NetworkSystem.NSFReliableNoNagle
+        else:
+            flags = NetworkSystem.NSFUnreliableNoNagle
+        self.netSys.sendDatagram(connection, dg, flags)
 
     def closeClientConnection(self, client):
         if client.id != -1:
             self.clientIdAllocator.free(client.id)
+        self.interest.removeClient(client)
         self.netSys.closeConnection(client.connection)
         del self.clientsByConnection[client.connection]
 
@@ -490,6 +1024,87 @@ class ServerRepository(BaseObjectManager):
         client.tickCount = dgi.getUint32()
         self.notify.debug("Client acknowleged tick %i" % client.tickCount)
 
+        # Objects that were caught up in an acknowledged snapshot, and not
+        # left out again since, no longer need their own base tick.
+        while client.rebasedSnapshots:
+            tick = next(iter(client.rebasedSnapshots))
+            if tick > client.tickCount:
+                break
+            for doId in client.rebasedSnapshots.pop(tick):
+                entry = client.skippedObjects.get(doId)
+                if entry and entry[1] < tick:
+                    del client.skippedObjects[doId]
+
+    def handleClientUserCommands(self, client, dgi):
+        doId = dgi.getUint32()
+        do = self.doId2do.get(doId)
+        if not do:
+            return
+
+        if do.owner != client:
+            self.notify.warning("SUSPICIOUS: client %i tried to send user commands for unowned doId %i" %
+                                (client.id, doId))
+            return
+
+        if not do.commandField:
+            self.notify.warning("SUSPICIOUS: client %i sent user commands for doId %i, which takes none" %
+                                (client.id, doId))
+            return
+
+        backlog = sv_max_command_backlog.getValue()
+        numCommands = dgi.getUint8()
+        for _ in range(numCommands):
+            commandNumber = dgi.getUint32()
+            data = dgi.getBlob()
+            if commandNumber <= do.lastQueuedCommand:
+                # Resent or out of date.
+                continue
+            do.lastQueuedCommand = commandNumber
+            if len(do.commandQueue) >= backlog:
+                self.notify.debug("Dropping user command %i for doId %i, backlog full" %
+                                  (commandNumber, doId))
+                continue
+            do.commandQueue.append((commandNumber, data))
+
+        if do.commandQueue:
+            self.commandObjects.add(do)
+
+    def runUserCommands(self):
+        """
+        Runs queued user commands on owned objects.  The last command run
+        on each is acknowledged to its owner with the next snapshot, see
+        bundleCommandAcks().
+        """
+        if not self.commandObjects:
+            return
+
+        maxCommands = sv_max_commands_per_tick.getValue()
+        for do in list(self.commandObjects):
+            field = do.dclass.getFieldByName(do.commandField)
+            if not field:
+                self.notify.warning("Unknown command field %s on %s" %
+                                    (do.commandField, do.dclass.getName()))
+                do.commandQueue.clear()
+                self.commandObjects.discard(do)
+                continue
+
+            for _ in range(min(maxCommands, len(do.commandQueue))):
+                commandNumber, data = do.commandQueue.popleft()
+                packer = DCPacker()
+                packer.setUnpackData(data)
+                packer.beginUnpack(field)
+                field.receiveUpdate(packer, do)
+                if not packer.endUnpack():
+                    self.notify.warning("Failed to unpack user command %i for doId %i" %
+                                        (commandNumber, do.doId))
+                do.lastRunCommand = commandNumber
+
+            if not do.commandQueue:
+                self.commandObjects.discard(do)
+
+            if do.owner:
+                do.owner.commandObjects.add(do)
+
     def handleClientSetCMDRate(self, client, dgi):
         cmdRate = dgi.getUint8()
         client.cmdRate = cmdRate
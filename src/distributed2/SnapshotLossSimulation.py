@@ -0,0 +1,83 @@
+"""
+Shows how snapshot latency and bandwidth hold up when snapshots are lost.
+Runs the LoopbackHarness once per loss rate, dropping that share of the
+snapshots on their way to the client, and reports how old the client's
+newest snapshot is, how long its user commands wait to be acknowledged,
+and how many bytes the server sends it.
+
+Run it as a script:
+    python -m direct.distributed2.SnapshotLossSimulation --loss 0 0.05 0.2 --latency 3
+"""
+
+from .LoopbackHarness import LoopbackHarness
+
+import argparse
+import sys
+
+class SnapshotLossHarness(LoopbackHarness):
+    """ A LoopbackHarness that also keeps track of snapshot age. """
+
+    def __init__(self, *args, **kwargs):
+        LoopbackHarness.__init__(self, *args, **kwargs)
+        # Ticks between the server taking the client's newest snapshot and
+        # each client tick.
+        self.snapshotAges = []
+
+    def step(self):
+        LoopbackHarness.step(self)
+        if self.mover and self.client.serverTickCount:
+            # step() has moved on to the next tick already.
+            self.snapshotAges.append(self.tick - 1 - self.client.serverTickCount)
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {'mean': 0.0, 'p99': 0, 'max': 0}
+    count = len(values)
+    return {'mean': sum(values) / count,
+            'p99': values[min(count - 1, int(count * 0.99))],
+            'max': values[-1]}
+
+def simulate(dropRate, numTicks, latency, seed, listenPort):
+    harness = SnapshotLossHarness(latency, dropRate, seed, listenPort = listenPort)
+    ok = harness.run(numTicks)
+    report = harness.getReport()
+    link = harness.fromServer
+    report['ok'] = ok
+    report['snapshotAge'] = percentiles(harness.snapshotAges)
+    report['datagramsDropped'] = link.datagramsDropped
+    report['bytesPerTick'] = link.bytesSent / max(1, harness.tick)
+    report['bytesDelivered'] = link.bytesSent - link.bytesDropped
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+    parser.add_argument('--loss', type = float, nargs = '+', default = [0.0, 0.05, 0.2],
+                        help = "shares of snapshots to drop, one run each")
+    parser.add_argument('--ticks', type = int, default = 600)
+    parser.add_argument('--latency', type = int, default = 3,
+                        help = "ticks each datagram spends in flight")
+    parser.add_argument('--seed', type = int, default = 1)
+    parser.add_argument('--port', type = int, default = 27099,
+                        help = "the servers still open listen sockets, on this port "
+                               "and the ones after it")
+    args = parser.parse_args()
+
+    print("%i ticks, %i ticks of latency each way" % (args.ticks, args.latency))
+    print("%6s %9s %20s %20s %12s %8s" % ('loss', 'dropped', 'snapshot age mean/p99/max',
+                                            'cmd latency mean/p99', 'B/tick sent', 'checks'))
+    allOk = True
+    for i, dropRate in enumerate(args.loss):
+        report = simulate(dropRate, args.ticks, args.latency, args.seed, args.port + i)
+        age = report['snapshotAge']
+        command = report['commandLatency']
+        allOk = allOk and report['ok']
+        print("%5.1f%% %4i/%-4i %10.2f/%3i/%3i %15.2f/%3i %12.1f %8s" %
+              (dropRate * 100, report['datagramsDropped'], report['datagramsToClient'],
+               age['mean'], age['p99'], age['max'], command['mean'], command['p99'],
+               report['bytesPerTick'], "ok" if report['ok'] else "FAILED"))
+
+    sys.exit(0 if allOk else 1)
+
+if __name__ == '__main__':
+    main()
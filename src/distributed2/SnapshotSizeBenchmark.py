@@ -0,0 +1,118 @@
+"""
+Compares the size of snapshots of moving objects with and without the
+quantpos and quantangle field keywords (see FieldQuantizer).
+
+Run it as a script:
+    python -m direct.distributed2.SnapshotSizeBenchmark --objects 500 --ticks 200
+"""
+
+from panda3d.core import Datagram, StringStream
+from panda3d.direct import DCFile, FrameSnapshot, FrameSnapshotManager
+
+import argparse
+import math
+import random
+
+DCText = """
+keyword ram;
+keyword quantpos;
+keyword quantangle;
+
+dclass PlainNode {
+  float64 pos[3] ram;
+  float64 hpr[3] ram;
+  uint8 state ram;
+};
+
+dclass QuantizedNode {
+  float64 pos[3] ram quantpos;
+  float64 hpr[3] ram quantangle;
+  uint8 state ram;
+};
+"""
+
+class MovingObject:
+    """ Wanders around like a player or NPC would. """
+
+    def __init__(self, doId, rng):
+        self.doId = doId
+        self.rng = rng
+        self.pos = [rng.uniform(-500, 500), rng.uniform(-500, 500), 0.0]
+        self.hpr = [rng.uniform(-180, 180), 0.0, 0.0]
+        self.state = 0
+        self.speed = rng.uniform(0.0, 0.3)
+
+    def move(self):
+        self.hpr[0] += self.rng.uniform(-3.0, 3.0)
+        heading = math.radians(self.hpr[0])
+        self.pos[0] += math.cos(heading) * self.speed
+        self.pos[1] += math.sin(heading) * self.speed
+        if self.rng.random() < 0.01:
+            self.state = self.rng.randrange(4)
+
+def readDC():
+    dcFile = DCFile()
+    if not dcFile.read(StringStream(DCText.encode('utf-8')), 'SnapshotSizeBenchmark'):
+        raise RuntimeError("couldn't read the benchmark DC file")
+    return dcFile
+
+def measure(dclass, numObjects, numTicks, seed, movingShare):
+    """
+    Returns the total bytes of the absolute first snapshot and of the delta
+    snapshots of the rest of the ticks.
+    """
+    rng = random.Random(seed)
+    objects = [MovingObject(doId, rng) for doId in range(1, numObjects + 1)]
+    numMoving = int(numObjects * movingShare)
+
+    mgr = FrameSnapshotManager()
+    prevSnap = None
+    absoluteBytes = 0
+    deltaBytes = 0
+    for tick in range(numTicks):
+        snap = FrameSnapshot(tick, numObjects)
+        for i, obj in enumerate(objects):
+            if tick > 0 and i < numMoving:
+                obj.move()
+            mgr.packObjectInSnapshot(snap, i, obj, obj.doId, 0, dclass)
+
+        dg = Datagram()
+        if prevSnap is None:
+            mgr.clientFormatSnapshot(dg, snap, [0])
+            absoluteBytes += dg.getLength()
+        else:
+            mgr.clientFormatDeltaSnapshot(dg, prevSnap, snap, [0])
+            deltaBytes += dg.getLength()
+        prevSnap = snap
+
+    return absoluteBytes, deltaBytes
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+    parser.add_argument('--objects', type = int, default = 500)
+    parser.add_argument('--ticks', type = int, default = 200)
+    parser.add_argument('--moving', type = float, default = 0.5,
+                        help = "share of the objects that move every tick")
+    parser.add_argument('--seed', type = int, default = 1)
+    args = parser.parse_args()
+
+    dcFile = readDC()
+    results = {}
+    for name in ('PlainNode', 'QuantizedNode'):
+        results[name] = measure(dcFile.getClassByName(name), args.objects,
+                                args.ticks, args.seed, args.moving)
+
+    plainAbs, plainDelta = results['PlainNode']
+    quantAbs, quantDelta = results['QuantizedNode']
+    numDeltas = max(1, args.ticks - 1)
+    print("%i objects, %i%% moving, %i ticks" %
+          (args.objects, args.moving * 100, args.ticks))
+    print("%-12s %14s %20s" % ('', 'absolute bytes', 'delta bytes/tick'))
+    print("%-12s %14i %20.1f" % ('full', plainAbs, plainDelta / numDeltas))
+    print("%-12s %14i %20.1f" % ('quantized', quantAbs, quantDelta / numDeltas))
+    if plainDelta:
+        print("quantized deltas are %.1f%% of the full size" %
+              (quantDelta * 100.0 / plainDelta))
+
+if __name__ == '__main__':
+    main()
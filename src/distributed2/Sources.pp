@@ -15,20 +15,27 @@
     changeFrameList.h changeFrameList.I \
     clientFrame.h clientFrame.I \
     clientFrameManager.h clientFrameManager.I \
+    fieldHistory.h fieldHistory.I \
+    fieldQuantizer.h fieldQuantizer.I \
     frameSnapshot.h frameSnapshot.I \
     frameSnapshotEntry.h frameSnapshotEntry.I \
     frameSnapshotManager.h frameSnapshotManager.I \
-    packedObject.h packedObject.I
+    packedObject.h packedObject.I \
+    snapshotBitStream.h snapshotBitStream.I \
+    snapshotBudget.h snapshotBudget.I
 
   #define COMPOSITE_SOURCES \
     config_distributed2.cxx \
     changeFrameList.cxx \
     clientFrame.cxx \
     clientFrameManager.cxx \
+    fieldHistory.cxx \
+    fieldQuantizer.cxx \
     frameSnapshot.cxx \
     frameSnapshotEntry.cxx \
     frameSnapshotManager.cxx \
-    packedObject.cxx
+    packedObject.cxx \
+    snapshotBudget.cxx
 
   #define IGATESCAN all
 
@@ -0,0 +1,84 @@
+"""
+Measures the server's tick cost as the number of objects grows, with a
+client that only sees a few of the zones.  For comparison it also times the
+scan over every object that takeTickSnapshot() used to do to find the
+visible ones.
+
+Run it as a script:
+    python -m direct.distributed2.TickCostBenchmark --objects 1000 10000 50000
+"""
+
+from .LoopbackHarness import LoopbackHarness, LoopbackMoverAI
+
+import argparse
+import timeit
+
+def fullScan(objects, clientZones):
+    """ Finds the visible objects the way takeTickSnapshot() used to. """
+    visible = []
+    for do in objects.values():
+        if do.zoneId not in clientZones:
+            continue
+        visible.append(do)
+    return visible
+
+def measure(numObjects, numZones, visibleZones, numTicks, listenPort):
+    harness = LoopbackHarness(listenPort = listenPort)
+    if not harness.start():
+        raise RuntimeError("couldn't connect the loopback client")
+    harness.scripting = False
+
+    server = harness.server
+    client = harness.client
+    # A snapshot every tick.
+    client.setUpdateRate(255)
+    client.setInterest(list(range(visibleZones)))
+    for i in range(numObjects):
+        server.generateObject(LoopbackMoverAI(), i % numZones)
+
+    # Get the generates out of the way.
+    for _ in range(10):
+        harness.step()
+
+    profiler = server.getTickProfiler()
+    profiler.reset()
+    for _ in range(numTicks):
+        harness.step()
+
+    clientZones = server.clientsByConnection[client.connectionHandle].currentInterestZoneIds
+    scanTime = min(timeit.repeat(lambda: fullScan(server.doId2do, clientZones),
+                                 number = 1, repeat = 5))
+
+    return {'objects': len(server.doId2do),
+            'visible': len(fullScan(server.doId2do, clientZones)),
+            'tick': profiler.getStats(),
+            'pack': profiler.getStats('snapshotPack'),
+            'scan': scanTime}
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+    parser.add_argument('--objects', type = int, nargs = '+', default = [1000, 10000, 50000])
+    parser.add_argument('--zones', type = int, default = 500)
+    parser.add_argument('--visible-zones', type = int, default = 10,
+                        help = "zones the client has interest in")
+    parser.add_argument('--ticks', type = int, default = 100)
+    parser.add_argument('--port', type = int, default = 27099,
+                        help = "the servers still open listen sockets, on this port "
+                               "and the ones after it")
+    args = parser.parse_args()
+
+    print("%i zones, the client sees %i, %i ticks each" %
+          (args.zones, args.visible_zones, args.ticks))
+    print("%8s %8s %22s %16s %16s" % ('objects', 'visible', 'tick mean/p99 ms',
+                                        'pack mean ms', 'full scan ms'))
+    for i, numObjects in enumerate(args.objects):
+        result = measure(numObjects, args.zones, args.visible_zones, args.ticks,
+                         args.port + i)
+        tick = result['tick']
+        print("%8i %8i %13.3f/%8.3f %16.3f %16.3f" %
+              (result['objects'], result['visible'], tick['mean'] * 1000,
+               tick['p99'] * 1000, result['pack']['mean'] * 1000,
+               result['scan'] * 1000))
+
+if __name__ == '__main__':
+    main()
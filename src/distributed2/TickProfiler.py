@@ -0,0 +1,134 @@
+from direct.directnotify.DirectNotifyGlobal import directNotify
+
+from collections import deque
+
+class TickProfiler:
+    """
+    Records where the server's time goes each simulation tick and how many
+    bytes it sends out.
+
+    Tick time is split into named phases by calling mark() after each step
+    of the tick.  The last `historySize` samples of each phase are kept, from
+    which means, percentiles and histograms are computed on demand.  Byte
+    counts are totals since the last reset().
+    """
+
+    notify = directNotify.newCategory("TickProfiler")
+
+    def __init__(self, historySize = 600, logInterval = 0.0):
+        self.historySize = historySize
+        # How often, in seconds, to log a summary.  0 means never.
+        self.logInterval = logInterval
+        self.nextLogTime = 0.0
+
+        self.tickStart = 0.0
+        self.lastMark = 0.0
+
+        self.reset()
+
+    def reset(self):
+        """ Forgets all recorded timings and byte counts. """
+        self.tickTimes = deque(maxlen = self.historySize)
+        self.phaseTimes = {}
+        # Insertion ordered list of phase names, for reporting.
+        self.phaseNames = []
+
+        self.bytesByClient = {}
+        self.bytesByMsgType = {}
+        self.bytesByDclass = {}
+        self.totalBytes = 0
+
+    def beginTick(self):
+        self.tickStart = globalClock.getRealTime()
+        self.lastMark = self.tickStart
+
+    def mark(self, phase):
+        """
+        Records the time since the last mark (or the start of the tick) as
+        time spent in the named phase.
+        """
+        now = globalClock.getRealTime()
+        times = self.phaseTimes.get(phase)
+        if times is None:
+            times = deque(maxlen = self.historySize)
+            self.phaseTimes[phase] = times
+            self.phaseNames.append(phase)
+        times.append(now - self.lastMark)
+        self.lastMark = now
+
+    def endTick(self):
+        now = globalClock.getRealTime()
+        self.tickTimes.append(now - self.tickStart)
+
+        if self.logInterval > 0 and now >= self.nextLogTime:
+            if self.nextLogTime > 0:
+                self.notify.info(self.getSummary())
+            self.nextLogTime = now + self.logInterval
+
+    def countBytes(self, clientId, msgType, numBytes, dclassName = None):
+        """
+        Records numBytes sent to the indicated client in a message of the
+        indicated type, optionally on behalf of an object of the named class.
+        """
+        self.totalBytes += numBytes
+        self.bytesByClient[clientId] = self.bytesByClient.get(clientId, 0) + numBytes
+        self.bytesByMsgType[msgType] = self.bytesByMsgType.get(msgType, 0) + numBytes
+        if dclassName is not None:
+            self.bytesByDclass[dclassName] = self.bytesByDclass.get(dclassName, 0) + numBytes
+
+    def getStats(self, phase = None):
+        """
+        Returns a dictionary of mean, p50, p99 and max times, in seconds, for
+        the named phase, or for the whole tick if phase is None.
+        """
+        if phase is None:
+            samples = self.tickTimes
+        else:
+            samples = self.phaseTimes.get(phase, ())
+
+        if not samples:
+            return {'count': 0, 'mean': 0.0, 'p50': 0.0, 'p99': 0.0, 'max': 0.0}
+
+        ordered = sorted(samples)
+        count = len(ordered)
+        return {'count': count,
+                'mean': sum(ordered) / count,
+                'p50': ordered[min(count - 1, int(count * 0.50))],
+                'p99': ordered[min(count - 1, int(count * 0.99))],
+                'max': ordered[-1]}
+
+    def getHistogram(self, bucketSize = 0.001, phase = None):
+        """
+        Returns a dictionary mapping the start time of each bucketSize-wide
+        bucket to the number of recorded ticks (or phase samples) in it.
+        """
+        if phase is None:
+            samples = self.tickTimes
+        else:
+            samples = self.phaseTimes.get(phase, ())
+
+        histogram = {}
+        for sample in samples:
+            bucket = int(sample / bucketSize) * bucketSize
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+        return histogram
+
+    def getTopBytes(self, table, n = 5):
+        """ Returns the n largest (key, bytes) pairs from a byte table. """
+        return sorted(table.items(), key = lambda item: item[1], reverse = True)[:n]
+
+    def getSummary(self):
+        lines = []
+        stats = self.getStats()
+        lines.append("tick: mean %.2f ms, p50 %.2f ms, p99 %.2f ms, max %.2f ms over %i ticks" %
+                     (stats['mean'] * 1000, stats['p50'] * 1000, stats['p99'] * 1000,
+                      stats['max'] * 1000, stats['count']))
+        for phase in self.phaseNames:
+            stats = self.getStats(phase)
+            lines.append("  %s: mean %.2f ms, p99 %.2f ms" %
+                         (phase, stats['mean'] * 1000, stats['p99'] * 1000))
+        lines.append("sent %i bytes" % self.totalBytes)
+        lines.append("  by client: %s" % self.getTopBytes(self.bytesByClient))
+        lines.append("  by message: %s" % self.getTopBytes(self.bytesByMsgType))
+        lines.append("  by class: %s" % self.getTopBytes(self.bytesByDclass))
+        return "\n".join(lines)
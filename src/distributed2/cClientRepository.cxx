@@ -18,13 +18,50 @@
 #include "dcParameter.h"
 #include "dcPacker.h"
 #include "extension.h"
+#include "fieldQuantizer.h"
+#include "snapshotBitStream.h"
+
+#include <cmath>
+
+/**
+ * Returns the DCClass of the indicated Python distributed object, or nullptr
+ * with a Python exception set if it has none.
+ */
+DCClass *CClientRepository::
+get_object_class(PyObject *dist_obj) const {
+  PyObject *py_dclass = PyObject_GetAttrString(dist_obj, (char *)"dclass");
+  if (!py_dclass) {
+    return nullptr;
+  }
+
+  PyObject *py_dclass_this = PyObject_GetAttrString(py_dclass, (char *)"this");
+  Py_DECREF(py_dclass);
+  if (!py_dclass_this) {
+    return nullptr;
+  }
+
+  DCClass *dclass = (DCClass *)PyLong_AsVoidPtr(py_dclass_this);
+  Py_DECREF(py_dclass_this);
+  return dclass;
+}
 
 /**
  * Unpacks a server snapshot from the datagram and applies the state onto the
  * distributed objects.
+ *
+ * Objects whose class sets batchDataUpdates don't get preDataUpdate, field
+ * setters and postDataUpdate called one by one.  Instead, the changed values
+ * of all such objects of a class are passed to the class's batchDataUpdate
+ * method in one call, after the rest of the snapshot has been applied.
+ *
+ * Returns false if the snapshot could not be completely applied.  Since
+ * snapshots are sent unreliably, this happens if the snapshot references an
+ * object whose generate has not arrived yet.  In that case the objects before
+ * it are still updated, but the snapshot should not be acknowledged, so the
+ * server keeps sending deltas from the last complete snapshot.
  */
-void CClientRepository::
-unpack_server_snapshot(DatagramIterator &dgi) {
+bool CClientRepository::
+unpack_server_snapshot(DatagramIterator &dgi, int tick) {
   bool is_delta = (bool)dgi.get_uint8();
   int num_objects = dgi.get_uint16();
 
@@ -38,10 +75,14 @@ unpack_server_snapshot(DatagramIterator &dgi) {
   PyObject *doid2do = PyObject_GetAttrString(_py_repo, (char *)"doId2do");
   if (!doid2do) {
     PyErr_Print();
-    return;
+    return false;
   }
 
-  for (int i = 0; i < num_objects; i++) {
+  pmap<PyTypeObject *, bool> wants_batch;
+  BatchUpdates batches;
+  bool success = true;
+
+  for (int i = 0; i < num_objects && success; i++) {
     DOID_TYPE do_id = dgi.get_uint32();
 
     PyObject *py_do_id = PyLong_FromUnsignedLong(do_id);
@@ -50,39 +91,149 @@ unpack_server_snapshot(DatagramIterator &dgi) {
     Py_DECREF(py_do_id);
 
     if (!dist_obj) {
-      std::ostringstream ss;
-      ss << "Received state snapshot for object id " << do_id << ", but not found in doId2do";
-      std::string message = ss.str();
-      PyErr_SetString(PyExc_KeyError, message.c_str());
-      Py_DECREF(doid2do);
-      return;
+      // We can't know how big the object's state is without its class, so
+      // the rest of the snapshot has to be thrown away.
+      if (distributed2_cat.is_debug()) {
+        distributed2_cat.debug()
+          << "Received state snapshot for object id " << do_id
+          << ", but not found in doId2do; dropping rest of snapshot\n";
+      }
+      success = false;
+      break;
     }
 
-    PyObject *py_dclass = PyObject_GetAttrString(dist_obj, (char *)"dclass");
-    if (!py_dclass) {
+    DCClass *dclass = get_object_class(dist_obj);
+    if (!dclass) {
       PyErr_Print();
-      Py_DECREF(doid2do);
-      return;
+      success = false;
+      break;
     }
 
-    PyObject *py_dclass_this = PyObject_GetAttrString(py_dclass, (char *)"this");
-    Py_DECREF(py_dclass);
-    if (!py_dclass_this) {
-      PyErr_Print();
-      Py_DECREF(doid2do);
-      return;
+    // Record interpolated fields at this snapshot's tick.
+    _snapshot_tick = tick;
+
+    if (wants_batch_update(Py_TYPE(dist_obj), wants_batch)) {
+      BatchUpdate &batch = add_batch_object(batches, dist_obj);
+      success = unpack_fields(dgi, dist_obj, dclass, do_id, &batch);
+
+    } else {
+      success = unpack_object_state(dgi, dist_obj, dclass, do_id);
     }
 
-    DCClass *dclass = (DCClass *)PyLong_AsVoidPtr(py_dclass_this);
-    Py_DECREF(py_dclass_this);
+    _snapshot_tick = -1;
 
-    if (!unpack_object_state(dgi, dist_obj, dclass, do_id)) {
-      Py_DECREF(doid2do);
-      return;
+    if (!success && PyErr_Occurred()) {
+      // Report it here rather than leave it pending through the batch
+      // updates below, and have the caller merely not acknowledge the
+      // snapshot.
+      PyErr_Print();
     }
   }
 
+  // Objects unpacked before a failure still get their update.
+  dispatch_batch_updates(batches);
+
+  if (tick >= 0) {
+    _last_snapshot_tick = tick;
+  }
+
   Py_DECREF(doid2do);
+  return success;
+}
+
+/**
+ * Returns true if objects of the indicated Python class want their snapshot
+ * state delivered through batchDataUpdate.  The answer is cached in the
+ * indicated map for the duration of a snapshot.
+ */
+bool CClientRepository::
+wants_batch_update(PyTypeObject *type, pmap<PyTypeObject *, bool> &cache) {
+  pmap<PyTypeObject *, bool>::const_iterator it = cache.find(type);
+  if (it != cache.end()) {
+    return (*it).second;
+  }
+
+  bool wants = false;
+  PyObject *attr = PyObject_GetAttrString((PyObject *)type, (char *)"batchDataUpdates");
+  if (attr) {
+    wants = PyObject_IsTrue(attr) == 1;
+    Py_DECREF(attr);
+  } else {
+    PyErr_Clear();
+  }
+
+  cache[type] = wants;
+  return wants;
+}
+
+/**
+ * Appends the object to the batch of its Python class, creating the batch if
+ * needed, and returns the batch.  Its field values must be added next.
+ */
+CClientRepository::BatchUpdate &CClientRepository::
+add_batch_object(BatchUpdates &batches, PyObject *dist_obj) {
+  BatchUpdate &batch = batches[Py_TYPE(dist_obj)];
+  if (batch._objects == nullptr) {
+    batch._objects = PyList_New(0);
+    batch._fields = PyDict_New();
+  }
+  PyList_Append(batch._objects, dist_obj);
+  return batch;
+}
+
+/**
+ * Appends the unpacked value of a field to the batch.  The values of each
+ * field are kept as two parallel lists: the index of the object in the
+ * batch's object list, and the value.
+ */
+void CClientRepository::
+add_batch_value(BatchUpdate &batch, DCField *field, PyObject *args) {
+  const char *c_name = field->get_name().c_str();
+
+  PyObject *column = PyDict_GetItemString(batch._fields, c_name);
+  if (column == nullptr) {
+    column = PyTuple_Pack(2, PyList_New(0), PyList_New(0));
+    // PyTuple_Pack took its own references to the new lists.
+    Py_DECREF(PyTuple_GET_ITEM(column, 0));
+    Py_DECREF(PyTuple_GET_ITEM(column, 1));
+    PyDict_SetItemString(batch._fields, c_name, column);
+    Py_DECREF(column);
+  }
+
+  PyObject *index = PyLong_FromSsize_t(PyList_GET_SIZE(batch._objects) - 1);
+  PyList_Append(PyTuple_GET_ITEM(column, 0), index);
+  Py_DECREF(index);
+  PyList_Append(PyTuple_GET_ITEM(column, 1), args);
+}
+
+/**
+ * Calls batchDataUpdate(objects, fields) once on each Python class that has
+ * collected values in this snapshot, and releases the batches.  The method is
+ * looked up on the class, so it must be a classmethod.
+ */
+void CClientRepository::
+dispatch_batch_updates(BatchUpdates &batches) {
+  BatchUpdates::iterator it;
+  for (it = batches.begin(); it != batches.end(); ++it) {
+    BatchUpdate &batch = (*it).second;
+
+    PyObject *method = PyObject_GetAttrString((PyObject *)(*it).first, (char *)"batchDataUpdate");
+    if (method) {
+      PyObject *result = PyObject_CallFunctionObjArgs(method, batch._objects, batch._fields, nullptr);
+      if (result) {
+        Py_DECREF(result);
+      } else {
+        PyErr_Print();
+      }
+      Py_DECREF(method);
+    } else {
+      PyErr_Print();
+    }
+
+    Py_DECREF(batch._objects);
+    Py_DECREF(batch._fields);
+  }
+  batches.clear();
 }
 
 /**
@@ -101,20 +252,63 @@ unpack_object_state(DatagramIterator &dgi, PyObject *dist_obj, DCClass *dclass,
     Py_DECREF(pre_data_update);
   }
 
+  if (!unpack_fields(dgi, dist_obj, dclass, do_id, nullptr)) {
+    return false;
+  }
+
+  // Finally call the postDataUpdate method so they can do stuff after we've
+  // unpacked the state.
+  PyObject *post_data_update = PyObject_GetAttrString(dist_obj, (char *)"postDataUpdate");
+  if (post_data_update) {
+    PyObject_CallObject(post_data_update, NULL);
+    Py_DECREF(post_data_update);
+  }
+
+  return true;
+}
+
+/**
+ * Unpacks the changed fields of an object from the datagram.  If batch is
+ * nullptr, each value is applied to the object right away, otherwise it is
+ * added to the batch.
+ */
+bool CClientRepository::
+unpack_fields(DatagramIterator &dgi, PyObject *dist_obj, DCClass *dclass,
+              DOID_TYPE do_id, BatchUpdate *batch) {
+  // The fields are identified by a bitmask over the inherited fields if the
+  // high bit is set, otherwise by a list of field numbers.  See
+  // PackedObject::pack_fields().
   int num_fields = dgi.get_uint16();
+  vector_int field_numbers;
+  if ((num_fields & 0x8000) != 0) {
+    int mask_bytes = num_fields & 0x7fff;
+    for (int i = 0; i < mask_bytes; i++) {
+      unsigned char bits = dgi.get_uint8();
+      for (int bit = 0; bits != 0; bit++, bits >>= 1) {
+        if (bits & 1) {
+          field_numbers.push_back((i << 3) + bit);
+        }
+      }
+    }
+  } else {
+    field_numbers.reserve(num_fields);
+    for (int i = 0; i < num_fields; i++) {
+      field_numbers.push_back(dgi.get_uint16());
+    }
+  }
+  num_fields = (int)field_numbers.size();
 
   if (distributed2_cat.is_debug()) {
     distributed2_cat.debug()
       << "Unpacking " << num_fields << " fields on object " << do_id << "\n";
   }
 
-  char proxy_name[256];
-  DCPacker packer;
-
-  const char *data = (const char *)dgi.get_datagram().get_data();
+  pvector<DCField *> fields(num_fields);
+  pvector<const FieldQuantizer *> quantizers(num_fields, nullptr);
+  bool any_quantized = false;
 
   for (int j = 0; j < num_fields; j++) {
-    int field_number = dgi.get_uint16();
+    int field_number = field_numbers[j];
 
     DCField *field = dclass->get_inherited_field(field_number);
     if (!field) {
@@ -134,7 +328,36 @@ unpack_object_state(DatagramIterator &dgi, PyObject *dist_obj, DCClass *dclass,
       return false;
     }
 
-    const char *c_name = field->get_name().c_str();
+    fields[j] = field;
+    quantizers[j] = FieldQuantizer::get_quantizer(field);
+    any_quantized = any_quantized || (quantizers[j] != nullptr);
+  }
+
+  // The quantized values of the quantized fields come first, bit packed.
+  pvector<uint32_t> codes;
+  if (any_quantized) {
+    SnapshotBitReader reader(dgi);
+    for (int j = 0; j < num_fields; j++) {
+      const FieldQuantizer *quantizer = quantizers[j];
+      if (quantizer != nullptr) {
+        int value_bits = quantizer->get_value_bits();
+        for (int v = 0; v < quantizer->get_num_values(); v++) {
+          codes.push_back(reader.read(value_bits));
+        }
+      }
+    }
+  }
+  const uint32_t *next_code = codes.data();
+
+  DCPacker packer;
+  DCPacker value_packer;
+
+  const char *data = (const char *)dgi.get_datagram().get_data();
+
+  for (int j = 0; j < num_fields; j++) {
+    int field_number = field_numbers[j];
+    DCField *field = fields[j];
+    const FieldQuantizer *quantizer = quantizers[j];
 
     if (distributed2_cat.is_debug()) {
       distributed2_cat.debug()
@@ -142,14 +365,31 @@ unpack_object_state(DatagramIterator &dgi, PyObject *dist_obj, DCClass *dclass,
         << do_id << "\n";
     }
 
-    // Put the buffer in the DCPacker to unpack the data into python objects
-    packer.set_unpack_data(data + dgi.get_current_index(), dgi.get_remaining_size(), false);
-    packer.begin_unpack(field);
-    PyObject *args = invoke_extension(field).unpack_args(packer);
-    packer.end_unpack();
+    PyObject *args;
+    if (quantizer != nullptr) {
+      // Turn the quantized value back into the field's DC format.
+      value_packer.clear_data();
+      bool packed = quantizer->dequantize(next_code, value_packer);
+      next_code += quantizer->get_num_values();
+
+      args = nullptr;
+      if (packed) {
+        packer.set_unpack_data(value_packer.get_data(), value_packer.get_length(), false);
+        packer.begin_unpack(field);
+        args = invoke_extension(field).unpack_args(packer);
+        packer.end_unpack();
+      }
 
-    // Skip over the bytes in the DGI that the DCPacker just unpacked
-    dgi.skip_bytes(packer.get_num_unpacked_bytes());
+    } else {
+      // Put the buffer in the DCPacker to unpack the data into python objects
+      packer.set_unpack_data(data + dgi.get_current_index(), dgi.get_remaining_size(), false);
+      packer.begin_unpack(field);
+      args = invoke_extension(field).unpack_args(packer);
+      packer.end_unpack();
+
+      // Skip over the bytes in the DGI that the DCPacker just unpacked
+      dgi.skip_bytes(packer.get_num_unpacked_bytes());
+    }
 
     if (!args) {
       std::ostringstream ss;
@@ -159,63 +399,244 @@ unpack_object_state(DatagramIterator &dgi, PyObject *dist_obj, DCClass *dclass,
       return false;
     }
 
-    // Now set the args on the field
-    sprintf(proxy_name, "RecvProxy_%s", c_name);
-    if (PyObject_HasAttrString(dist_obj, proxy_name)) {
-      // If we have a proxy for this field, allow the proxy method to
-      // do whatever it needs to do with the args
-      PyObject *proxy = PyObject_GetAttrString(dist_obj, proxy_name);
+    // Fields tagged "interp" that arrive in a snapshot are applied later
+    // by interpolate(), along with their OnRecv_ handler, except for the
+    // very first value, so the object always has something.
+    bool deferred = false;
+    if (_snapshot_tick >= 0 && field->has_keyword("interp")) {
+      deferred = record_interp_value(do_id, field_number, args) > 1;
+    }
 
-      if (distributed2_cat.is_debug()) {
-        distributed2_cat.debug()
-          << "Calling recv proxy\n";
+    if (batch != nullptr) {
+      // The batch handler is responsible for everything, including OnRecv_.
+      if (!deferred) {
+        add_batch_value(*batch, field, args);
       }
+      Py_DECREF(args);
+      continue;
+    }
 
-      if (PyTuple_Check(args)) {
-        // Args are already a tuple
-        PyObject_CallObject(proxy, args);
+    if (!deferred) {
+      apply_field_value(dist_obj, field, args);
+      call_recv_handler(dist_obj, field);
+    }
 
-      } else {
-        // The arguments are not already a tuple. Since we are calling a
-        // method, the arguments need to be in a tuple.
-        PyObject *tuple_args = PyTuple_Pack(1, args);
-        PyObject_CallObject(proxy, tuple_args);
-        Py_DECREF(tuple_args);
-      }
+    Py_DECREF(args);
+  }
+
+  return true;
+}
+
+/**
+ * Calls the object's OnRecv_<field> method, if it defines one, to let it
+ * handle a new value of the field.
+ */
+void CClientRepository::
+call_recv_handler(PyObject *dist_obj, DCField *field) {
+  char proxy_name[256];
+  sprintf(proxy_name, "OnRecv_%s", field->get_name().c_str());
+  if (PyObject_HasAttrString(dist_obj, proxy_name)) {
+    // Call it
+    PyObject *recv_handler = PyObject_GetAttrString(dist_obj, proxy_name);
+    PyObject_CallObject(recv_handler, NULL);
+    Py_DECREF(recv_handler);
+  }
+}
+
+/**
+ * Sets the unpacked value of a field on the object, either through its
+ * RecvProxy_<field> method if it has one, or directly on the attribute with
+ * the name of the field.
+ */
+void CClientRepository::
+apply_field_value(PyObject *dist_obj, DCField *field, PyObject *args) {
+  char proxy_name[256];
+  const char *c_name = field->get_name().c_str();
 
-      Py_DECREF(proxy);
+  // Now set the args on the field
+  sprintf(proxy_name, "RecvProxy_%s", c_name);
+  if (PyObject_HasAttrString(dist_obj, proxy_name)) {
+    // If we have a proxy for this field, allow the proxy method to
+    // do whatever it needs to do with the args
+    PyObject *proxy = PyObject_GetAttrString(dist_obj, proxy_name);
+
+    if (distributed2_cat.is_debug()) {
+      distributed2_cat.debug()
+        << "Calling recv proxy\n";
+    }
+
+    if (PyTuple_Check(args)) {
+      // Args are already a tuple
+      PyObject_CallObject(proxy, args);
 
     } else {
-      // Set the args directly on the attribute on the object with the
-      // name of the field.
-      if (distributed2_cat.is_debug()) {
-        distributed2_cat.debug()
-          << "Setting unpacked value directly on object\n";
-      }
-      PyObject_SetAttrString(dist_obj, c_name, args);
+      // The arguments are not already a tuple. Since we are calling a
+      // method, the arguments need to be in a tuple.
+      PyObject *tuple_args = PyTuple_Pack(1, args);
+      PyObject_CallObject(proxy, tuple_args);
+      Py_DECREF(tuple_args);
+    }
+
+    Py_DECREF(proxy);
+
+  } else {
+    // Set the args directly on the attribute on the object with the
+    // name of the field.
+    if (distributed2_cat.is_debug()) {
+      distributed2_cat.debug()
+        << "Setting unpacked value directly on object\n";
     }
+    PyObject_SetAttrString(dist_obj, c_name, args);
+  }
+}
 
-    // Check to see if the object defines a method to handle when this
-    // particuler field is unpacked.
-    // Re-use the proxy_name buffer
-    sprintf(proxy_name, "OnRecv_%s", c_name);
-    if (PyObject_HasAttrString(dist_obj, proxy_name)) {
-      // Call it
-      PyObject *recv_handler = PyObject_GetAttrString(dist_obj, proxy_name);
-      PyObject_CallObject(recv_handler, NULL);
-      Py_DECREF(recv_handler);
+/**
+ * Records the unpacked value of an interpolated field at the current snapshot
+ * tick.  The value must be a number or a flat sequence of numbers.  Returns
+ * the number of values now in the field's history, or -1 if the value can't
+ * be interpolated.
+ */
+int CClientRepository::
+record_interp_value(DOID_TYPE do_id, int field_number, PyObject *args) {
+  double values[16];
+  int num_values = 0;
+  bool integer = true;
+
+  if (PyFloat_Check(args) || PyLong_Check(args)) {
+    values[0] = PyFloat_AsDouble(args);
+    num_values = 1;
+    integer = !PyFloat_Check(args);
+
+  } else if (PyTuple_Check(args) || PyList_Check(args)) {
+    num_values = (int)PySequence_Fast_GET_SIZE(args);
+    if (num_values > 16) {
+      return -1;
+    }
+    for (int i = 0; i < num_values; i++) {
+      PyObject *item = PySequence_Fast_GET_ITEM(args, i);
+      if (!PyFloat_Check(item) && !PyLong_Check(item)) {
+        return -1;
+      }
+      values[i] = PyFloat_AsDouble(item);
+      integer = integer && !PyFloat_Check(item);
     }
 
-    Py_DECREF(args);
+  } else {
+    return -1;
   }
 
-  // Finally call the postDataUpdate method so they can do stuff after we've
-  // unpacked the state.
-  PyObject *post_data_update = PyObject_GetAttrString(dist_obj, (char *)"postDataUpdate");
-  if (post_data_update) {
-    PyObject_CallObject(post_data_update, NULL);
-    Py_DECREF(post_data_update);
+  FieldHistory &history = _interp_history[do_id][field_number];
+  history.record(_snapshot_tick, values, num_values, _last_snapshot_tick);
+  history.set_integer(integer);
+  return history.get_num_samples();
+}
+
+/**
+ * Applies the interpolated values of all "interp" fields at the indicated
+ * (fractional) server tick onto their objects.  Call this once per rendered
+ * frame with a tick somewhat behind the newest snapshot, so there are usually
+ * two snapshots to interpolate between.
+ *
+ * The values are applied the same way as snapshot values: through the
+ * field's RecvProxy_ and OnRecv_ methods, or, for classes that set
+ * batchDataUpdates, through one batchDataUpdate call per class.
+ */
+void CClientRepository::
+interpolate(double tick) {
+  if (_interp_history.empty()) {
+    return;
   }
 
-  return true;
+  PyMutexHolder holder;
+
+  PyObject *doid2do = PyObject_GetAttrString(_py_repo, (char *)"doId2do");
+  if (!doid2do) {
+    PyErr_Print();
+    return;
+  }
+
+  pvector<double> values;
+  pmap<PyTypeObject *, bool> wants_batch;
+  BatchUpdates batches;
+
+  InterpHistory::iterator it;
+  for (it = _interp_history.begin(); it != _interp_history.end(); ++it) {
+    PyObject *py_do_id = PyLong_FromUnsignedLong((*it).first);
+    PyObject *dist_obj = PyDict_GetItem(doid2do, py_do_id);
+    Py_DECREF(py_do_id);
+    if (!dist_obj) {
+      continue;
+    }
+
+    DCClass *dclass = nullptr;
+    bool batched = wants_batch_update(Py_TYPE(dist_obj), wants_batch);
+    BatchUpdate *batch = nullptr;
+
+    FieldHistories &fields = (*it).second;
+    FieldHistories::iterator fi;
+    for (fi = fields.begin(); fi != fields.end(); ++fi) {
+      FieldHistory &history = (*fi).second;
+      if (history.is_settled()) {
+        // Nothing new since we last applied the newest value.
+        continue;
+      }
+
+      if (!history.sample(tick, values)) {
+        continue;
+      }
+
+      if (dclass == nullptr) {
+        dclass = get_object_class(dist_obj);
+        if (dclass == nullptr) {
+          PyErr_Print();
+          break;
+        }
+      }
+
+      DCField *field = dclass->get_inherited_field((*fi).first);
+      if (!field) {
+        continue;
+      }
+
+      bool integer = history.is_integer();
+      PyObject *args;
+      if (values.size() == 1) {
+        args = integer ? PyLong_FromLong(lround(values[0])) : PyFloat_FromDouble(values[0]);
+      } else {
+        args = PyTuple_New(values.size());
+        for (size_t i = 0; i < values.size(); i++) {
+          PyTuple_SET_ITEM(args, i, integer ? PyLong_FromLong(lround(values[i]))
+                                            : PyFloat_FromDouble(values[i]));
+        }
+      }
+
+      if (batched) {
+        if (batch == nullptr) {
+          batch = &add_batch_object(batches, dist_obj);
+        }
+        add_batch_value(*batch, field, args);
+      } else {
+        apply_field_value(dist_obj, field, args);
+        call_recv_handler(dist_obj, field);
+      }
+      Py_DECREF(args);
+
+      if (tick >= history.get_newest_tick()) {
+        history.set_settled(true);
+      }
+    }
+  }
+
+  dispatch_batch_updates(batches);
+
+  Py_DECREF(doid2do);
+}
+
+/**
+ * Forgets the interpolation history of the indicated object.  Call this when
+ * the object is deleted.
+ */
+void CClientRepository::
+remove_interp_history(DOID_TYPE do_id) {
+  _interp_history.erase(do_id);
 }
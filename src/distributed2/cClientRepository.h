@@ -18,8 +18,11 @@
 #include "datagramIterator.h"
 #include "dcbase.h"
 #include "py_panda.h"
+#include "fieldHistory.h"
+#include "pmap.h"
 
 class DCClass;
+class DCField;
 
 /**
  * This is the C++ implementation of the ClientRepository, which currently
@@ -32,12 +35,51 @@ PUBLISHED:
 
   INLINE void set_python_repository(PyObject *repo);
 
-  void unpack_server_snapshot(DatagramIterator &dgi);
+  bool unpack_server_snapshot(DatagramIterator &dgi, int tick = -1);
   bool unpack_object_state(DatagramIterator &dgi, PyObject *dist_obj,
                            DCClass *dclass, DOID_TYPE do_id);
 
+  void interpolate(double tick);
+  void remove_interp_history(DOID_TYPE do_id);
+  INLINE void clear_interp_history();
+
+private:
+  // Field values collected for all objects of one Python class that opted
+  // into batched data updates, delivered in one call per snapshot.
+  class BatchUpdate {
+  public:
+    INLINE BatchUpdate();
+
+    PyObject *_objects;
+    PyObject *_fields;
+  };
+  typedef pmap<PyTypeObject *, BatchUpdate> BatchUpdates;
+
+  bool unpack_fields(DatagramIterator &dgi, PyObject *dist_obj,
+                     DCClass *dclass, DOID_TYPE do_id, BatchUpdate *batch);
+  bool wants_batch_update(PyTypeObject *type, pmap<PyTypeObject *, bool> &cache);
+  BatchUpdate &add_batch_object(BatchUpdates &batches, PyObject *dist_obj);
+  void add_batch_value(BatchUpdate &batch, DCField *field, PyObject *args);
+  void dispatch_batch_updates(BatchUpdates &batches);
+
+  DCClass *get_object_class(PyObject *dist_obj) const;
+  int record_interp_value(DOID_TYPE do_id, int field_number, PyObject *args);
+  void apply_field_value(PyObject *dist_obj, DCField *field, PyObject *args);
+  void call_recv_handler(PyObject *dist_obj, DCField *field);
+
 private:
   PyObject *_py_repo;
+
+  // The server tick of the snapshot currently being unpacked.
+  int _snapshot_tick;
+  // The server tick of the last snapshot that was unpacked.
+  int _last_snapshot_tick;
+
+  // Recent values of the fields tagged with the "interp" keyword, by object
+  // ID and inherited field number.
+  typedef pmap<int, FieldHistory> FieldHistories;
+  typedef phash_map<DOID_TYPE, FieldHistories, integer_hash<DOID_TYPE>> InterpHistory;
+  InterpHistory _interp_history;
 };
 
 #include "cClientRepository.I"
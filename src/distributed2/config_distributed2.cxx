@@ -18,6 +18,7 @@
 #include "clientFrame.h"
 #include "frameSnapshot.h"
 #include "frameSnapshotEntry.h"
+#include "snapshotBudget.h"
 
 #if !defined(CPPPARSER) && !defined(LINK_ALL_STATIC) && !defined(BUILDING_DIRECT_DISTRIBUTED2)
   #error Buildsystem error: BUILDING_DIRECT_DISTRIBUTED2 not defined
@@ -30,6 +31,29 @@ ConfigureFn(config_distributed2) {
   init_libdistributed2();
 }
 
+// The server and its clients must agree on these, see FieldQuantizer.
+
+ConfigVariableDouble snapshot_quant_pos_step
+("snapshot-quant-pos-step", 1.0 / 64.0,
+ PRC_DESC("The resolution of the values of fields with the quantpos keyword "
+          "in snapshots, in the field's own units."));
+
+ConfigVariableInt snapshot_quant_pos_bits
+("snapshot-quant-pos-bits", 24,
+ PRC_DESC("The number of bits each value of a field with the quantpos "
+          "keyword takes in snapshots.  Values out of the range this gives "
+          "at snapshot-quant-pos-step are clamped."));
+
+ConfigVariableInt snapshot_quant_angle_bits
+("snapshot-quant-angle-bits", 12,
+ PRC_DESC("The number of bits each value of a field with the quantangle "
+          "keyword takes in snapshots.  The values are angles in degrees."));
+
+ConfigVariableInt snapshot_quant_normal_bits
+("snapshot-quant-normal-bits", 12,
+ PRC_DESC("The number of bits each value of a field with the quantnormal "
+          "keyword takes in snapshots.  The values are clamped to [-1, 1]."));
+
 /**
  * Initializes the library.  This must be called at least once before any of
  * the functions or classes in this library can be used.  Normally it will be
@@ -48,4 +72,5 @@ init_libdistributed2() {
   FrameSnapshot::init_type();
   FrameSnapshotEntry::init_type();
   PackedObject::init_type();
+  SnapshotBudget::init_type();
 }
@@ -17,9 +17,16 @@
 #include "directbase.h"
 #include "notifyCategoryProxy.h"
 #include "dconfig.h"
+#include "configVariableDouble.h"
+#include "configVariableInt.h"
 
 NotifyCategoryDecl(distributed2, EXPCL_DIRECT_DISTRIBUTED2, EXPTP_DIRECT_DISTRIBUTED2);
 
+extern EXPCL_DIRECT_DISTRIBUTED2 ConfigVariableDouble snapshot_quant_pos_step;
+extern EXPCL_DIRECT_DISTRIBUTED2 ConfigVariableInt snapshot_quant_pos_bits;
+extern EXPCL_DIRECT_DISTRIBUTED2 ConfigVariableInt snapshot_quant_angle_bits;
+extern EXPCL_DIRECT_DISTRIBUTED2 ConfigVariableInt snapshot_quant_normal_bits;
+
 extern EXPCL_DIRECT_DISTRIBUTED void init_libdistributed2();
 
 #endif
@@ -0,0 +1,113 @@
+/**
+ * PANDA 3D SOFTWARE
+ * Copyright (c) Carnegie Mellon University.  All rights reserved.
+ *
+ * All use of this software is subject to the terms of the revised BSD
+ * license.  You should have received a copy of this license along
+ * with this source code in a file named "LICENSE."
+ *
+ * @file fieldHistory.cxx
+ * @author agent
+ * @date 2026-10-18
+ */
+
+#include "fieldHistory.h"
+
+/**
+ * Records the value of the field at the indicated server tick.  Values older
+ * than the newest one in the history are ignored, and a value at the same
+ * tick as the newest one replaces it.
+ *
+ * Snapshots leave out fields that didn't change, so the newest value may have
+ * held for many ticks before this one.  hold_tick is the tick of the previous
+ * snapshot; if it is between the newest value and this one, the newest value
+ * is recorded again at hold_tick first, so that the change is interpolated
+ * over the last snapshot interval instead of the whole time it held.
+ */
+void FieldHistory::
+record(int tick, const double *values, int num_values, int hold_tick) {
+  if (_count > 0) {
+    int newest_tick = _samples[_head]._tick;
+    if (tick < newest_tick) {
+      return;
+    }
+
+    if (hold_tick > newest_tick && hold_tick < tick) {
+      pvector<double> held_values = _samples[_head]._values;
+      _head = (_head + 1) % field_history_size;
+      if (_count < field_history_size) {
+        _count++;
+      }
+      _samples[_head]._tick = hold_tick;
+      _samples[_head]._values.swap(held_values);
+      newest_tick = hold_tick;
+    }
+
+    if (tick != newest_tick) {
+      _head = (_head + 1) % field_history_size;
+      if (_count < field_history_size) {
+        _count++;
+      }
+    }
+
+  } else {
+    _head = 0;
+    _count = 1;
+  }
+
+  Sample &sample = _samples[_head];
+  sample._tick = tick;
+  sample._values.assign(values, values + num_values);
+
+  _settled = false;
+}
+
+/**
+ * Fills in the value of the field at the indicated (fractional) server tick,
+ * linearly interpolating between the two values on either side of it.  Holds
+ * the newest value past the end of the history, and the oldest value before
+ * the start of it.  Returns false if the history is empty.
+ */
+bool FieldHistory::
+sample(double tick, pvector<double> &values) const {
+  if (_count == 0) {
+    return false;
+  }
+
+  // Walk backwards from the newest value to the newest one at or before the
+  // requested tick.
+  int newer = -1;
+  int index = _head;
+  for (int i = 0; i < _count; i++) {
+    const Sample &older = _samples[index];
+
+    if (older._tick <= tick) {
+      if (newer == -1) {
+        // Past the newest value.
+        values = older._values;
+        return true;
+      }
+
+      const Sample &next = _samples[newer];
+      if (next._values.size() != older._values.size()) {
+        values = next._values;
+        return true;
+      }
+
+      double frac = (tick - older._tick) / (double)(next._tick - older._tick);
+      size_t num_values = older._values.size();
+      values.resize(num_values);
+      for (size_t j = 0; j < num_values; j++) {
+        values[j] = older._values[j] + (next._values[j] - older._values[j]) * frac;
+      }
+      return true;
+    }
+
+    newer = index;
+    index = (index + field_history_size - 1) % field_history_size;
+  }
+
+  // Before the oldest value.
+  values = _samples[newer]._values;
+  return true;
+}
@@ -0,0 +1,68 @@
+/**
+ * PANDA 3D SOFTWARE
+ * Copyright (c) Carnegie Mellon University.  All rights reserved.
+ *
+ * All use of this software is subject to the terms of the revised BSD
+ * license.  You should have received a copy of this license along
+ * with this source code in a file named "LICENSE."
+ *
+ * @file fieldHistory.h
+ * @author agent
+ * @date 2026-10-18
+ */
+
+#ifndef FIELDHISTORY_H
+#define FIELDHISTORY_H
+
+#include "config_distributed2.h"
+#include "pvector.h"
+
+static constexpr int field_history_size = 32;
+
+/**
+ * Ring buffer of the most recent values of a single numeric state field of a
+ * distributed object, keyed by server tick.  The client uses this to
+ * interpolate the field between snapshots at render time.
+ *
+ * A value is a flat list of numbers, so scalars as well as vectors can be
+ * interpolated.  Only the last `field_history_size` values are kept.
+ */
+class EXPCL_DIRECT_DISTRIBUTED2 FieldHistory {
+public:
+  INLINE FieldHistory();
+
+  void record(int tick, const double *values, int num_values,
+              int hold_tick = -1);
+  bool sample(double tick, pvector<double> &values) const;
+
+  INLINE int get_num_samples() const;
+  INLINE int get_newest_tick() const;
+
+  INLINE void set_settled(bool settled);
+  INLINE bool is_settled() const;
+
+  INLINE void set_integer(bool integer);
+  INLINE bool is_integer() const;
+
+private:
+  struct Sample {
+    int _tick;
+    pvector<double> _values;
+  };
+
+  Sample _samples[field_history_size];
+  // Index of the newest sample.
+  int _head;
+  int _count;
+
+  // True once the newest sample has been applied to the object and there is
+  // nothing left to interpolate.
+  bool _settled;
+
+  // True if the field holds integers, so sampled values should be rounded.
+  bool _integer;
+};
+
+#include "fieldHistory.I"
+
+#endif // FIELDHISTORY_H
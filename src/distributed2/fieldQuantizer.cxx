@@ -0,0 +1,257 @@
+/**
+ * PANDA 3D SOFTWARE
+ * Copyright (c) Carnegie Mellon University.  All rights reserved.
+ *
+ * All use of this software is subject to the terms of the revised BSD
+ * license.  You should have received a copy of this license along
+ * with this source code in a file named "LICENSE."
+ *
+ * @file fieldQuantizer.cxx
+ * @author agent
+ * @date 2026-10-18
+ */
+
+#include "fieldQuantizer.h"
+#include "dcField.h"
+#include "dcPacker.h"
+#include "dcPackerInterface.h"
+#include "lightMutexHolder.h"
+
+#include <cmath>
+
+FieldQuantizer::Quantizers FieldQuantizer::_quantizers;
+LightMutex FieldQuantizer::_lock;
+
+/**
+ *
+ */
+FieldQuantizer::
+FieldQuantizer(const DCField *field, Mode mode, int num_values) :
+  _field(field),
+  _mode(mode),
+  _num_values(num_values),
+  _step(1.0)
+{
+  switch (mode) {
+  case M_position:
+    _value_bits = snapshot_quant_pos_bits;
+    _step = snapshot_quant_pos_step;
+    break;
+
+  case M_angle:
+    _value_bits = snapshot_quant_angle_bits;
+    break;
+
+  case M_normal:
+    _value_bits = snapshot_quant_normal_bits;
+    break;
+  }
+
+  _value_bits = std::max(2, std::min(_value_bits, 32));
+}
+
+/**
+ * Returns the quantizer for the field, or nullptr if the field has none of
+ * the quantization keywords, or can't be quantized.  The quantizers live for
+ * as long as the program.
+ */
+const FieldQuantizer *FieldQuantizer::
+get_quantizer(const DCField *field) {
+  LightMutexHolder holder(_lock);
+
+  Quantizers::const_iterator it = _quantizers.find(field);
+  if (it != _quantizers.end()) {
+    return (*it).second;
+  }
+
+  FieldQuantizer *quantizer = nullptr;
+
+  Mode mode = M_position;
+  bool has_mode = true;
+  if (field->has_keyword("quantpos")) {
+    mode = M_position;
+  } else if (field->has_keyword("quantangle")) {
+    mode = M_angle;
+  } else if (field->has_keyword("quantnormal")) {
+    mode = M_normal;
+  } else {
+    has_mode = false;
+  }
+
+  if (has_mode) {
+    int num_values = field->has_fixed_structure() ? count_values(field) : -1;
+    if (num_values > 0) {
+      quantizer = new FieldQuantizer(field, mode, num_values);
+    } else {
+      distributed2_cat.warning()
+        << "Field " << field->get_name() << " is not made of a fixed number of "
+        << "numbers, sending it unquantized\n";
+    }
+  }
+
+  _quantizers[field] = quantizer;
+  return quantizer;
+}
+
+/**
+ * Quantizes the value of the field packed in the indicated DC data into
+ * get_num_values() codes.  Returns false if the data couldn't be unpacked.
+ */
+bool FieldQuantizer::
+quantize(const char *data, size_t length, uint32_t *codes) const {
+  DCPacker packer;
+  packer.set_unpack_data(data, length, false);
+  packer.begin_unpack(_field);
+  unpack_values(packer, codes);
+  return packer.end_unpack();
+}
+
+/**
+ * Packs the value of the field given by the indicated codes into the packer,
+ * in the field's DC format.  Returns false if it couldn't be packed.
+ */
+bool FieldQuantizer::
+dequantize(const uint32_t *codes, DCPacker &packer) const {
+  packer.begin_pack(_field);
+  pack_values(packer, codes);
+  return packer.end_pack();
+}
+
+/**
+ * Returns the code of a single number.
+ */
+uint32_t FieldQuantizer::
+quantize_value(double value) const {
+  double max_code = (double)(((uint64_t)1 << _value_bits) - 1);
+
+  switch (_mode) {
+  case M_position:
+    {
+      // Two's complement in _value_bits bits.
+      double half = (double)((uint64_t)1 << (_value_bits - 1));
+      double code = std::floor(value / _step + 0.5);
+      code = std::max(-half, std::min(code, half - 1.0));
+      return (uint32_t)(int64_t)code;
+    }
+
+  case M_angle:
+    {
+      double turns = value / 360.0;
+      turns -= std::floor(turns);
+      double code = std::floor(turns * (max_code + 1.0) + 0.5);
+      // A full turn wraps around to zero.
+      return (uint32_t)((uint64_t)code & (uint64_t)max_code);
+    }
+
+  case M_normal:
+    {
+      double clamped = std::max(-1.0, std::min(value, 1.0));
+      return (uint32_t)std::floor((clamped + 1.0) * 0.5 * max_code + 0.5);
+    }
+  }
+
+  return 0;
+}
+
+/**
+ * Returns the number a code stands for.
+ */
+double FieldQuantizer::
+dequantize_value(uint32_t code) const {
+  double max_code = (double)(((uint64_t)1 << _value_bits) - 1);
+
+  switch (_mode) {
+  case M_position:
+    {
+      // Sign extend.
+      int64_t value = code;
+      if (code & ((uint64_t)1 << (_value_bits - 1))) {
+        value -= (int64_t)1 << _value_bits;
+      }
+      return (double)value * _step;
+    }
+
+  case M_angle:
+    {
+      double angle = (double)code * 360.0 / (max_code + 1.0);
+      return (angle >= 180.0) ? angle - 360.0 : angle;
+    }
+
+  case M_normal:
+    return (double)code / max_code * 2.0 - 1.0;
+  }
+
+  return 0.0;
+}
+
+/**
+ * Returns the number of numbers a value of the indicated field or element is
+ * made of, or -1 if it contains anything other than numbers or has a varying
+ * number of elements.
+ */
+int FieldQuantizer::
+count_values(const DCPackerInterface *iface) {
+  if (!iface->has_nested_fields()) {
+    switch (iface->get_pack_type()) {
+    case PT_double:
+    case PT_int:
+    case PT_uint:
+    case PT_int64:
+    case PT_uint64:
+      return 1;
+
+    default:
+      return -1;
+    }
+  }
+
+  int num_nested = iface->get_num_nested_fields();
+  if (num_nested < 0) {
+    return -1;
+  }
+
+  int count = 0;
+  for (int i = 0; i < num_nested; i++) {
+    const DCPackerInterface *nested = iface->get_nested_field(i);
+    int nested_count = (nested != nullptr) ? count_values(nested) : -1;
+    if (nested_count < 0) {
+      return -1;
+    }
+    count += nested_count;
+  }
+  return count;
+}
+
+/**
+ * Unpacks the numbers of the current field of the packer, recursively, and
+ * writes their codes to the codes array, advancing it.
+ */
+void FieldQuantizer::
+unpack_values(DCPacker &packer, uint32_t *&codes) const {
+  if (packer.has_nested_fields()) {
+    packer.push();
+    while (packer.more_nested_fields()) {
+      unpack_values(packer, codes);
+    }
+    packer.pop();
+  } else {
+    *codes++ = quantize_value(packer.unpack_double());
+  }
+}
+
+/**
+ * Packs the numbers given by the codes into the current field of the packer,
+ * recursively, advancing the codes array.
+ */
+void FieldQuantizer::
+pack_values(DCPacker &packer, const uint32_t *&codes) const {
+  if (packer.has_nested_fields()) {
+    packer.push();
+    while (packer.more_nested_fields()) {
+      pack_values(packer, codes);
+    }
+    packer.pop();
+  } else {
+    packer.pack_double(dequantize_value(*codes++));
+  }
+}
@@ -0,0 +1,89 @@
+/**
+ * PANDA 3D SOFTWARE
+ * Copyright (c) Carnegie Mellon University.  All rights reserved.
+ *
+ * All use of this software is subject to the terms of the revised BSD
+ * license.  You should have received a copy of this license along
+ * with this source code in a file named "LICENSE."
+ *
+ * @file fieldQuantizer.h
+ * @author agent
+ * @date 2026-10-18
+ */
+
+#ifndef FIELDQUANTIZER_H
+#define FIELDQUANTIZER_H
+
+#include "config_distributed2.h"
+#include "pmap.h"
+#include "lightMutex.h"
+#include "numeric_types.h"
+
+class DCField;
+class DCPacker;
+class DCPackerInterface;
+
+/**
+ * Sends the values of a numeric state field in snapshots at a reduced
+ * precision, with as few bits per value as the precision needs.  A field
+ * opts in with one of these DC keywords:
+ *
+ *   quantpos    - fixed point at snapshot-quant-pos-step, in
+ *                 snapshot-quant-pos-bits bits per value, for positions.
+ *   quantangle  - angles in degrees, in snapshot-quant-angle-bits bits per
+ *                 value.  Received angles are in [-180, 180).
+ *   quantnormal - values in [-1, 1], in snapshot-quant-normal-bits bits per
+ *                 value, for normals and other unit vectors.
+ *
+ * The keyword applies to every value of the field, which must be made of a
+ * fixed number of numbers, like float64 or float32 pos[3].  The keywords
+ * have to be declared in the DC file, and the server and clients must use
+ * the same config.
+ *
+ * The field is still stored at its DC type on both ends; the quantized form
+ * only exists on the wire.  See PackedObject::pack_fields().
+ */
+class EXPCL_DIRECT_DISTRIBUTED2 FieldQuantizer {
+public:
+  enum Mode {
+    M_position,
+    M_angle,
+    M_normal,
+  };
+
+  static const FieldQuantizer *get_quantizer(const DCField *field);
+
+  INLINE Mode get_mode() const;
+  INLINE int get_num_values() const;
+  INLINE int get_value_bits() const;
+  INLINE int get_num_bits() const;
+
+  bool quantize(const char *data, size_t length, uint32_t *codes) const;
+  bool dequantize(const uint32_t *codes, DCPacker &packer) const;
+
+  uint32_t quantize_value(double value) const;
+  double dequantize_value(uint32_t code) const;
+
+private:
+  FieldQuantizer(const DCField *field, Mode mode, int num_values);
+
+  static int count_values(const DCPackerInterface *iface);
+  void unpack_values(DCPacker &packer, uint32_t *&codes) const;
+  void pack_values(DCPacker &packer, const uint32_t *&codes) const;
+
+private:
+  const DCField *_field;
+  Mode _mode;
+  int _num_values;
+  int _value_bits;
+  double _step;
+
+  // Quantizers by field, or nullptr for fields that aren't quantized.
+  typedef pmap<const DCField *, FieldQuantizer *> Quantizers;
+  static Quantizers _quantizers;
+  static LightMutex _lock;
+};
+
+#include "fieldQuantizer.I"
+
+#endif // FIELDQUANTIZER_H
@@ -13,6 +13,38 @@
 
 #include "frameSnapshotManager.h"
 #include "frameSnapshot.h"
+#include "frameSnapshotEntry.h"
+#include "mutexHolder.h"
+
+#include <algorithm>
+
+/**
+ * Worker thread that formats client snapshots queued on a
+ * FrameSnapshotManager.
+ */
+class SnapshotEncodeThread : public Thread {
+public:
+  SnapshotEncodeThread(const std::string &name, FrameSnapshotManager *mgr) :
+    Thread(name, "snapshot-encode"),
+    _mgr(mgr)
+  {
+  }
+
+  virtual void thread_main() {
+    _mgr->encode_thread_main();
+  }
+
+private:
+  FrameSnapshotManager *_mgr;
+};
+
+/**
+ *
+ */
+FrameSnapshotManager::
+~FrameSnapshotManager() {
+  stop_encode_threads();
+}
 
 /**
  * Creates and returns a new PackedObject for the specified object ID.
@@ -51,3 +83,385 @@ remove_prev_sent_packet(DOID_TYPE do_id) {
     _prev_sent_packets.erase(itr);
   }
 }
+
+/**
+ * Fills in the indicated snapshot entry with the most recently sent packed
+ * state of the object, without re-packing the object's fields.  Use this for
+ * objects that are known to not have changed since they were last packed.
+ *
+ * Returns false if no packet was ever sent for the object, in which case the
+ * object must be packed with pack_object_in_snapshot() instead.
+ */
+bool FrameSnapshotManager::
+pack_unchanged_object_in_snapshot(FrameSnapshot *snapshot, int entry_idx,
+                                  DOID_TYPE do_id, ZONEID_TYPE zone_id,
+                                  DCClass *dclass) {
+  PackedObject *prev_pack = get_prev_sent_packet(do_id);
+  if (prev_pack == nullptr || prev_pack->get_class() != dclass) {
+    return false;
+  }
+
+  FrameSnapshotEntry &entry = snapshot->get_entry(entry_idx);
+  entry.set_class(dclass);
+  entry.set_do_id(do_id);
+  entry.set_zone_id(zone_id);
+  entry.set_exists(true);
+  entry.set_packed_object(prev_pack);
+
+  snapshot->mark_entry_valid(entry_idx);
+
+  return true;
+}
+
+/**
+ * Sets the number of worker threads used by format_queued_snapshots().  If
+ * this is zero (the default), queued snapshots are formatted on the calling
+ * thread.  Has no effect if Panda was built without true threading support.
+ */
+void FrameSnapshotManager::
+set_num_encode_threads(int num_threads) {
+  nassertv(!_formatting);
+
+  if (!Thread::is_true_threads()) {
+    num_threads = 0;
+  }
+
+  if (num_threads == (int)_encode_threads.size()) {
+    return;
+  }
+
+  stop_encode_threads();
+
+  for (int i = 0; i < num_threads; i++) {
+    std::ostringstream strm;
+    strm << "SnapshotEncode-" << i;
+    PT(Thread) thread = new SnapshotEncodeThread(strm.str(), this);
+    if (thread->start(TP_normal, true)) {
+      _encode_threads.push_back(thread);
+    } else {
+      distributed2_cat.warning()
+        << "Could not start snapshot encode thread " << i << "\n";
+    }
+  }
+}
+
+/**
+ * Queues up a client snapshot to be formatted into the indicated datagram by
+ * the next call to format_queued_snapshots().  If from is nullptr, an absolute
+ * snapshot is formatted, otherwise a delta snapshot from `from` to `to`.  The
+ * datagram must be kept alive until format_queued_snapshots() returns.
+ */
+void FrameSnapshotManager::
+queue_snapshot(Datagram *dg, FrameSnapshot *from, FrameSnapshot *to,
+               ZoneIds &&interest_zone_ids, DoIds &&exclude_do_ids,
+               SnapshotBudget *budget) {
+  MutexHolder holder(_format_lock);
+  nassertv(!_formatting);
+
+  FormatJob job;
+  job._dg = dg;
+  job._from = from;
+  job._to = to;
+  job._interest_zone_ids = std::move(interest_zone_ids);
+  job._exclude_do_ids = std::move(exclude_do_ids);
+  job._budget = budget;
+  _format_jobs.push_back(std::move(job));
+}
+
+/**
+ * Formats all of the client snapshots queued by queue_snapshot(), spreading
+ * the work over the encode threads and the calling thread.  Does not return
+ * until every queued snapshot has been formatted.
+ *
+ * This only touches data that was already packed into the snapshots, so the
+ * Python GIL is released while it runs.
+ */
+void FrameSnapshotManager::
+format_queued_snapshots() {
+  MutexHolder holder(_format_lock);
+
+  if (_format_jobs.empty()) {
+    return;
+  }
+
+  _next_format_job = 0;
+  _format_jobs_remaining = _format_jobs.size();
+  _formatting = true;
+  _format_cvar.notify_all();
+
+  // Help out with the queue on this thread as well.
+  while (_next_format_job < _format_jobs.size()) {
+    const FormatJob &job = _format_jobs[_next_format_job++];
+    _format_lock.release();
+    run_format_job(job);
+    _format_lock.acquire();
+    _format_jobs_remaining--;
+  }
+
+  while (_format_jobs_remaining > 0) {
+    _format_done_cvar.wait();
+  }
+
+  _formatting = false;
+  _format_jobs.clear();
+}
+
+/**
+ * Main loop of a snapshot encode thread.  Pulls queued snapshots off of the
+ * queue while format_queued_snapshots() is running.
+ */
+void FrameSnapshotManager::
+encode_thread_main() {
+  MutexHolder holder(_format_lock);
+
+  while (true) {
+    while (!_shutdown &&
+           !(_formatting && _next_format_job < _format_jobs.size())) {
+      _format_cvar.wait();
+    }
+
+    if (_shutdown) {
+      return;
+    }
+
+    const FormatJob &job = _format_jobs[_next_format_job++];
+    _format_lock.release();
+    run_format_job(job);
+    _format_lock.acquire();
+
+    if (--_format_jobs_remaining == 0) {
+      _format_done_cvar.notify_all();
+    }
+  }
+}
+
+/**
+ * Formats a single queued client snapshot.
+ */
+void FrameSnapshotManager::
+run_format_job(const FormatJob &job) const {
+  if (job._from != nullptr) {
+    format_delta_snapshot(*job._dg, job._from, job._to, job._interest_zone_ids,
+                          job._exclude_do_ids, job._budget);
+  } else {
+    format_snapshot(*job._dg, job._to, job._interest_zone_ids, job._exclude_do_ids,
+                    job._budget);
+  }
+}
+
+/**
+ * Stops and joins all of the encode threads.
+ */
+void FrameSnapshotManager::
+stop_encode_threads() {
+  if (_encode_threads.empty()) {
+    return;
+  }
+
+  {
+    MutexHolder holder(_format_lock);
+    _shutdown = true;
+    _format_cvar.notify_all();
+  }
+
+  for (Thread *thread : _encode_threads) {
+    thread->join();
+  }
+  _encode_threads.clear();
+
+  _shutdown = false;
+}
+
+/**
+ * Builds a datagram out of the specified snapshot suitable for sending to a
+ * client. Only objects that are in the specified interest zones and not in
+ * the sorted exclude_do_ids list are packed into the datagram.  If a budget
+ * is given, only the objects that fit in it are packed; see SnapshotBudget.
+ */
+void FrameSnapshotManager::
+format_snapshot(Datagram &dg, FrameSnapshot *snapshot,
+                const ZoneIds &interest_zone_ids,
+                const DoIds &exclude_do_ids,
+                SnapshotBudget *budget) const {
+  // Record tick count of the snapshot
+  dg.add_uint32(snapshot->get_tick_count());
+
+  // Indicate this is *not* a delta snapshot.
+  dg.add_uint8(0);
+
+  Datagram object_dg;
+  int num_objects = pack_client_objects(object_dg, nullptr, snapshot, interest_zone_ids,
+                                        exclude_do_ids, budget);
+
+  // # of objects in this client snapshot
+  dg.add_uint16(num_objects);
+
+  // Copy object data onto main datagram
+  dg.append_data(object_dg.get_data(), object_dg.get_length());
+}
+
+/**
+ * Builds a datagram out of the specified snapshot suitable for sending to a
+ * client. Only objects that are in the specified interest zones and not in
+ * the sorted exclude_do_ids list are packed into the datagram, and only
+ * fields that have changed between `from` and `to` are packed.  If a budget
+ * is given, only the objects that fit in it are packed; see SnapshotBudget.
+ */
+void FrameSnapshotManager::
+format_delta_snapshot(Datagram &dg, FrameSnapshot *from, FrameSnapshot *to,
+                      const ZoneIds &interest_zone_ids,
+                      const DoIds &exclude_do_ids,
+                      SnapshotBudget *budget) const {
+  // Record tick count of the snapshot
+  dg.add_uint32(to->get_tick_count());
+
+  // Indicate this is a delta snapshot.
+  dg.add_uint8(1);
+
+  Datagram object_dg;
+  int num_objects = pack_client_objects(object_dg, from, to, interest_zone_ids,
+                                        exclude_do_ids, budget);
+
+  // # of objects in this client snapshot
+  dg.add_uint16(num_objects);
+
+  // Copy object data onto main datagram
+  dg.append_data(object_dg.get_data(), object_dg.get_length());
+}
+
+/**
+ * Packs the objects of the `to` snapshot that the client should receive into
+ * object_dg, and returns how many were packed.  If from is nullptr, each
+ * object's whole state is packed, otherwise only the fields that changed
+ * after the `from` tick.
+ */
+int FrameSnapshotManager::
+pack_client_objects(Datagram &object_dg, FrameSnapshot *from, FrameSnapshot *to,
+                    const ZoneIds &interest_zone_ids, const DoIds &exclude_do_ids,
+                    SnapshotBudget *budget) const {
+  // With a byte limit, the objects are packed into a scratch datagram first,
+  // then the most important ones that fit are copied out.
+  struct Candidate {
+    DOID_TYPE _do_id;
+    float _priority;
+    size_t _start;
+    size_t _length;
+  };
+  pvector<Candidate> candidates;
+
+  bool limited = (budget != nullptr && budget->get_max_bytes() > 0);
+  Datagram scratch_dg;
+  Datagram &pack_dg = limited ? scratch_dg : object_dg;
+
+  if (budget != nullptr) {
+    budget->clear_results();
+  }
+
+  int from_tick = (from != nullptr) ? from->get_tick_count() : -1;
+
+  int num_objects = 0;
+  for (int i = 0; i < to->get_num_valid_entries(); i++) {
+    FrameSnapshotEntry &entry = to->get_entry(to->get_valid_entry(i));
+    if (std::find(interest_zone_ids.begin(), interest_zone_ids.end(),
+                  entry.get_zone_id()) == interest_zone_ids.end()) {
+
+      // Object not seen by this client, don't include in client snapshot
+      continue;
+    }
+
+    if (!exclude_do_ids.empty() &&
+        std::binary_search(exclude_do_ids.begin(), exclude_do_ids.end(),
+                           entry.get_do_id())) {
+      // The client doesn't know about this object yet.
+      continue;
+    }
+
+    PackedObject *packet = entry.get_packed_object();
+
+    // An object left out of earlier snapshots is delta compressed against
+    // the last state the client has of it.
+    int base_tick = from_tick;
+    bool rebased = (budget != nullptr && budget->get_base_tick(entry.get_do_id(), base_tick));
+
+    vector_int changed_fields;
+    int num_changes = -1;
+    if (base_tick != -1) {
+      num_changes = packet->get_fields_changed_after_tick(base_tick, changed_fields);
+
+      if (distributed2_cat.is_debug()) {
+        distributed2_cat.debug()
+          << base_tick << " to " << to->get_tick_count() << " for client\n";
+        distributed2_cat.debug()
+          << num_changes << " fields changed for client after tick " << base_tick << " doId " << packet->get_do_id() << "\n";
+      }
+
+      if (num_changes == 0) {
+        // Nothing changed from previous client snapshot, don't include this
+        // object.
+        continue;
+      }
+    }
+
+    size_t start = pack_dg.get_length();
+
+    // Object ID
+    pack_dg.add_uint32(entry.get_do_id());
+
+    if (num_changes != -1) {
+      // Now copy each changed field into the datagram
+      packet->pack_fields(pack_dg, changed_fields.data(), num_changes);
+
+    } else {
+      // -1 means all fields changed, or this is not a delta snapshot, so
+      // just pack the whole object
+      packet->pack_datagram(pack_dg);
+    }
+
+    if (limited) {
+      Candidate candidate;
+      candidate._do_id = entry.get_do_id();
+      candidate._priority = budget->get_priority(entry.get_do_id());
+      candidate._start = start;
+      candidate._length = pack_dg.get_length() - start;
+      candidates.push_back(candidate);
+
+    } else {
+      if (rebased) {
+        budget->add_rebased(entry.get_do_id());
+      }
+      num_objects++;
+    }
+  }
+
+  if (!limited) {
+    if (budget != nullptr) {
+      budget->set_num_bytes(object_dg.get_length());
+    }
+    return num_objects;
+  }
+
+  // Highest priority first.  Ties keep snapshot order.
+  std::stable_sort(candidates.begin(), candidates.end(),
+                   [](const Candidate &a, const Candidate &b) {
+                     return a._priority > b._priority;
+                   });
+
+  const unsigned char *data = (const unsigned char *)scratch_dg.get_data();
+  size_t max_bytes = budget->get_max_bytes();
+  for (const Candidate &candidate : candidates) {
+    if (num_objects > 0 && object_dg.get_length() + candidate._length > max_bytes) {
+      budget->add_skipped(candidate._do_id);
+      continue;
+    }
+
+    object_dg.append_data(data + candidate._start, candidate._length);
+    int base_tick;
+    if (budget->get_base_tick(candidate._do_id, base_tick)) {
+      budget->add_rebased(candidate._do_id);
+    }
+    num_objects++;
+  }
+
+  budget->set_num_bytes(object_dg.get_length());
+  return num_objects;
+}
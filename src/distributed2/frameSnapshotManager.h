@@ -16,25 +16,97 @@
 
 #include "config_distributed2.h"
 #include "packedObject.h"
+#include "snapshotBudget.h"
 #include "pmap.h"
 #include "extension.h"
 #include "datagram.h"
+#include "pvector.h"
+#include "pmutex.h"
+#include "conditionVar.h"
+#include "thread.h"
 
 class FrameSnapshot;
 
 class EXPCL_DIRECT_DISTRIBUTED2 FrameSnapshotManager {
 PUBLISHED:
   INLINE FrameSnapshotManager();
+  ~FrameSnapshotManager();
 
   PT(PackedObject) create_packed_object(DOID_TYPE do_id);
   PackedObject *get_prev_sent_packet(DOID_TYPE do_id) const;
   void remove_prev_sent_packet(DOID_TYPE do_id);
 
+  bool pack_unchanged_object_in_snapshot(FrameSnapshot *snapshot, int entry,
+                                         DOID_TYPE do_id, ZONEID_TYPE zone_id,
+                                         DCClass *dclass);
+
+  void set_num_encode_threads(int num_threads);
+  INLINE int get_num_encode_threads() const;
+
+  INLINE int get_num_queued_snapshots() const;
+  BLOCKING void format_queued_snapshots();
+
+public:
+  typedef pvector<ZONEID_TYPE> ZoneIds;
+  typedef pvector<DOID_TYPE> DoIds;
+
+  void format_snapshot(Datagram &dg, FrameSnapshot *snapshot,
+                       const ZoneIds &interest_zone_ids,
+                       const DoIds &exclude_do_ids = DoIds(),
+                       SnapshotBudget *budget = nullptr) const;
+  void format_delta_snapshot(Datagram &dg, FrameSnapshot *from, FrameSnapshot *to,
+                             const ZoneIds &interest_zone_ids,
+                             const DoIds &exclude_do_ids = DoIds(),
+                             SnapshotBudget *budget = nullptr) const;
+
+  void queue_snapshot(Datagram *dg, FrameSnapshot *from, FrameSnapshot *to,
+                      ZoneIds &&interest_zone_ids, DoIds &&exclude_do_ids,
+                      SnapshotBudget *budget = nullptr);
+
+  void encode_thread_main();
+
+private:
+  // A client snapshot waiting to be formatted by format_queued_snapshots().
+  // If _from is nullptr, an absolute snapshot is formatted.
+  struct FormatJob {
+    Datagram *_dg;
+    PT(FrameSnapshot) _from;
+    PT(FrameSnapshot) _to;
+    ZoneIds _interest_zone_ids;
+    // Sorted list of objects to leave out even if they are in an interest
+    // zone.
+    DoIds _exclude_do_ids;
+    PT(SnapshotBudget) _budget;
+  };
+  typedef pvector<FormatJob> FormatJobs;
+
+  int pack_client_objects(Datagram &object_dg, FrameSnapshot *from, FrameSnapshot *to,
+                          const ZoneIds &interest_zone_ids, const DoIds &exclude_do_ids,
+                          SnapshotBudget *budget) const;
+  void run_format_job(const FormatJob &job) const;
+  void stop_encode_threads();
+
 private:
   // The most recently sent packets for each object ID.
   typedef phash_map<DOID_TYPE, PT(PackedObject), integer_hash<DOID_TYPE>> PrevSentPackets;
   PrevSentPackets _prev_sent_packets;
 
+  // Worker threads that format queued client snapshots.  The calling thread
+  // also works through the queue, so zero threads means everything is
+  // formatted on the calling thread.
+  typedef pvector<PT(Thread)> EncodeThreads;
+  EncodeThreads _encode_threads;
+
+  FormatJobs _format_jobs;
+  size_t _next_format_job;
+  size_t _format_jobs_remaining;
+  bool _formatting;
+  bool _shutdown;
+
+  Mutex _format_lock;
+  ConditionVar _format_cvar;
+  ConditionVar _format_done_cvar;
+
 PUBLISHED:
   EXTENSION(PackedObject *find_or_create_object_packet_for_baseline(PyObject *dist_obj, DCClass *dclass,
                                                                     DOID_TYPE do_id));
@@ -43,6 +115,15 @@ PUBLISHED:
   EXTENSION(void client_format_delta_snapshot(Datagram &dg, FrameSnapshot *from,
                                               FrameSnapshot *to, PyObject *interest_zone_ids));
 
+  EXTENSION(void queue_client_format_snapshot(Datagram &dg, FrameSnapshot *snapshot,
+                                              PyObject *interest_zone_ids,
+                                              PyObject *exclude_do_ids = nullptr,
+                                              SnapshotBudget *budget = nullptr));
+  EXTENSION(void queue_client_format_delta_snapshot(Datagram &dg, FrameSnapshot *from,
+                                                    FrameSnapshot *to, PyObject *interest_zone_ids,
+                                                    PyObject *exclude_do_ids = nullptr,
+                                                    SnapshotBudget *budget = nullptr));
+
   EXTENSION(bool pack_object_in_snapshot(FrameSnapshot *snapshot, int entry, PyObject *dist_obj,
                                          DOID_TYPE do_id, ZONEID_TYPE zone_id, DCClass *dclass));
 
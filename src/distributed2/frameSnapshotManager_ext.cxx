@@ -22,6 +22,8 @@
 #include "dcField_ext.h"
 #include "dcParameter.h"
 
+#include <algorithm>
+
 /**
  * Packs the current state of the specified object into the packer and fills
  * in where the individual fields are in the buffer. Returns false if the state
@@ -139,6 +141,7 @@ find_or_create_object_packet_for_baseline(PyObject *dist_obj, DCClass *dclass, D
   pack->set_snapshot_creation_tick(-1);
   pack->set_data(data, length);
   pack->set_fields(std::move(fields));
+  pack->quantize_fields();
 
   return pack;
 }
@@ -236,6 +239,7 @@ pack_object_in_snapshot(FrameSnapshot *snapshot, int entry_idx, PyObject *dist_o
   packed_object->set_snapshot_creation_tick(snapshot->get_tick_count());
   packed_object->set_data(packer.take_data(), length);
   packed_object->set_fields(std::move(packed_fields));
+  packed_object->quantize_fields();
 
   entry.set_packed_object(packed_object);
 
@@ -243,52 +247,54 @@ pack_object_in_snapshot(FrameSnapshot *snapshot, int entry_idx, PyObject *dist_o
 }
 
 /**
- * Builds a datagram out of the specified snapshot suitable for sending to a
- * client. Only objects that are in the specified interest zones are packed
- * into the datagram.
+ * Converts a Python list of zone IDs into a C++ vector.
  */
-void Extension<FrameSnapshotManager>::
-client_format_snapshot(Datagram &dg, FrameSnapshot *snapshot,
-                       PyObject *py_interest_zone_ids) {
-  pvector<ZONEID_TYPE> interest_zone_ids;
+static FrameSnapshotManager::ZoneIds
+extract_zone_ids(PyObject *py_interest_zone_ids) {
+  FrameSnapshotManager::ZoneIds interest_zone_ids;
   interest_zone_ids.resize(PyList_Size(py_interest_zone_ids));
   for (size_t i = 0; i < interest_zone_ids.size(); i++) {
     interest_zone_ids[i] = PyLong_AsLong(PyList_GetItem(py_interest_zone_ids, i));
   }
+  return interest_zone_ids;
+}
 
-  // Record tick count of the snapshot
-  dg.add_uint32(snapshot->get_tick_count());
-
-  // Indicate this is *not* a delta snapshot.
-  dg.add_uint8(0);
-
-  int num_objects = 0;
-  Datagram object_dg;
-  for (int i = 0; i < snapshot->get_num_valid_entries(); i++) {
-    FrameSnapshotEntry &entry = snapshot->get_entry(snapshot->get_valid_entry(i));
-    if (std::find(interest_zone_ids.begin(), interest_zone_ids.end(),
-                  entry.get_zone_id()) == interest_zone_ids.end()) {
-
-      // Object not seen by this client, don't include in client snapshot
-      continue;
-    }
-
-    // Object ID
-    object_dg.add_uint32(entry.get_do_id());
+/**
+ * Converts an optional Python sequence of object IDs into a sorted C++
+ * vector.
+ */
+static FrameSnapshotManager::DoIds
+extract_do_ids(PyObject *py_do_ids) {
+  FrameSnapshotManager::DoIds do_ids;
+  if (py_do_ids == nullptr || py_do_ids == Py_None) {
+    return do_ids;
+  }
 
-    // This is not a delta snapshot, just copy the absolute state
-    // onto the datagram.
-    PackedObject *packet = entry.get_packed_object();
-    packet->pack_datagram(object_dg);
+  PyObject *fast = PySequence_Fast(py_do_ids, "expected a sequence of object IDs");
+  if (fast == nullptr) {
+    return do_ids;
+  }
 
-    num_objects++;
+  Py_ssize_t size = PySequence_Fast_GET_SIZE(fast);
+  do_ids.resize(size);
+  for (Py_ssize_t i = 0; i < size; i++) {
+    do_ids[i] = PyLong_AsUnsignedLong(PySequence_Fast_GET_ITEM(fast, i));
   }
+  Py_DECREF(fast);
 
-  // # of objects in this client snapshot
-  dg.add_uint16(num_objects);
+  std::sort(do_ids.begin(), do_ids.end());
+  return do_ids;
+}
 
-  // Copy object data onto main datagram
-  dg.append_data(object_dg.get_data(), object_dg.get_length());
+/**
+ * Builds a datagram out of the specified snapshot suitable for sending to a
+ * client. Only objects that are in the specified interest zones are packed
+ * into the datagram.
+ */
+void Extension<FrameSnapshotManager>::
+client_format_snapshot(Datagram &dg, FrameSnapshot *snapshot,
+                       PyObject *py_interest_zone_ids) {
+  _this->format_snapshot(dg, snapshot, extract_zone_ids(py_interest_zone_ids));
 }
 
 /**
@@ -300,70 +306,38 @@ client_format_snapshot(Datagram &dg, FrameSnapshot *snapshot,
 void Extension<FrameSnapshotManager>::
 client_format_delta_snapshot(Datagram &dg, FrameSnapshot *from, FrameSnapshot *to,
                              PyObject *py_interest_zone_ids) {
-  pvector<ZONEID_TYPE> interest_zone_ids;
-  interest_zone_ids.resize(PyList_Size(py_interest_zone_ids));
-  for (size_t i = 0; i < interest_zone_ids.size(); i++) {
-    interest_zone_ids[i] = PyLong_AsLong(PyList_GetItem(py_interest_zone_ids, i));
-  }
-
-  // Record tick count of the snapshot
-  dg.add_uint32(to->get_tick_count());
-
-  // Indicate this is a delta snapshot.
-  dg.add_uint8(1);
-
-  int num_objects = 0;
-  Datagram object_dg;
-  for (int i = 0; i < to->get_num_valid_entries(); i++) {
-    FrameSnapshotEntry &entry = to->get_entry(to->get_valid_entry(i));
-    if (std::find(interest_zone_ids.begin(), interest_zone_ids.end(),
-                  entry.get_zone_id()) == interest_zone_ids.end()) {
-
-      // Object not seen by this client, don't include in client snapshot
-      continue;
-    }
-
-    PackedObject *packet = entry.get_packed_object();
-
-    vector_int changed_fields;
-    int num_changes = packet->get_fields_changed_after_tick(from->get_tick_count(), changed_fields);
-
-    if (distributed2_cat.is_debug()) {
-      distributed2_cat.debug()
-        << from->get_tick_count() << " to " << to->get_tick_count() << " for client\n";
-      distributed2_cat.debug()
-        << num_changes << " fields changed for client after tick " << from->get_tick_count() << " doId " << packet->get_do_id() << "\n";
-    }
-
-    if (num_changes == 0) {
-      // Nothing changed from previous client snapshot, don't include this
-      // object.
-      continue;
-    }
-
-    // Object ID
-    object_dg.add_uint32(entry.get_do_id());
-
-    if (num_changes != -1) {
-      // How many fields are there?
-      object_dg.add_uint16(num_changes);
-
-      // Now copy each changed field into the datagram
-      for (int j = 0; j < num_changes; j++) {
-        packet->pack_field(object_dg, changed_fields[j]);
-      }
-
-    } else {
-      // -1 means all fields changed, so just pack the whole object
-      packet->pack_datagram(object_dg);
-    }
-
-    num_objects++;
-  }
+  _this->format_delta_snapshot(dg, from, to, extract_zone_ids(py_interest_zone_ids));
+}
 
-  // # of objects in this client snapshot
-  dg.add_uint16(num_objects);
+/**
+ * Like client_format_snapshot(), but only queues the snapshot to be formatted
+ * by the next call to format_queued_snapshots().  The datagram must be kept
+ * alive until then.  Objects in exclude_do_ids are left out of the snapshot
+ * even if they are in an interest zone.  If a budget is given, it limits the
+ * snapshot's size and receives the results once it has been formatted.
+ */
+void Extension<FrameSnapshotManager>::
+queue_client_format_snapshot(Datagram &dg, FrameSnapshot *snapshot,
+                             PyObject *py_interest_zone_ids,
+                             PyObject *py_exclude_do_ids,
+                             SnapshotBudget *budget) {
+  _this->queue_snapshot(&dg, nullptr, snapshot, extract_zone_ids(py_interest_zone_ids),
+                        extract_do_ids(py_exclude_do_ids), budget);
+}
 
-  // Copy object data onto main datagram
-  dg.append_data(object_dg.get_data(), object_dg.get_length());
+/**
+ * Like client_format_delta_snapshot(), but only queues the snapshot to be
+ * formatted by the next call to format_queued_snapshots().  The datagram must
+ * be kept alive until then.  Objects in exclude_do_ids are left out of the
+ * snapshot even if they are in an interest zone.  If a budget is given, it
+ * limits the snapshot's size and receives the results once it has been
+ * formatted.
+ */
+void Extension<FrameSnapshotManager>::
+queue_client_format_delta_snapshot(Datagram &dg, FrameSnapshot *from, FrameSnapshot *to,
+                                   PyObject *py_interest_zone_ids,
+                                   PyObject *py_exclude_do_ids,
+                                   SnapshotBudget *budget) {
+  _this->queue_snapshot(&dg, from, to, extract_zone_ids(py_interest_zone_ids),
+                        extract_do_ids(py_exclude_do_ids), budget);
 }
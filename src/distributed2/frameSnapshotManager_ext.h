@@ -43,6 +43,15 @@ public:
                               PyObject *interest_zone_ids);
   void client_format_delta_snapshot(Datagram &dg, FrameSnapshot *from,
                                     FrameSnapshot *to, PyObject *interest_zone_ids);
+
+  void queue_client_format_snapshot(Datagram &dg, FrameSnapshot *snapshot,
+                                    PyObject *interest_zone_ids,
+                                    PyObject *exclude_do_ids = nullptr,
+                                    SnapshotBudget *budget = nullptr);
+  void queue_client_format_delta_snapshot(Datagram &dg, FrameSnapshot *from,
+                                          FrameSnapshot *to, PyObject *interest_zone_ids,
+                                          PyObject *exclude_do_ids = nullptr,
+                                          SnapshotBudget *budget = nullptr);
 };
 
 #endif // FRAMESNAPSHOTMANAGER_EXT_H
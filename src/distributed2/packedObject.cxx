@@ -15,12 +15,14 @@
 #include "dcClass.h"
 #include "dcField.h"
 #include "dcParameter.h"
+#include "snapshotBitStream.h"
 
 TypeHandle PackedObject::_type_handle;
 
 /**
  * Calculates which fields have different packed values between this
- * PackedObject and the specified data.
+ * PackedObject and the specified data.  Quantized fields only count as
+ * changed if their quantized value changed.
  *
  * NOTE: It is assumed that both buffers have the same length and specify
  *       the same fields in the same order.
@@ -40,10 +42,24 @@ calc_delta(const char *data, size_t length, PackedObject::PackedFields &fields,
 
   delta_fields.reserve(num_fields);
 
+  pvector<uint32_t> codes;
+
   for (int i = 0; i < num_fields; i++) {
     const PackedField &field = get_field(i);
     const PackedField &other_field = fields[i];
 
+    const FieldQuantizer *quantizer = get_field_quantizer(i);
+    if (quantizer != nullptr) {
+      codes.resize(quantizer->get_num_values());
+      if (quantizer->quantize(data + other_field.offset, other_field.length, codes.data())) {
+        if (memcmp(codes.data(), &_quant_codes[_quant_offsets[i]],
+                   codes.size() * sizeof(uint32_t))) {
+          delta_fields.push_back(i);
+        }
+        continue;
+      }
+    }
+
     if (field.length != other_field.length) {
       // If the packed field length is different, obviously the
       // value is different.
@@ -65,19 +81,124 @@ calc_delta(const char *data, size_t length, PackedObject::PackedFields &fields,
 void PackedObject::
 pack_datagram(Datagram &dg) {
   int num_fields = get_num_fields();
-  dg.add_uint16(num_fields);
+  pvector<int> fields(num_fields);
+  for (int i = 0; i < num_fields; i++) {
+    fields[i] = i;
+  }
+
+  pack_fields(dg, fields.data(), num_fields);
+}
+
+/**
+ * Packs the indicated subset of fields onto the datagram.  The field list
+ * must be in ascending order.
+ *
+ * The fields are identified either by a list of uint16 field numbers, or by
+ * a bitmask over the class's inherited fields, whichever is smaller.  The
+ * leading uint16 is the number of fields in the first case, or the number of
+ * mask bytes with the high bit set in the second.
+ *
+ * The quantized values of the quantized fields follow, bit packed, padded to
+ * a whole byte, then the data of the rest of the fields.  The receiver knows
+ * from the field list how many bits the quantized values take.
+ */
+void PackedObject::
+pack_fields(Datagram &dg, const int *fields, int num_fields) {
+  if (num_fields == 0) {
+    dg.add_uint16(0);
+    return;
+  }
+
+  int max_field_index = get_field(fields[num_fields - 1]).field_index;
+  int mask_bytes = (max_field_index >> 3) + 1;
+
+  if (mask_bytes < num_fields * 2 && mask_bytes < 0x8000) {
+    dg.add_uint16(0x8000 | mask_bytes);
+
+    pvector<unsigned char> mask(mask_bytes, 0);
+    for (int i = 0; i < num_fields; i++) {
+      int field_index = get_field(fields[i]).field_index;
+      mask[field_index >> 3] |= (1 << (field_index & 7));
+    }
+    dg.append_data(mask.data(), mask_bytes);
+
+  } else {
+    dg.add_uint16(num_fields);
+    for (int i = 0; i < num_fields; i++) {
+      dg.add_uint16(get_field(fields[i]).field_index);
+    }
+  }
+
+  if (!_quantizers.empty()) {
+    SnapshotBitWriter writer(dg);
+    for (int i = 0; i < num_fields; i++) {
+      const FieldQuantizer *quantizer = _quantizers[fields[i]];
+      if (quantizer != nullptr) {
+        const uint32_t *codes = &_quant_codes[_quant_offsets[fields[i]]];
+        int value_bits = quantizer->get_value_bits();
+        for (int v = 0; v < quantizer->get_num_values(); v++) {
+          writer.write(codes[v], value_bits);
+        }
+      }
+    }
+    writer.flush();
+  }
 
   for (int i = 0; i < num_fields; i++) {
-    pack_field(dg, i);
+    if (get_field_quantizer(fields[i]) == nullptr) {
+      pack_field_data(dg, fields[i]);
+    }
   }
 }
 
 /**
- * Packs the indicated field onto the datagram.
+ * Packs only the data of the indicated field onto the datagram.
  */
 void PackedObject::
-pack_field(Datagram &dg, int n) {
+pack_field_data(Datagram &dg, int n) {
   const PackedField &field = get_field(n);
-  dg.add_uint16(field.field_index);
   dg.append_data(_data + field.offset, field.length);
 }
+
+/**
+ * Looks up which of the fields are quantized, and quantizes their values,
+ * for pack_fields() and calc_delta().  Call this once the class, data and
+ * fields have been set.
+ */
+void PackedObject::
+quantize_fields() {
+  _quantizers.clear();
+  _quant_offsets.clear();
+  _quant_codes.clear();
+
+  if (_dclass == nullptr) {
+    return;
+  }
+
+  int num_fields = get_num_fields();
+  for (int i = 0; i < num_fields; i++) {
+    const PackedField &packed_field = get_field(i);
+    DCField *field = _dclass->get_inherited_field(packed_field.field_index);
+    const FieldQuantizer *quantizer = (field != nullptr) ? FieldQuantizer::get_quantizer(field) : nullptr;
+    if (quantizer == nullptr) {
+      continue;
+    }
+
+    if (_quantizers.empty()) {
+      _quantizers.resize(num_fields, nullptr);
+      _quant_offsets.resize(num_fields, -1);
+    }
+
+    size_t offset = _quant_codes.size();
+    _quant_codes.resize(offset + quantizer->get_num_values(), 0);
+    if (!quantizer->quantize(_data + packed_field.offset, packed_field.length,
+                             &_quant_codes[offset])) {
+      // The receiver expects the field quantized, so it gets zeroes.
+      distributed2_cat.warning()
+        << "Could not quantize field " << field->get_name() << " of object "
+        << _do_id << "\n";
+    }
+    _quantizers[i] = quantizer;
+    _quant_offsets[i] = (int)offset;
+  }
+}
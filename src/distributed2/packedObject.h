@@ -21,6 +21,7 @@
 #include "typedReferenceCount.h"
 #include "deletedChain.h"
 #include "datagram.h"
+#include "fieldQuantizer.h"
 
 class DCClass;
 
@@ -76,12 +77,23 @@ PUBLISHED:
                  vector_int &delta_fields);
 
   void pack_datagram(Datagram &dg);
-  void pack_field(Datagram &dg, int n);
+  void pack_fields(Datagram &dg, const int *fields, int num_fields);
+  void pack_field_data(Datagram &dg, int n);
+
+public:
+  void quantize_fields();
+  INLINE const FieldQuantizer *get_field_quantizer(int n) const;
 
 private:
   // Individual field information
   pvector<PackedField> _fields;
 
+  // The quantizer of each field, or nullptr, and the offset of the field's
+  // codes in _quant_codes.  Empty if no field is quantized.
+  pvector<const FieldQuantizer *> _quantizers;
+  vector_int _quant_offsets;
+  pvector<uint32_t> _quant_codes;
+
   char *_data;
   size_t _length;
 
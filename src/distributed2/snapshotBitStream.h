@@ -0,0 +1,58 @@
+/**
+ * PANDA 3D SOFTWARE
+ * Copyright (c) Carnegie Mellon University.  All rights reserved.
+ *
+ * All use of this software is subject to the terms of the revised BSD
+ * license.  You should have received a copy of this license along
+ * with this source code in a file named "LICENSE."
+ *
+ * @file snapshotBitStream.h
+ * @author agent
+ * @date 2026-10-18
+ */
+
+#ifndef SNAPSHOTBITSTREAM_H
+#define SNAPSHOTBITSTREAM_H
+
+#include "config_distributed2.h"
+#include "datagram.h"
+#include "datagramIterator.h"
+#include "numeric_types.h"
+
+/**
+ * Appends values of arbitrary bit widths to a datagram, least significant
+ * bit first.  Call flush() when done, to write out the last partial byte.
+ */
+class EXPCL_DIRECT_DISTRIBUTED2 SnapshotBitWriter {
+public:
+  INLINE explicit SnapshotBitWriter(Datagram &dg);
+
+  INLINE void write(uint32_t value, int num_bits);
+  INLINE void flush();
+
+private:
+  Datagram &_dg;
+  uint64_t _bits;
+  int _num_bits;
+};
+
+/**
+ * Reads values written by a SnapshotBitWriter from a datagram.  Bytes are
+ * taken from the iterator as they are needed, so once the last value has
+ * been read, the iterator is at the byte after it.
+ */
+class EXPCL_DIRECT_DISTRIBUTED2 SnapshotBitReader {
+public:
+  INLINE explicit SnapshotBitReader(DatagramIterator &dgi);
+
+  INLINE uint32_t read(int num_bits);
+
+private:
+  DatagramIterator &_dgi;
+  uint64_t _bits;
+  int _num_bits;
+};
+
+#include "snapshotBitStream.I"
+
+#endif // SNAPSHOTBITSTREAM_H
@@ -0,0 +1,16 @@
+/**
+ * PANDA 3D SOFTWARE
+ * Copyright (c) Carnegie Mellon University.  All rights reserved.
+ *
+ * All use of this software is subject to the terms of the revised BSD
+ * license.  You should have received a copy of this license along
+ * with this source code in a file named "LICENSE."
+ *
+ * @file snapshotBudget.cxx
+ * @author agent
+ * @date 2026-10-18
+ */
+
+#include "snapshotBudget.h"
+
+TypeHandle SnapshotBudget::_type_handle;
@@ -0,0 +1,102 @@
+/**
+ * PANDA 3D SOFTWARE
+ * Copyright (c) Carnegie Mellon University.  All rights reserved.
+ *
+ * All use of this software is subject to the terms of the revised BSD
+ * license.  You should have received a copy of this license along
+ * with this source code in a file named "LICENSE."
+ *
+ * @file snapshotBudget.h
+ * @author agent
+ * @date 2026-10-18
+ */
+
+#ifndef SNAPSHOTBUDGET_H
+#define SNAPSHOTBUDGET_H
+
+#include "config_distributed2.h"
+#include "typedReferenceCount.h"
+#include "dcbase.h"
+#include "pmap.h"
+#include "pvector.h"
+
+/**
+ * Limits the size of a single client snapshot.  When formatting a snapshot
+ * with a budget, the FrameSnapshotManager ranks the objects that have
+ * something to send by priority and packs only as many of the highest
+ * priority ones as fit in the byte limit.  At least one object is always
+ * packed.
+ *
+ * The budget also lets individual objects be delta compressed against an
+ * older tick than the rest of the snapshot, which is needed to catch up an
+ * object that was left out of earlier snapshots.
+ *
+ * After formatting, the budget holds the objects that were left out, and the
+ * objects that were packed against their own base tick.
+ */
+class EXPCL_DIRECT_DISTRIBUTED2 SnapshotBudget : public TypedReferenceCount {
+PUBLISHED:
+  INLINE explicit SnapshotBudget(size_t max_bytes = 0);
+
+  INLINE void set_max_bytes(size_t max_bytes);
+  INLINE size_t get_max_bytes() const;
+
+  INLINE void set_priority(DOID_TYPE do_id, float priority);
+  INLINE float get_priority(DOID_TYPE do_id) const;
+
+  INLINE void set_base_tick(DOID_TYPE do_id, int tick);
+  INLINE bool get_base_tick(DOID_TYPE do_id, int &tick) const;
+
+  INLINE size_t get_num_skipped() const;
+  INLINE DOID_TYPE get_skipped(size_t n) const;
+  MAKE_SEQ(get_skipped_objects, get_num_skipped, get_skipped);
+
+  INLINE size_t get_num_rebased() const;
+  INLINE DOID_TYPE get_rebased(size_t n) const;
+  MAKE_SEQ(get_rebased_objects, get_num_rebased, get_rebased);
+
+  INLINE size_t get_num_bytes() const;
+
+public:
+  INLINE void clear_results();
+  INLINE void add_skipped(DOID_TYPE do_id);
+  INLINE void add_rebased(DOID_TYPE do_id);
+  INLINE void set_num_bytes(size_t num_bytes);
+
+private:
+  size_t _max_bytes;
+
+  typedef phash_map<DOID_TYPE, float, integer_hash<DOID_TYPE>> Priorities;
+  Priorities _priorities;
+
+  // Per-object tick to delta compress against, instead of the snapshot's
+  // from tick.  -1 means pack the whole object.
+  typedef phash_map<DOID_TYPE, int, integer_hash<DOID_TYPE>> BaseTicks;
+  BaseTicks _base_ticks;
+
+  typedef pvector<DOID_TYPE> DoIds;
+  DoIds _skipped;
+  DoIds _rebased;
+  size_t _num_bytes;
+
+public:
+  static TypeHandle get_class_type() {
+    return _type_handle;
+  }
+  static void init_type() {
+    TypedReferenceCount::init_type();
+    register_type(_type_handle, "SnapshotBudget",
+                  TypedReferenceCount::get_class_type());
+    }
+  virtual TypeHandle get_type() const {
+    return get_class_type();
+  }
+  virtual TypeHandle force_init_type() {init_type(); return get_class_type();}
+
+private:
+  static TypeHandle _type_handle;
+};
+
+#include "snapshotBudget.I"
+
+#endif // SNAPSHOTBUDGET_H
@@ -8,12 +8,20 @@ from . import MessengerGlobal
 from direct.directnotify.DirectNotifyGlobal import *
 from direct.task import TaskManagerGlobal
 from panda3d.core import PStatCollector, EventQueue, EventHandler
-from panda3d.core import ConfigVariableBool, EventStorePandaNode
+from panda3d.core import ConfigVariableBool, ConfigVariableList, EventStorePandaNode
 
 class EventManager:
 
     notify = None
 
+    # How repeated occurrences of an event in one pass over the queue are
+    # merged.
+    MergeNone = 0
+    # Only the last occurrence is processed.
+    MergeLatest = 1
+    # Only the first occurrence is processed.
+    MergeFirst = 2
+
     def __init__(self, eventQueue = None, messenger = None, taskMgr = None):
         """
         Create a C++ event queue and handler
@@ -24,6 +32,9 @@ class EventManager:
 
         self.eventQueue = eventQueue
         self.eventHandler = None
+        # Bumped by shutdown(), so that the rest of a batch of events being
+        # processed is dropped along with the queue.
+        self._generation = 0
 
         if not messenger:
             messenger = MessengerGlobal.messenger
@@ -35,20 +46,119 @@ class EventManager:
 
         self._wantPstats = ConfigVariableBool('pstats-eventmanager', False)
 
+        # eventName->merge policy, for events that are thrown many times a
+        # frame and of which only one occurrence matters.
+        self.mergePolicies = {}
+        for eventName in ConfigVariableList('event-merge-latest',
+                "Names of events of which only the last occurrence each "
+                "frame is processed."):
+            self.mergePolicies[eventName] = self.MergeLatest
+
+    def setMergePolicy(self, eventName, policy):
+        """
+        Sets how repeated occurrences of the named event are merged when the
+        queue is processed, one of MergeNone, MergeLatest or MergeFirst.
+        Events that are dropped aren't passed to the C++ event handler
+        either.
+        """
+        if policy == self.MergeNone:
+            self.mergePolicies.pop(eventName, None)
+        else:
+            self.mergePolicies[eventName] = policy
+
+    def getMergePolicy(self, eventName):
+        return self.mergePolicies.get(eventName, self.MergeNone)
+
     def doEvents(self):
         """
         Process all the events on the C++ event queue
         """
-        # use different methods for handling events with and without pstats tracking
-        # for efficiency
-        if self._wantPstats:
-            processFunc = self.processEventPstats
-        else:
-            processFunc = self.processEvent
         isEmptyFunc = self.eventQueue.isQueueEmpty
         dequeueFunc = self.eventQueue.dequeueEvent
+        if self._wantPstats:
+            # Tracked one at a time, so each event gets its own collector.
+            while not isEmptyFunc():
+                self.processEventPstats(dequeueFunc())
+            return
+
+        # Drain the queue in batches.  Events thrown while a batch is
+        # processed make up the next one, so the order is the same as
+        # processing them one at a time.
         while not isEmptyFunc():
-            processFunc(dequeueFunc())
+            events = []
+            while not isEmptyFunc():
+                events.append(dequeueFunc())
+            self.processEvents(events)
+
+    def mergeEvents(self, events):
+        """
+        Returns the list of events with the occurrences that are superseded
+        according to the merge policies taken out.
+        """
+        policies = self.mergePolicies
+        keep = {}
+        for i, event in enumerate(events):
+            policy = policies.get(event.name)
+            if policy == self.MergeLatest:
+                keep[event.name] = i
+            elif policy == self.MergeFirst and event.name not in keep:
+                keep[event.name] = i
+
+        if not keep:
+            return events
+
+        return [event for i, event in enumerate(events)
+                if keep.get(event.name, i) == i]
+
+    def processEvents(self, events):
+        """
+        Process a list of C++ events, in order, after merging them according
+        to the merge policies.  If a handler shuts the EventManager down, the
+        remaining events are dropped.
+        Duplicate any changes in processEventPstats
+        """
+        if self.mergePolicies:
+            events = self.mergeEvents(events)
+
+        messenger = self.messenger
+        globalMessenger = MessengerGlobal.messenger
+        if globalMessenger is messenger:
+            globalMessenger = None
+        handler = self.eventHandler
+        parseFunc = self.parseEventParameter
+        notifyDebug = EventManager.notify.getDebug()
+        generation = self._generation
+
+        for event in events:
+            if self._generation != generation:
+                # Shut down by the last handler, and the queue flushed.
+                break
+
+            eventName = event.name
+            if not eventName:
+                # An unnamed event from C++ is probably a bad thing
+                EventManager.notify.warning('unnamed event in processEvents')
+                continue
+
+            # Most events, such as button events, have no parameters.
+            if event.getNumParameters():
+                paramList = [parseFunc(eventParameter)
+                             for eventParameter in event.parameters]
+            else:
+                paramList = []
+
+            # Do not print the new frame debug, it is too noisy!
+            if notifyDebug and eventName != 'NewFrame':
+                EventManager.notify.debug('received C++ event named: ' + eventName +
+                                          ' parameters: ' + repr(paramList))
+
+            messenger.send(eventName, paramList)
+            if globalMessenger:
+                globalMessenger.send(eventName, paramList)
+
+            # Also send the event down into C++ land
+            if handler:
+                handler.dispatchEvent(event)
 
     def eventLoopTask(self, task):
         """
@@ -89,49 +199,17 @@ class EventManager:
     def processEvent(self, event):
         """
         Process a C++ event
-        Duplicate any changes in processEventPstats
         """
-        # **************************************************************
-        # ******** Duplicate any changes in processEventPstats *********
-        # **************************************************************
-        # Get the event name
-        eventName = event.name
-        if eventName:
-            paramList = []
-            for eventParameter in event.parameters:
-                eventParameterData = self.parseEventParameter(eventParameter)
-                paramList.append(eventParameterData)
-
-            # Do not print the new frame debug, it is too noisy!
-            if (EventManager.notify.getDebug() and eventName != 'NewFrame'):
-                EventManager.notify.debug('received C++ event named: ' + eventName +
-                                          ' parameters: ' + repr(paramList))
-            # **************************************************************
-            # ******** Duplicate any changes in processEventPstats *********
-            # **************************************************************
-            # Send the event, we used to send it with the event
-            # name as a parameter, but now you can use extraArgs for that
-            self.messenger.send(eventName, paramList)
-            if self.messenger != MessengerGlobal.messenger:
-                MessengerGlobal.messenger.send(eventName, paramList)
-
-            # Also send the event down into C++ land
-            handler = self.eventHandler
-            if handler:
-                handler.dispatchEvent(event)
-
-        else:
-            # An unnamed event from C++ is probably a bad thing
-            EventManager.notify.warning('unnamed event in processEvent')
+        self.processEvents([event])
 
     def processEventPstats(self, event):
         """
         Process a C++ event with pstats tracking
-        Duplicate any changes in processEvent
+        Duplicate any changes in processEvents
         """
-        # ********************************************************
-        # ******** Duplicate any changes in processEvent *********
-        # ********************************************************
+        # *********************************************************
+        # ******** Duplicate any changes in processEvents *********
+        # *********************************************************
         # Get the event name
         eventName = event.name
         if eventName:
@@ -146,9 +224,9 @@ class EventManager:
                                           ' parameters: ' + repr(paramList))
             # Send the event, we used to send it with the event
             # name as a parameter, but now you can use extraArgs for that
-            # ********************************************************
-            # ******** Duplicate any changes in processEvent *********
-            # ********************************************************
+            # *********************************************************
+            # ******** Duplicate any changes in processEvents *********
+            # *********************************************************
             name = eventName
             hyphen = name.find('-')
             if hyphen >= 0:
@@ -193,6 +271,7 @@ class EventManager:
 
     def shutdown(self):
         self.taskMgr.remove('eventManager')
+        self._generation += 1
 
         # Flush the event queue.  We do this after removing the task
         # since the task removal itself might also fire off an event.
@@ -22,6 +22,7 @@ from direct.extensions_native import NodePath_extensions
 # This needs to be available early for DirectGUI imports
 import sys
 import builtins
+import time
 builtins.config = DConfig
 
 class HostBase(DirectObject):
@@ -48,6 +49,34 @@ class HostBase(DirectObject):
         # when this is false, it only has to do with builtin simulation tasks.
         self.fixedSimulationStep = self.config.GetBool('want-fixed-simulation-step', 0)
 
+        # Do you want the main loop to sleep until the next simulation tick
+        # is due, instead of running frames back to back?  This is meant for
+        # headless processes, such as dedicated servers, that have nothing to
+        # do between simulation ticks.
+        self.idleSleep = self.config.GetBool('want-idle-sleep', 0)
+        # The final stretch of each idle sleep is spent yielding in a loop
+        # rather than sleeping, since sleep tends to wake up late.
+        self.idleSpinTime = self.config.GetFloat('idle-spin-time', 0.001)
+        # If set, this is called with the number of seconds to wait instead
+        # of sleeping, so the wait can end early, for instance when network
+        # data comes in.
+        self.idleWaitFunc = None
+
+        # The most simulation ticks to run in a single frame, or 0 for no
+        # limit.  When a frame stalls, the ticks it owes beyond this are
+        # handled according to tickOverloadPolicy:
+        #   'drop' - the extra ticks are skipped over, so the tick count
+        #            jumps ahead and simulated time stays in step with real
+        #            time.
+        #   'slow' - up to maxDeferredTicks of the extra ticks are carried
+        #            over to later frames, to catch up on a brief spike, and
+        #            the rest are discarded without advancing the tick count,
+        #            so simulated time runs slower than real time while the
+        #            load lasts.
+        self.maxTicksPerFrame = self.config.GetInt('max-ticks-per-frame', 0)
+        self.tickOverloadPolicy = self.config.GetString('tick-overload-policy', 'drop')
+        self.maxDeferredTicks = self.config.GetInt('max-deferred-ticks', self.maxTicksPerFrame)
+
         #: The global event manager, as imported from `.EventManagerGlobal`.
         self.eventMgr = eventMgr
         #: The global messenger, as imported from `.MessengerGlobal`.
@@ -140,10 +169,29 @@ class HostBase(DirectObject):
         self.currentTicksThisFrame = 0
         # What tick are we currently on this frame?
         self.currentFrameTick = 0
+        # How many frames have hit maxTicksPerFrame, and how many ticks were
+        # dropped, discarded to slow down simulated time, or are currently
+        # carried over as a result.
+        self.overloadFrames = 0
+        self.droppedTicks = 0
+        self.dilatedTicks = 0
+        self.deferredTicks = 0
+        # Real time the simulation has fallen behind by through dilated
+        # ticks.  Simulated time plus this is real time.
+        self.dilatedTime = 0.0
         # How many simulations ticks are we running per-second?
         self.ticksPerSec = 60
         self.intervalPerTick = 1.0 / self.ticksPerSec
 
+        # Real time at which the current frame started.
+        self.frameStartTime = self.frameTime
+        # How long the last frame worked and how long it then slept, and the
+        # running totals, when idle sleeping is enabled.
+        self.idleWorkTime = 0.0
+        self.idleSleepTime = 0.0
+        self.totalIdleWorkTime = 0.0
+        self.totalIdleSleepTime = 0.0
+
         self.taskMgr.finalInit()
 
     def shutdown(self):
@@ -215,6 +263,11 @@ class HostBase(DirectObject):
             numTicks = int(self.remainder / self.intervalPerTick)
             self.remainder -= numTicks * self.intervalPerTick
 
+        self.deferredTicks = 0
+        if self.maxTicksPerFrame > 0 and numTicks > self.maxTicksPerFrame:
+            self.handleTickOverload(numTicks)
+            numTicks = self.maxTicksPerFrame
+
         self.totalTicksThisFrame = numTicks
         self.currentFrameTick = 0
         self.currentTicksThisFrame = 1
@@ -254,14 +307,61 @@ class HostBase(DirectObject):
         # And finally, step all frame-bound tasks
         self.taskMgr.step()
 
+    def handleTickOverload(self, numTicks):
+        """
+        Called when a frame owes more than maxTicksPerFrame simulation ticks.
+        Applies the overload policy to the ticks that won't be run this frame
+        and sends a 'simOverload' event with the number of ticks owed and the
+        number that will be run.
+        """
+        excess = numTicks - self.maxTicksPerFrame
+        self.overloadFrames += 1
+
+        if self.tickOverloadPolicy == 'slow':
+            # Carry some of the extra ticks over to later frames, and let
+            # simulated time fall behind by the rest, so that sustained
+            # overload can't build up an ever growing debt of ticks.
+            carried = min(excess, self.maxDeferredTicks)
+            self.remainder += carried * self.intervalPerTick
+            self.deferredTicks = carried
+            # The discarded time is taken out of simulated time for good,
+            # so it isn't owed again by the next frame.
+            dilated = excess - carried
+            self.dilatedTicks += dilated
+            self.dilatedTime += dilated * self.intervalPerTick
+        else:
+            # Skip over the extra ticks.
+            self.tickCount += excess
+            self.droppedTicks += excess
+
+        self.notify.debug("Simulation overloaded: owed %i ticks, running %i (%s)" %
+                          (numTicks, self.maxTicksPerFrame, self.tickOverloadPolicy))
+        self.messenger.send('simOverload', [numTicks, self.maxTicksPerFrame])
+
+    def getOverloadStats(self):
+        """
+        Returns a dictionary with the number of overloaded frames, the total
+        number of dropped ticks, the total number of ticks discarded to slow
+        down simulated time and the real time they add up to, and the number
+        of ticks carried over from the last frame.
+        """
+        return {'overloadFrames': self.overloadFrames,
+                'droppedTicks': self.droppedTicks,
+                'dilatedTicks': self.dilatedTicks,
+                'dilatedTime': self.dilatedTime,
+                'deferredTicks': self.deferredTicks}
+
     def postRunFrame(self):
         pass
 
     def doRunFrame(self):
         # Manually advance the clock
         now = self.globalClock.getRealTime()
-        self.deltaTime = now - self.frameTime
+        # frameTime is in simulated time after runFrame(), which is behind
+        # real time by the dilated time.
+        self.deltaTime = now - self.dilatedTime - self.frameTime
         self.frameTime = now
+        self.frameStartTime = now
 
         self.globalClock.setFrameTime(self.frameTime)
         self.globalClock.setDt(self.deltaTime)
@@ -273,6 +373,45 @@ class HostBase(DirectObject):
 
         self.frameCount += 1
 
+    def idleUntilNextTick(self):
+        """
+        Sleeps until the next simulation tick is due.  Called after each
+        frame by the main loop when want-idle-sleep is set.
+        """
+        now = self.globalClock.getRealTime()
+        # After runFrame(), frameTime is the time of the last tick plus the
+        # leftover remainder, so the next tick is due one interval after the
+        # last tick, in real time once the dilated time is added back.
+        due = self.frameTime + self.dilatedTime - self.remainder + self.intervalPerTick
+        wait = due - now
+
+        if wait > 0:
+            if self.idleWaitFunc:
+                self.idleWaitFunc(wait)
+            else:
+                if wait > self.idleSpinTime:
+                    time.sleep(wait - self.idleSpinTime)
+                while self.globalClock.getRealTime() < due:
+                    time.sleep(0)
+
+        end = self.globalClock.getRealTime()
+        self.idleWorkTime = now - self.frameStartTime
+        self.idleSleepTime = end - now
+        self.totalIdleWorkTime += self.idleWorkTime
+        self.totalIdleSleepTime += self.idleSleepTime
+
+    def getIdleStats(self):
+        """
+        Returns a dictionary with the time the last frame spent working and
+        sleeping, the running totals, and the fraction of time spent working.
+        """
+        total = self.totalIdleWorkTime + self.totalIdleSleepTime
+        return {'work': self.idleWorkTime,
+                'sleep': self.idleSleepTime,
+                'totalWork': self.totalIdleWorkTime,
+                'totalSleep': self.totalIdleSleepTime,
+                'utilization': self.totalIdleWorkTime / total if total > 0 else 0.0}
+
     def run(self):
         """Starts the main loop of the application."""
 
@@ -296,6 +435,8 @@ class HostBase(DirectObject):
             while self.taskMgr.running:
                 try:
                     self.doRunFrame()
+                    if self.idleSleep:
+                        self.idleUntilNextTick()
                 except KeyboardInterrupt:
                     self.taskMgr.stop()
                 except SystemError:
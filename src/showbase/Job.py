@@ -20,6 +20,25 @@ class Job(DirectObject):
     #: Yield any remaining time for this job until next frame.
     Sleep = object()
 
+    class Compute:
+        """Yield ``Job.Compute(func, *args, **kwArgs)`` from `run()` to
+        have the JobManager call func on a worker thread, or a worker
+        process if job-manager-use-processes is set, instead of in the
+        timeslice.  The job is parked until the call returns, and the yield
+        expression then evaluates to its return value, or raises its
+        exception::
+
+            path = yield Job.Compute(findPath, start, goal)
+
+        func must not touch the scene graph or anything else the main
+        thread uses, and with processes, it and its arguments must be
+        picklable.
+        """
+        def __init__(self, func, *args, **kwArgs):
+            self.func = func
+            self.args = args
+            self.kwArgs = kwArgs
+
     # These priorities determine how many timeslices a job gets relative to other
     # jobs. A job with priority of 1000 will run 10 times more often than a job
     # with priority of 100.
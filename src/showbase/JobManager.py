@@ -2,17 +2,25 @@ from direct.directnotify.DirectNotifyGlobal import directNotify
 from direct.task.TaskManagerGlobal import taskMgr
 from direct.showbase.Job import Job
 from direct.showbase.PythonUtil import getBase
+import concurrent.futures
 
 class JobManager:
     """
     Similar to the taskMgr but designed for tasks that are CPU-intensive and/or
     not time-critical. Jobs run in a fixed timeslice that the JobManager is
     allotted each frame.
+
+    If job-manager-frame-budget-ms is set, the JobManager runs after igLoop
+    instead, and its timeslice grows to use whatever is left of that frame
+    budget.  Steps of a job that yield a `Job.Compute` run on a pool of
+    worker threads or processes, outside of the timeslice.
     """
     notify = directNotify.newCategory("JobManager")
 
     # there's one task for the JobManager, all jobs run in this task
     TaskName = 'jobManager'
+    # sort of the task with an adaptive timeslice, right after igLoop
+    AdaptiveTaskSort = 55
 
     def __init__(self, timeslice=None):
         # how long do we run per frame
@@ -31,14 +39,26 @@ class JobManager:
         # out CPU usage
         self._jobId2overflowTime = {}
         self._useOverflowTime = None
+        # frame budget from the config, read when first needed
+        self._frameBudget = None
         # this is a generator that we use to give high-priority jobs more timeslices,
         # it yields jobIds in a sequence that includes high-priority jobIds more often
         # than low-priority
         self._jobIdGenerator = None
         self._highestPriority = Job.Priorities.Normal
+        # jobId -> future of the Job.Compute the job is parked on
+        self._jobId2future = {}
+        # pool that runs Job.Compute steps, created when first needed
+        self._executor = None
 
     def destroy(self):
         taskMgr.remove(JobManager.TaskName)
+        for future in self._jobId2future.values():
+            future.cancel()
+        self._jobId2future = {}
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
         del self._pri2jobId2job
 
     def add(self, job):
@@ -59,7 +79,11 @@ class JobManager:
         # reset the jobId round-robin
         self._jobIdGenerator = None
         if len(self._jobId2pri) == 1:
-            taskMgr.add(self._process, JobManager.TaskName)
+            if self._getFrameBudget():
+                taskMgr.add(self._process, JobManager.TaskName,
+                            sort=JobManager.AdaptiveTaskSort)
+            else:
+                taskMgr.add(self._process, JobManager.TaskName)
             self._highestPriority = pri
         elif pri > self._highestPriority:
             self._highestPriority = pri
@@ -79,6 +103,10 @@ class JobManager:
         self._jobId2timeslices.pop(jobId)
         # remove the overflow time
         self._jobId2overflowTime.pop(jobId)
+        # abandon the computation the job is waiting on, if any
+        future = self._jobId2future.pop(jobId, None)
+        if future is not None:
+            future.cancel()
         if len(self._pri2jobId2job[pri]) == 0:
             del self._pri2jobId2job[pri]
             if pri == self._highestPriority:
@@ -106,13 +134,16 @@ class JobManager:
         job.resume()
         while True:
             try:
-                result = next(gen)
+                # this waits for the computation the job is parked on
+                result = self._stepJob(jobId, gen)
             except StopIteration:
                 # Job didn't yield Job.Done, it ran off the end and returned
                 # treat it as if it returned Job.Done
                 self.notify.warning('job %s never yielded Job.Done' % job)
                 result = Job.Done
-            if result is Job.Done:
+            if isinstance(result, Job.Compute):
+                self._jobId2future[jobId] = self._submit(result)
+            elif result is Job.Done:
                 job.suspend()
                 self.remove(job)
                 job._setFinished()
@@ -135,6 +166,60 @@ class JobManager:
     def setTimeslice(self, timeslice):
         self._timeslice = timeslice
 
+    @staticmethod
+    def getFrameBudget():
+        # how long a frame may take, including the JobManager's timeslice, or
+        # 0 for a fixed timeslice.
+        # config is in milliseconds, this func returns value in seconds
+        return getBase().config.GetFloat('job-manager-frame-budget-ms', 0.) / 1000.
+
+    def _getFrameBudget(self):
+        if self._frameBudget is None:
+            self._frameBudget = self.getFrameBudget()
+        return self._frameBudget
+
+    def _getAdaptiveTimeslice(self, frameBudget):
+        # use whatever the rest of the frame left over, but at least the
+        # regular timeslice
+        used = globalClock.getRealTime() - globalClock.getFrameTime()
+        return max(self.getTimeslice(), frameBudget - used)
+
+    def _getExecutor(self):
+        if self._executor is None:
+            numWorkers = getBase().config.GetInt('job-manager-workers', 0) or None
+            if getBase().config.GetBool('job-manager-use-processes', 0):
+                self._executor = concurrent.futures.ProcessPoolExecutor(numWorkers)
+            else:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    numWorkers, thread_name_prefix='jobManager')
+        return self._executor
+
+    def _submit(self, compute):
+        return self._getExecutor().submit(compute.func, *compute.args, **compute.kwArgs)
+
+    def _stepJob(self, jobId, gen):
+        # advances the job's generator, handing it the outcome of the
+        # computation it was parked on, if any
+        future = self._jobId2future.pop(jobId, None)
+        if future is None:
+            return next(gen)
+        exception = future.exception()
+        if exception is not None:
+            return gen.throw(exception)
+        return gen.send(future.result())
+
+    def _isParked(self, jobId):
+        future = self._jobId2future.get(jobId)
+        return future is not None and not future.done()
+
+    def _hasRunnableJob(self):
+        if len(self._jobId2future) < len(self._jobId2pri):
+            return True
+        for future in self._jobId2future.values():
+            if future.done():
+                return True
+        return False
+
     def _getSortedPriorities(self):
         # returns all job priorities in ascending order
         priorities = list(self._pri2jobId2job.keys())
@@ -147,7 +232,12 @@ class JobManager:
         if len(self._pri2jobId2job):
             #assert self.notify.debugCall()
             # figure out how long we can run
-            endT = globalClock.getRealTime() + (self.getTimeslice() * .9)
+            frameBudget = self._getFrameBudget()
+            if frameBudget:
+                timeslice = self._getAdaptiveTimeslice(frameBudget)
+            else:
+                timeslice = self.getTimeslice()
+            endT = globalClock.getRealTime() + (timeslice * .9)
             while True:
                 if self._jobIdGenerator is None:
                     # round-robin the jobs, giving high-priority jobs more timeslices
@@ -165,6 +255,12 @@ class JobManager:
                 if pri is None:
                     # this job is no longer present
                     continue
+                if self._isParked(jobId):
+                    # still waiting on its computation
+                    if not self._hasRunnableJob():
+                        # every job is, nothing to do this frame
+                        break
+                    continue
                 # check if there's overflow time that we need to make up for
                 if self._useOverflowTime:
                     overflowTime = self._jobId2overflowTime[jobId]
@@ -181,7 +277,7 @@ class JobManager:
                 job.resume()
                 while globalClock.getRealTime() < endT:
                     try:
-                        result = next(gen)
+                        result = self._stepJob(jobId, gen)
                     except StopIteration:
                         # Job didn't yield Job.Done, it ran off the end and returned
                         # treat it as if it returned Job.Done
@@ -194,6 +290,14 @@ class JobManager:
                             job._pstats.stop()
                         # grab the next job if there's time left
                         break
+                    elif isinstance(result, Job.Compute):
+                        # park the job until the computation is done
+                        self._jobId2future[jobId] = self._submit(result)
+                        job.suspend()
+                        if __debug__:
+                            job._pstats.stop()
+                        # grab the next job if there's time left
+                        break
                     elif result is Job.Done:
                         job.suspend()
                         self.remove(job)
@@ -10,6 +10,8 @@ from direct.directnotify import DirectNotifyGlobal
 import types
 
 from direct.stdpy.threading import Lock
+from panda3d.core import ConfigVariableBool
+from _thread import get_ident
 
 
 class Messenger:
@@ -51,6 +53,16 @@ class Messenger:
         # multithreaded access.
         self.lock = Lock()
 
+        # eventName->(acceptorDict, tuple of objMsgrIds), built on the first
+        # send after the listeners of the event change.  Events sent from
+        # the thread that created the messenger are dispatched from these
+        # without taking the lock.
+        self.__dispatchTables = {}
+        self._mainThreadId = get_ident()
+        self.fastDispatch = ConfigVariableBool('messenger-fast-dispatch', True,
+            "Dispatch events sent from the main thread from a cached table "
+            "of listeners, without taking the messenger lock.").getValue()
+
         if __debug__:
             self.__isWatching=0
             self.__watching={}
@@ -157,6 +169,7 @@ class Messenger:
         self.lock.acquire()
         try:
             acceptorDict = self.__callbacks.setdefault(event, {})
+            self.__dispatchTables.pop(event, None)
 
             id = self._getMessengerId(object)
 
@@ -203,6 +216,7 @@ class Messenger:
             # If this object is there, delete it from the dictionary
             if acceptorDict and id in acceptorDict:
                 del acceptorDict[id]
+                self.__dispatchTables.pop(event, None)
                 # If this dictionary is now empty, remove the event
                 # entry from the Messenger alltogether
                 if (len(acceptorDict) == 0):
@@ -240,6 +254,7 @@ class Messenger:
                     # If this object is there, delete it from the dictionary
                     if acceptorDict and id in acceptorDict:
                         del acceptorDict[id]
+                        self.__dispatchTables.pop(event, None)
                         # If this dictionary is now empty, remove the event
                         # entry from the Messenger alltogether
                         if (len(acceptorDict) == 0):
@@ -314,6 +329,17 @@ class Messenger:
                 'sent event: %s sentArgs = %s, taskChain = %s' % (
                 event, sentArgs, taskChain))
 
+        if taskChain is None and self.fastDispatch and \
+                get_ident() == self._mainThreadId and \
+                not (__debug__ and self.__isWatching):
+            table = self.__dispatchTables.get(event)
+            if table is None:
+                table = self.__buildDispatchTable(event)
+                if table is None:
+                    return
+            self.__fastDispatch(event, sentArgs, *table)
+            return
+
         self.lock.acquire()
         try:
             foundWatch=0
@@ -349,6 +375,61 @@ class Messenger:
         finally:
             self.lock.release()
 
+    def __buildDispatchTable(self, event):
+        self.lock.acquire()
+        try:
+            acceptorDict = self.__callbacks.get(event)
+            if not acceptorDict:
+                return None
+            table = (acceptorDict, tuple(acceptorDict.keys()))
+            self.__dispatchTables[event] = table
+            return table
+        finally:
+            self.lock.release()
+
+    def __fastDispatch(self, event, sentArgs, acceptorDict, ids):
+        # Same as __dispatch(), except that the lock is only held while a
+        # one-shot listener is removed.  The table is never modified, so
+        # accepts and ignores made by the handlers are safe.
+        for id in ids:
+            # A previous handler may have removed this one.
+            callInfo = acceptorDict.get(id)
+            if callInfo:
+                method, extraArgs, persistent = callInfo
+                if not persistent:
+                    self.lock.acquire()
+                    try:
+                        self.__removeOneShot(event, id, acceptorDict)
+                    finally:
+                        self.lock.release()
+
+                result = method(*extraArgs, *sentArgs)
+
+                if hasattr(result, 'cr_await'):
+                    # It's a coroutine, so schedule it with the task manager.
+                    if not self.taskMgr:
+                        from direct.task import TaskManagerGlobal
+                        self.taskMgr = TaskManagerGlobal.taskMgr
+                    self.taskMgr.add(result)
+
+    def __removeOneShot(self, event, id, acceptorDict):
+        # assumes lock is held.
+        # This object is no longer listening for this event
+        eventDict = self.__objectEvents.get(id)
+        if eventDict and event in eventDict:
+            del eventDict[event]
+            if (len(eventDict) == 0):
+                del self.__objectEvents[id]
+            self._releaseObject(self._getObject(id))
+
+        del acceptorDict[id]
+        self.__dispatchTables.pop(event, None)
+        # If the dictionary at this event is now empty, remove
+        # the event entry from the Messenger altogether
+        if (event in self.__callbacks \
+                and (len(self.__callbacks[event]) == 0)):
+            del self.__callbacks[event]
+
     def __taskChainDispatch(self, taskChain, task):
         """ This task is spawned each time an event is sent across
         task chains.  Its job is to empty the task events on the queue
@@ -394,20 +475,7 @@ class Messenger:
                 # If this object was only accepting this event once,
                 # remove it from the dictionary
                 if not persistent:
-                    # This object is no longer listening for this event
-                    eventDict = self.__objectEvents.get(id)
-                    if eventDict and event in eventDict:
-                        del eventDict[event]
-                        if (len(eventDict) == 0):
-                            del self.__objectEvents[id]
-                        self._releaseObject(self._getObject(id))
-
-                    del acceptorDict[id]
-                    # If the dictionary at this event is now empty, remove
-                    # the event entry from the Messenger altogether
-                    if (event in self.__callbacks \
-                            and (len(self.__callbacks[event]) == 0)):
-                        del self.__callbacks[event]
+                    self.__removeOneShot(event, id, acceptorDict)
 
                 if __debug__:
                     if foundWatch:
@@ -448,6 +516,7 @@ class Messenger:
         self.lock.acquire()
         try:
             self.__callbacks.clear()
+            self.__dispatchTables.clear()
             self.__objectEvents.clear()
             self._id2object.clear()
         finally:
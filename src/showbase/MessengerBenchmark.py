@@ -0,0 +1,85 @@
+"""
+Times Messenger.send() on the fast dispatch path, from cached listener
+tables without the lock, against the locked path it takes when
+messenger-fast-dispatch is off.
+
+Run it as a script:
+    python -m direct.showbase.MessengerBenchmark --sends 100000
+"""
+
+from .Messenger import Messenger
+
+import argparse
+import timeit
+
+class Listener:
+
+    def __init__(self):
+        self.calls = 0
+
+    def handle(self, *args):
+        self.calls += 1
+
+def makeMessenger(fastDispatch):
+    messenger = Messenger()
+    messenger.fastDispatch = fastDispatch
+    return messenger
+
+def timeSends(fastDispatch, numListeners, extraArgs, sentArgs, numSends, repeat):
+    """
+    Returns the fastest time of numSends sends of an event that numListeners
+    listeners accept.
+    """
+    messenger = makeMessenger(fastDispatch)
+    listeners = [Listener() for _ in range(numListeners)]
+    for listener in listeners:
+        messenger.accept('event', listener, listener.handle, extraArgs)
+
+    send = messenger.send
+    def run():
+        for _ in range(numSends):
+            send('event', sentArgs)
+    return min(timeit.repeat(run, number = 1, repeat = repeat))
+
+def timeOneShots(fastDispatch, numListeners, numSends, repeat):
+    """
+    Returns the fastest time of numSends sends of an event that numListeners
+    listeners accept once each, accepting it again before every send, which
+    rebuilds the fast path's table every time.
+    """
+    messenger = makeMessenger(fastDispatch)
+    listeners = [Listener() for _ in range(numListeners)]
+
+    accept = messenger.accept
+    send = messenger.send
+    def run():
+        for _ in range(numSends):
+            for listener in listeners:
+                accept('event', listener, listener.handle, [], 0)
+            send('event')
+    return min(timeit.repeat(run, number = 1, repeat = repeat))
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__.strip().splitlines()[0])
+    parser.add_argument('--sends', type = int, default = 100000)
+    parser.add_argument('--repeat', type = int, default = 5,
+                        help = "runs of each test, the fastest is reported")
+    args = parser.parse_args()
+
+    cases = [("no listeners", lambda fast: timeSends(fast, 0, [], [], args.sends, args.repeat)),
+             ("1 listener", lambda fast: timeSends(fast, 1, [], [], args.sends, args.repeat)),
+             ("5 listeners", lambda fast: timeSends(fast, 5, [], [], args.sends, args.repeat)),
+             ("20 listeners", lambda fast: timeSends(fast, 20, [], [], args.sends, args.repeat)),
+             ("5 with args", lambda fast: timeSends(fast, 5, [1, 2], [3], args.sends, args.repeat)),
+             ("5 one-shot", lambda fast: timeOneShots(fast, 5, args.sends, args.repeat))]
+
+    print("%-14s %14s %14s %8s" % ('', 'locked us/send', 'fast us/send', 'speedup'))
+    for name, case in cases:
+        locked = case(False)
+        fast = case(True)
+        print("%-14s %14.3f %14.3f %7.2fx" %
+              (name, locked * 1e6 / args.sends, fast * 1e6 / args.sends,
+               locked / fast if fast else 0.0))
+
+if __name__ == '__main__':
+    main()
@@ -141,6 +141,26 @@ class TaskManager:
             session = None,
             )
 
+        self._taskAccounting = None
+        if ConfigVariableBool('task-accounting', False,
+                "Keep rolling statistics of the time taken by each task "
+                "and task chain.  This adds a Python call and a lock to "
+                "every run of a task.").getValue():
+            TA = importlib.import_module('direct.task.TaskAccounting')
+            self._taskAccounting = TA.TaskAccounting(
+                self,
+                history = ConfigVariableInt('task-accounting-history', 300,
+                    "Number of frames of task timing to keep.").getValue(),
+                budget = ConfigVariableDouble('task-watchdog-budget', 0.0,
+                    "Log tasks that take longer than this many milliseconds "
+                    "in a frame, or 0 to disable.").getValue() / 1000.0,
+                stackDump = ConfigVariableBool('task-watchdog-stack-dump', False,
+                    "Also log the stack of the main thread while a task runs "
+                    "over the watchdog budget.").getValue(),
+                warnInterval = ConfigVariableDouble('task-watchdog-warn-interval', 10.0,
+                    "Log each task that runs over the watchdog budget at most "
+                    "once per this many seconds.").getValue())
+
     def finalInit(self):
         # This function should be called once during startup, after
         # most things are imported.
@@ -156,6 +176,9 @@ class TaskManager:
         self.notify.info("TaskManager.destroy()")
         self.destroyed = True
         self._frameProfileQueue.clear()
+        if self._taskAccounting:
+            self._taskAccounting.destroy()
+            self._taskAccounting = None
         self.mgr.cleanup()
 
     def setClock(self, clockObject):
@@ -393,6 +416,7 @@ class TaskManager:
         return task
 
     def __setupTask(self, funcOrTask, name, priority, sort, extraArgs, taskChain, appendTask, owner, uponDeath):
+        timed = False
         if isinstance(funcOrTask, AsyncTask):
             task = funcOrTask
         elif hasattr(funcOrTask, '__call__') or \
@@ -400,6 +424,9 @@ class TaskManager:
                 type(funcOrTask) == types.GeneratorType:
             # It's a function, coroutine, or something emulating a coroutine.
             task = PythonTask(funcOrTask)
+            # Only plain functions can be timed; coroutines are resumed by
+            # the task, not called.
+            timed = hasattr(funcOrTask, '__call__')
             if name is None:
                 name = getattr(funcOrTask, '__qualname__', None) or \
                        getattr(funcOrTask, '__name__', None)
@@ -440,6 +467,10 @@ class TaskManager:
         if uponDeath is not None:
             task.setUponDeath(uponDeath)
 
+        if timed and self._taskAccounting:
+            task.setFunction(self._taskAccounting.wrap(
+                funcOrTask, task.getName(), taskChain))
+
         return task
 
     def remove(self, taskOrName):
@@ -488,6 +519,9 @@ class TaskManager:
 
         self.mgr.poll()
 
+        if self._taskAccounting:
+            self._taskAccounting.collect()
+
         # This is the spot for an internal yield function
         nextTaskTime = self.mgr.getNextWakeTime()
         self.doYield(startFrameTime, nextTaskTime)
@@ -588,13 +622,20 @@ class TaskManager:
             return 0
 
         method = task.getFunction()
+        timedFunction = None
+        if self._taskAccounting and self._taskAccounting.isTimed(method):
+            timedFunction = method
+            method = timedFunction.function
         if (type(method) == types.MethodType):
             function = method.__func__
         else:
             function = method
         if (function == oldMethod):
             newMethod = types.MethodType(newFunction, method.__self__)
-            task.setFunction(newMethod)
+            if timedFunction:
+                timedFunction.function = newMethod
+            else:
+                task.setFunction(newMethod)
             # Found a match
             return 1
         return 0
@@ -669,6 +710,47 @@ class TaskManager:
         if self._taskProfiler:
             self._taskProfiler.flush(name)
 
+    def getTaskFunction(self, task):
+        """ Returns the function of the task.  Unlike task.getFunction(),
+        this sees through the wrapper that times the task when
+        task-accounting is on. """
+        function = task.getFunction()
+        if self._taskAccounting:
+            function = self._taskAccounting.unwrap(function)
+        return function
+
+    def getTaskStats(self, name):
+        """ Returns the rolling timing statistics of the named task, as a
+        dictionary of count, total, mean, p50, p90, p99 and max seconds per
+        frame, or None if it hasn't run or task-accounting is off. """
+        if self._taskAccounting:
+            return self._taskAccounting.getTaskStats(name)
+        return None
+
+    def getTaskChainStats(self, chainName):
+        """ Returns the rolling timing statistics of all the tasks on the
+        named task chain, like getTaskStats(). """
+        if self._taskAccounting:
+            return self._taskAccounting.getChainStats(chainName)
+        return None
+
+    def getTopTasks(self, n=10, key='total'):
+        """ Returns a list of (name, stats) of the n tasks with the highest
+        value of the indicated statistic. """
+        if self._taskAccounting:
+            return self._taskAccounting.getTopTasks(n, key)
+        return []
+
+    def getTaskReport(self, n=10, key='total'):
+        """ Returns a report of the n most expensive tasks. """
+        if self._taskAccounting:
+            return self._taskAccounting.getReport(n, key)
+        return ''
+
+    def resetTaskStats(self):
+        if self._taskAccounting:
+            self._taskAccounting.resetStats()
+
     def _setProfileTask(self, task):
         if self._taskProfileInfo.session:
             self._taskProfileInfo.session.release()
@@ -0,0 +1,327 @@
+from direct.directnotify.DirectNotifyGlobal import directNotify
+from panda3d.core import Thread
+from collections import deque
+import sys
+import time
+from time import perf_counter
+import threading
+import traceback
+
+class TimedTaskFunction:
+    """
+    Stands in for the function of a task, and tells the TaskAccounting how
+    long each call of it took.  This is what task.getFunction() returns for
+    a timed task; use TaskManager.getTaskFunction() to get the task's own
+    function.
+    """
+
+    __slots__ = ('function', 'name', 'chain', 'accounting')
+
+    def __init__(self, function, name, chain, accounting):
+        self.function = function
+        self.name = name
+        self.chain = chain
+        self.accounting = accounting
+
+    def __call__(self, *args):
+        start = perf_counter()
+        try:
+            return self.function(*args)
+        finally:
+            self.accounting.record(self.name, self.chain, perf_counter() - start)
+
+    def __repr__(self):
+        return repr(self.function)
+
+class TaskAccounting:
+    """
+    Keeps rolling statistics of the time the task manager's tasks take, per
+    task name and per task chain.  The TaskManager wraps the function of
+    each task it creates from a function in a TimedTaskFunction, which times
+    every call, and the time of all tasks sharing a name is added together
+    per frame.  Coroutine tasks and tasks that were created as AsyncTask
+    objects aren't timed.
+
+    Each timed call goes through an extra Python frame and takes a lock to
+    add up its time.  That cost isn't part of the recorded task times; it
+    is measured once up front and reported by getReport() along with the
+    number of calls per frame it was paid for.  This is why accounting is
+    off unless task-accounting is set.
+
+    With a watchdog budget set, a task that takes longer than the budget is
+    logged, at most once per task every warnInterval seconds.  If the stack
+    dump is enabled as well, a thread checks on the task running on the
+    main thread, and logs the stack of the main thread once a task has been
+    running for longer than the budget, which shows what a task that hangs
+    is stuck on.  The stack dump requires true threads.
+    """
+
+    notify = directNotify.newCategory("TaskAccounting")
+
+    def __init__(self, taskMgr, history = 300, budget = 0.0, stackDump = False,
+                 warnInterval = 10.0):
+        self.taskMgr = taskMgr
+        self.history = history
+        self.budget = budget
+        self.warnInterval = warnInterval
+
+        self.resetStats()
+
+        # name -> seconds spent so far this frame, by task and by chain.
+        # Swapped out for new ones every frame by collect().  Tasks on
+        # threaded task chains record into these too, so they are only
+        # touched with the lock held.
+        self._lock = threading.Lock()
+        self._frameTaskTimes = {}
+        self._frameChainTimes = {}
+        self._frameCalls = 0
+
+        # Seconds each timed call costs on top of the task itself.
+        self.callOverhead = self._measureCallOverhead()
+
+        # name -> [time of the last warning, warnings suppressed since]
+        self._lastWarnings = {}
+
+        self._watchdogThread = None
+        self._watchdogRunning = False
+        if stackDump and budget > 0.0:
+            self.startWatchdog()
+
+    def destroy(self):
+        self.stopWatchdog()
+
+    def resetStats(self):
+        """ Forgets all of the samples gathered so far. """
+        # name -> deque of seconds per frame the task ran.
+        self.taskSamples = {}
+        # chain name -> deque of seconds per frame.
+        self.chainSamples = {}
+        # Number of timed calls per frame.
+        self.callSamples = deque(maxlen = self.history)
+
+    def _measureCallOverhead(self, numCalls = 2000):
+        """
+        Returns the median time of a timed call of a function that does
+        nothing, measured around the whole call like the caller sees it.
+        """
+        timed = TimedTaskFunction(lambda: None, 'overhead', 'default', self)
+        times = []
+        for _ in range(numCalls):
+            start = perf_counter()
+            timed()
+            times.append(perf_counter() - start)
+
+        # Forget the calls themselves.
+        with self._lock:
+            self._frameTaskTimes = {}
+            self._frameChainTimes = {}
+            self._frameCalls = 0
+
+        times.sort()
+        return times[len(times) // 2]
+
+    def wrap(self, function, name, chain):
+        """ Returns a stand-in for the task function that times its calls. """
+        return TimedTaskFunction(function, name, chain or 'default', self)
+
+    @staticmethod
+    def isTimed(function):
+        return isinstance(function, TimedTaskFunction)
+
+    @staticmethod
+    def unwrap(function):
+        """ Returns the task's own function if this is a TimedTaskFunction. """
+        if isinstance(function, TimedTaskFunction):
+            return function.function
+        return function
+
+    def record(self, name, chain, dt):
+        """
+        Adds a call of the named task to this frame's time.  May be called
+        from any thread.
+        """
+        message = None
+        with self._lock:
+            taskTimes = self._frameTaskTimes
+            taskTimes[name] = taskTimes.get(name, 0.0) + dt
+            chainTimes = self._frameChainTimes
+            chainTimes[chain] = chainTimes.get(chain, 0.0) + dt
+            self._frameCalls += 1
+
+            if self.budget > 0.0 and dt > self.budget:
+                message = self._checkWarning(
+                    name, "Task %s on chain %s took %.2f ms, budget is %.2f ms" %
+                    (name, chain, dt * 1000.0, self.budget * 1000.0))
+
+        if message:
+            self.notify.warning(message)
+
+    def _checkWarning(self, name, message):
+        """
+        Returns the message to log, or None if the task was already warned
+        about in the last warnInterval.  Called with the lock held.
+        """
+        now = perf_counter()
+        last = self._lastWarnings.get(name)
+        if last is not None and now - last[0] < self.warnInterval:
+            last[1] += 1
+            return None
+        if last is not None and last[1]:
+            message += " (%i more warnings suppressed)" % (last[1])
+        self._lastWarnings[name] = [now, 0]
+        return message
+
+    def collect(self):
+        """
+        Adds the time of the tasks that ran since the last call to their
+        histories.  Called by the TaskManager once per frame.
+        """
+        with self._lock:
+            taskTimes = self._frameTaskTimes
+            chainTimes = self._frameChainTimes
+            calls = self._frameCalls
+            self._frameTaskTimes = {}
+            self._frameChainTimes = {}
+            self._frameCalls = 0
+
+        self.callSamples.append(calls)
+
+        for name, dt in taskTimes.items():
+            samples = self.taskSamples.get(name)
+            if samples is None:
+                samples = deque(maxlen = self.history)
+                self.taskSamples[name] = samples
+            samples.append(dt)
+
+        for chain, dt in chainTimes.items():
+            samples = self.chainSamples.get(chain)
+            if samples is None:
+                samples = deque(maxlen = self.history)
+                self.chainSamples[chain] = samples
+            samples.append(dt)
+
+    @staticmethod
+    def _makeStats(samples):
+        ordered = sorted(samples)
+        count = len(ordered)
+        def percentile(p):
+            return ordered[min(count - 1, int(p * count))]
+        total = sum(ordered)
+        return {'count': count,
+                'total': total,
+                'mean': total / count,
+                'p50': percentile(0.5),
+                'p90': percentile(0.9),
+                'p99': percentile(0.99),
+                'max': ordered[-1]}
+
+    def getTaskStats(self, name):
+        """
+        Returns a dictionary of the count, total, mean, 50th, 90th and 99th
+        percentile and max time in seconds of the frames that the named
+        task ran in, over the history, or None if it hasn't run.
+        """
+        samples = self.taskSamples.get(name)
+        if not samples:
+            return None
+        return self._makeStats(samples)
+
+    def getChainStats(self, chain):
+        """ Same as getTaskStats(), for all the tasks on the named chain. """
+        samples = self.chainSamples.get(chain)
+        if not samples:
+            return None
+        return self._makeStats(samples)
+
+    def getTopTasks(self, n = 10, key = 'total'):
+        """
+        Returns a list of (name, stats) of the n tasks with the highest value
+        of the indicated statistic.
+        """
+        stats = [(name, self._makeStats(samples))
+                 for name, samples in self.taskSamples.items() if samples]
+        stats.sort(key = lambda item: item[1][key], reverse = True)
+        return stats[:n]
+
+    def getOverhead(self):
+        """
+        Returns the mean number of timed calls per frame and the seconds per
+        frame they cost on top of the tasks themselves.
+        """
+        if not self.callSamples:
+            return 0.0, 0.0
+        calls = sum(self.callSamples) / len(self.callSamples)
+        return calls, calls * self.callOverhead
+
+    def getReport(self, n = 10, key = 'total'):
+        """ Returns a report of the n most expensive tasks. """
+        calls, overhead = self.getOverhead()
+        lines = ["accounting: %.1f timed calls per frame, %.3f us each, %.3f ms per frame" %
+                 (calls, self.callOverhead * 1000000, overhead * 1000)]
+        for name, s in self.getTopTasks(n, key):
+            lines.append("%s: %i frames, total %.2f ms, mean %.3f ms, p50 %.3f ms, "
+                         "p90 %.3f ms, p99 %.3f ms, max %.3f ms" %
+                         (name, s['count'], s['total'] * 1000, s['mean'] * 1000,
+                          s['p50'] * 1000, s['p90'] * 1000, s['p99'] * 1000,
+                          s['max'] * 1000))
+        return "\n".join(lines)
+
+    def startWatchdog(self):
+        if self._watchdogThread:
+            return
+        if not Thread.isTrueThreads():
+            self.notify.warning("Can't dump stacks of slow tasks without true threads")
+            return
+
+        self._watchdogRunning = True
+        self._watchdogThread = threading.Thread(target = self._watchdog,
+                                                name = "TaskAccounting-watchdog")
+        self._watchdogThread.daemon = True
+        self._watchdogThread.start()
+
+    def stopWatchdog(self):
+        if not self._watchdogThread:
+            return
+        self._watchdogRunning = False
+        self._watchdogThread.join()
+        self._watchdogThread = None
+
+    def _watchdog(self):
+        mainThread = Thread.getMainThread()
+        mainIdent = threading.main_thread().ident
+        clock = self.taskMgr.globalClock
+        watching = None
+        startTime = 0.0
+        dumped = False
+        # name -> time of the last stack dump
+        lastDumps = {}
+
+        while self._watchdogRunning:
+            time.sleep(self.budget * 0.5)
+
+            task = mainThread.getCurrentTask()
+            if task is None:
+                watching = None
+                continue
+
+            # The same task in a later frame is a new run.
+            key = (task.getTaskId(), clock.getFrameCount())
+            now = perf_counter()
+            if key != watching:
+                watching = key
+                startTime = now
+                dumped = False
+                continue
+
+            if not dumped and now - startTime > self.budget:
+                dumped = True
+                name = task.getName()
+                last = lastDumps.get(name)
+                if last is not None and now - last < self.warnInterval:
+                    # Only dumps each task's stack once every warnInterval.
+                    continue
+                lastDumps[name] = now
+                frame = sys._current_frames().get(mainIdent)
+                stack = ''.join(traceback.format_stack(frame)) if frame else ''
+                self.notify.warning("Task %s has been running for over %.2f ms:\n%s" %
+                                    (name, self.budget * 1000.0, stack))